@@ -34,8 +34,7 @@ export default function CreateInvoicePage() {
         const data = await shipmentsApi.getById(Number(shipmentId))
         
         // Check if shipment already has an invoice
-        const invoices = await invoicesApi.getAll()
-        const hasInvoice = invoices.some((inv: any) => inv.shipments.includes(Number(shipmentId)))
+        const hasInvoice = Boolean(await invoicesApi.getByShipment(Number(shipmentId)))
         
         if (hasInvoice) {
           alert('Cette expédition a déjà une facture')
@@ -1,28 +1,14 @@
 "use client"
 
-import { useState, useEffect } from "react"
 import { useRouter } from "next/navigation"
 import BackButton from "@/components/layout/back-button"
+import LoadMoreButton from "@/components/layout/load-more-button"
 import { invoicesApi } from "@/lib/api"
+import { usePages } from "@/hooks/usePages"
 
 export default function InvoicesPage() {
   const router = useRouter()
-  const [invoices, setInvoices] = useState([])
-  const [loading, setLoading] = useState(true)
-
-  useEffect(() => {
-    async function fetchInvoices() {
-      try {
-        const data = await invoicesApi.getAll()
-        setInvoices(data)
-      } catch (error) {
-        console.error('Failed to fetch invoices:', error)
-      } finally {
-        setLoading(false)
-      }
-    }
-    fetchInvoices()
-  }, [])
+  const { items: invoices, loading, hasMore, loadMore } = usePages(() => invoicesApi.getPages())
 
   return (
     <div className="space-y-6">
@@ -30,7 +16,7 @@ export default function InvoicesPage() {
 
       <h1 className="text-3xl font-bold text-foreground">Invoices</h1>
 
-      {loading ? (
+      {loading && invoices.length === 0 ? (
         <div className="text-center py-8">Loading invoices...</div>
       ) : invoices.length === 0 ? (
         <div className="text-center py-8 text-muted-foreground">No invoices found</div>
@@ -92,6 +78,8 @@ export default function InvoicesPage() {
         </table>
       </div>
       )}
+
+      <LoadMoreButton hasMore={hasMore} loading={loading} onClick={loadMore} />
     </div>
   )
 }
@@ -1,35 +1,21 @@
 "use client"
 
-import { useState, useEffect } from "react"
 import { useRouter } from "next/navigation"
 import BackButton from "@/components/layout/back-button"
+import LoadMoreButton from "@/components/layout/load-more-button"
 import { incidentsApi } from "@/lib/api"
+import { usePages } from "@/hooks/usePages"
 
 export default function IncidentsPage() {
   const router = useRouter()
-  const [incidents, setIncidents] = useState([])
-  const [loading, setLoading] = useState(true)
-
-  useEffect(() => {
-    fetchIncidents()
-  }, [])
-
-  async function fetchIncidents() {
-    try {
-      const data = await incidentsApi.getAll()
-      setIncidents(data)
-    } catch (error) {
-      console.error('Failed to fetch incidents:', error)
-    } finally {
-      setLoading(false)
-    }
-  }
+  const { items: incidents, setItems: setIncidents, loading, hasMore, loadMore } = usePages(() => incidentsApi.getPages())
 
   async function handleResolve(id: number) {
     try {
       const incident = incidents.find((i: any) => i.id === id)
-      await incidentsApi.update(id, { ...incident, status: 'RESOLVED' })
-      fetchIncidents()
+      const updated = await incidentsApi.update(id, { ...incident, status: 'RESOLVED' })
+      // Swap the row in place rather than reloading every page seen so far
+      setIncidents(current => current.map((i: any) => i.id === id ? updated : i))
     } catch (error) {
       console.error('Failed to resolve incident:', error)
       alert('Échec de la résolution')
@@ -50,7 +36,7 @@ export default function IncidentsPage() {
         </button>
       </div>
 
-      {loading ? (
+      {loading && incidents.length === 0 ? (
         <div className="text-center py-8">Loading incidents...</div>
       ) : incidents.length === 0 ? (
         <div className="text-center py-8 text-muted-foreground">No incidents found</div>
@@ -105,6 +91,8 @@ export default function IncidentsPage() {
         </table>
       </div>
       )}
+
+      <LoadMoreButton hasMore={hasMore} loading={loading} onClick={loadMore} />
     </div>
   )
 }
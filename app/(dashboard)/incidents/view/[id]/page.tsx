@@ -19,9 +19,7 @@ export default function ViewIncidentPage() {
 
   async function fetchIncident() {
     try {
-      const incidents = await incidentsApi.getAll()
-      const found = incidents.find((i: any) => i.id === Number(id))
-      setIncident(found)
+      setIncident(await incidentsApi.getById(Number(id)))
     } catch (error) {
       console.error('Failed to fetch incident:', error)
     } finally {
@@ -6,6 +6,9 @@ import { Package, AlertCircle } from "lucide-react"
 import BackButton from "@/components/layout/back-button"
 import { shipmentsApi, incidentsApi, invoicesApi } from "@/lib/api"
 
+// Most open incidents and unpaid invoices listed here
+const NOTIFICATION_LIMIT = 50
+
 export default function NotificationsPage() {
   const router = useRouter()
   const [notifications, setNotifications] = useState<any[]>([])
@@ -17,10 +20,11 @@ export default function NotificationsPage() {
 
   async function fetchNotifications() {
     try {
+      // Newest first; older open incidents and unpaid invoices stay on their own pages
       const [shipments, incidents, invoices] = await Promise.all([
-        shipmentsApi.getAll(),
-        incidentsApi.getAll(),
-        invoicesApi.getAll()
+        shipmentsApi.getRecent(3),
+        incidentsApi.getRecent(NOTIFICATION_LIMIT, '?status=OPEN'),
+        invoicesApi.getRecent(NOTIFICATION_LIMIT, '?status__in=UNPAID,PARTIAL')
       ])
 
       const notifs: any[] = []
@@ -1,30 +1,16 @@
 "use client"
 
-import { useState, useEffect } from "react"
 import { useRouter } from "next/navigation"
 import BackButton from "@/components/layout/back-button"
+import LoadMoreButton from "@/components/layout/load-more-button"
 import { shipmentsApi } from "@/lib/api"
 import { useUser } from "@/hooks/useUser"
+import { usePages } from "@/hooks/usePages"
 
 export default function ShipmentsJournalPage() {
   const router = useRouter()
   const { user, can } = useUser()
-  const [shipments, setShipments] = useState([])
-  const [loading, setLoading] = useState(true)
-
-  useEffect(() => {
-    async function fetchShipments() {
-      try {
-        const data = await shipmentsApi.getAll()
-        setShipments(data)
-      } catch (error) {
-        console.error('Failed to fetch shipments:', error)
-      } finally {
-        setLoading(false)
-      }
-    }
-    fetchShipments()
-  }, [])
+  const { items: shipments, loading, hasMore, loadMore } = usePages(() => shipmentsApi.getPages())
 
   return (
     <div className="space-y-6">
@@ -42,7 +28,7 @@ export default function ShipmentsJournalPage() {
         )}
       </div>
 
-      {loading ? (
+      {loading && shipments.length === 0 ? (
         <div className="text-center py-8">Loading shipments...</div>
       ) : shipments.length === 0 ? (
         <div className="bg-card rounded-xl border border-border shadow-sm p-6">
@@ -98,6 +84,8 @@ export default function ShipmentsJournalPage() {
           </table>
         </div>
       )}
+
+      <LoadMoreButton hasMore={hasMore} loading={loading} onClick={loadMore} />
     </div>
   )
 }
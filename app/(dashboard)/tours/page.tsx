@@ -1,31 +1,17 @@
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState } from "react"
 import Link from "next/link"
 import { Truck, Calendar, MapPin, Fuel, Clock, AlertCircle } from "lucide-react"
 import BackButton from "@/components/layout/back-button"
+import LoadMoreButton from "@/components/layout/load-more-button"
 import { toursApi } from "@/lib/api"
+import { usePages } from "@/hooks/usePages"
 
 export default function ToursPage() {
-  const [tours, setTours] = useState<any[]>([])
-  const [loading, setLoading] = useState(true)
+  const { items: tours, loading, hasMore, loadMore } = usePages(() => toursApi.getPages())
   const [filter, setFilter] = useState("")
 
-  useEffect(() => {
-    fetchTours()
-  }, [])
-
-  const fetchTours = async () => {
-    try {
-      const data = await toursApi.getAll()
-      setTours(data)
-    } catch (error) {
-      console.error('Failed to fetch tours:', error)
-    } finally {
-      setLoading(false)
-    }
-  }
-
   const filteredTours = tours.filter(tour => 
     !filter || tour.status === filter
   )
@@ -58,7 +44,7 @@ export default function ToursPage() {
           </select>
         </div>
 
-        {loading ? (
+        {loading && tours.length === 0 ? (
           <p className="text-muted-foreground">Loading tours...</p>
         ) : filteredTours.length === 0 ? (
           <p className="text-muted-foreground">No tours found</p>
@@ -120,6 +106,8 @@ export default function ToursPage() {
           </div>
         )}
       </div>
+
+      <LoadMoreButton hasMore={hasMore} loading={loading} onClick={loadMore} />
     </div>
   )
 }
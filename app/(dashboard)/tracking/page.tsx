@@ -7,7 +7,7 @@ import { useSearchParams } from "next/navigation"
 import Link from "next/link"
 import { useRouter } from "next/navigation"
 import BackButton from "@/components/layout/back-button"
-import { shipmentsApi } from "@/lib/api"
+import { shipmentsApi, invoicesApi } from "@/lib/api"
 import { Button } from "@/components/ui/button"
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card"
 import { Badge } from "@/components/ui/badge"
@@ -61,21 +61,14 @@ export default function TrackingPage() {
   async function fetchShipment(tracking: string) {
     setLoading(true)
     try {
-      const shipments = await shipmentsApi.getAll()
-      const found = shipments.find((s: any) => s.tracking_number === tracking)
+      const found = await shipmentsApi.getByTrackingNumber(tracking)
       setShipment(found || null)
       
       // Fetch invoice if shipment found
       if (found) {
         try {
-          const invoiceRes = await fetch(`http://localhost:8000/api/invoices/`)
-          if (invoiceRes.ok) {
-            const invoices = await invoiceRes.json()
-            const relatedInvoice = invoices.find((inv: any) => 
-              inv.shipments.includes(found.id)
-            )
-            if (relatedInvoice) setInvoice(relatedInvoice)
-          }
+          const relatedInvoice = await invoicesApi.getByShipment(found.id)
+          if (relatedInvoice) setInvoice(relatedInvoice)
         } catch (error) {
           console.error('Failed to fetch invoice:', error)
         }
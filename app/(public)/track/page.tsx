@@ -2,7 +2,7 @@
 
 import { useState, useEffect } from "react"
 import { useSearchParams } from "next/navigation"
-import { Search, Package, MapPin, Calendar, User, FileText, DollarSign, Phone, Mail, MessageSquare, Send } from "lucide-react"
+import { Search, Package, MapPin, Calendar, User, DollarSign, Mail, MessageSquare, Send } from "lucide-react"
 import Link from "next/link"
 import { Button } from "@/components/ui/button"
 import { Input } from "@/components/ui/input"
@@ -17,7 +17,6 @@ export default function PublicTrackingPage() {
   const searchParams = useSearchParams()
   const [trackingNumber, setTrackingNumber] = useState("")
   const [shipment, setShipment] = useState<any>(null)
-  const [invoice, setInvoice] = useState<any>(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState("")
   const [showClaimForm, setShowClaimForm] = useState(false)
@@ -30,93 +29,25 @@ export default function PublicTrackingPage() {
   })
   const [claimSubmitted, setClaimSubmitted] = useState(false)
 
-  useEffect(() => {
-    const tracking = searchParams.get('tracking')
-    if (tracking) {
-      setTrackingNumber(tracking)
-      const fetchShipment = async () => {
-        setLoading(true)
-        setError("")
-        setShipment(null)
-        setInvoice(null)
-
-        try {
-          const shipmentRes = await fetch(`http://localhost:8000/api/shipments/?tracking_number=${tracking}`)
-          
-          if (!shipmentRes.ok) {
-            setError("Failed to connect to server")
-            return
-          }
-
-          const shipmentData = await shipmentRes.json()
-          
-          if (!shipmentData || shipmentData.length === 0) {
-            setError("Tracking number not found")
-            return
-          }
-
-          const foundShipment = shipmentData[0]
-          setShipment(foundShipment)
-
-          // Fetch invoice for this shipment
-          const invoiceRes = await fetch(`http://localhost:8000/api/invoices/`)
-          if (invoiceRes.ok) {
-            const invoices = await invoiceRes.json()
-            const relatedInvoice = invoices.find((inv: any) => 
-              inv.shipments.includes(foundShipment.id)
-            )
-            if (relatedInvoice) setInvoice(relatedInvoice)
-          }
-        } catch (err) {
-          console.error('Error:', err)
-          setError("Failed to fetch shipment details")
-        } finally {
-          setLoading(false)
-        }
-      }
-      fetchShipment()
-    }
-  }, [searchParams])
-
-  const handleTrack = async (e: React.FormEvent) => {
-    e.preventDefault()
-    if (!trackingNumber.trim()) return
-
+  const lookupShipment = async (tracking: string) => {
     setLoading(true)
     setError("")
     setShipment(null)
-    setInvoice(null)
 
     try {
-      // Fetch shipment details
-      const shipmentRes = await fetch(`http://localhost:8000/api/shipments/?tracking_number=${trackingNumber}`)
-      
-      if (!shipmentRes.ok) {
-        setError("Failed to connect to server")
-        return
-      }
+      // Public projection of the shipment and its history, served from the tracking cache
+      const res = await fetch(`http://localhost:8000/api/track/${encodeURIComponent(tracking)}/`)
 
-      const shipmentData = await shipmentRes.json()
-      console.log('API Response:', shipmentData)
-      
-      if (!shipmentData || shipmentData.length === 0) {
+      if (res.status === 404) {
         setError("Tracking number not found")
         return
       }
-
-      const foundShipment = shipmentData[0]
-      setShipment(foundShipment)
-
-      // Fetch invoice for this shipment
-      const invoiceRes = await fetch(`http://localhost:8000/api/invoices/`)
-      if (invoiceRes.ok) {
-        const invoices = await invoiceRes.json()
-        const relatedInvoice = invoices.find((inv: any) => 
-          inv.shipments.includes(foundShipment.id)
-        )
-        if (relatedInvoice) setInvoice(relatedInvoice)
+      if (!res.ok) {
+        setError("Failed to connect to server")
+        return
       }
 
+      setShipment(await res.json())
     } catch (err) {
       console.error('Error:', err)
       setError("Failed to fetch shipment details")
@@ -125,6 +56,20 @@ export default function PublicTrackingPage() {
     }
   }
 
+  useEffect(() => {
+    const tracking = searchParams.get('tracking')
+    if (tracking) {
+      setTrackingNumber(tracking)
+      lookupShipment(tracking)
+    }
+  }, [searchParams])
+
+  const handleTrack = async (e: React.FormEvent) => {
+    e.preventDefault()
+    if (!trackingNumber.trim()) return
+    await lookupShipment(trackingNumber)
+  }
+
   const handleClaimSubmit = async (e: React.FormEvent) => {
     e.preventDefault()
     // Simulate API call
@@ -184,7 +129,7 @@ export default function PublicTrackingPage() {
       <main className="max-w-4xl mx-auto px-6 py-12">
         <div className="text-center mb-8">
           <h2 className="text-4xl font-bold text-foreground mb-3">Track Your Shipment</h2>
-          <p className="text-muted-foreground">Enter your tracking number to view shipment details and invoice</p>
+          <p className="text-muted-foreground">Enter your tracking number to view shipment status and history</p>
         </div>
 
         {/* Search Form */}
@@ -253,7 +198,7 @@ export default function PublicTrackingPage() {
                     <MapPin className="w-5 h-5 text-primary mt-1" />
                     <div>
                       <p className="text-sm text-muted-foreground">Destination</p>
-                      <p className="font-semibold text-foreground">{shipment.destination_name || 'N/A'}</p>
+                      <p className="font-semibold text-foreground">{shipment.destination || 'N/A'}</p>
                     </div>
                   </div>
 
@@ -261,15 +206,15 @@ export default function PublicTrackingPage() {
                     <User className="w-5 h-5 text-primary mt-1" />
                     <div>
                       <p className="text-sm text-muted-foreground">Service Type</p>
-                      <p className="font-semibold text-foreground">{shipment.service_type_name || 'Standard'}</p>
+                      <p className="font-semibold text-foreground">{shipment.service_type || 'Standard'}</p>
                     </div>
                   </div>
                 </div>
 
-                {shipment.description && (
+                {shipment.is_international && shipment.destination_country && (
                   <div className="mt-6 pt-6 border-t border-border">
-                    <p className="text-sm text-muted-foreground mb-2">Description</p>
-                    <p className="text-foreground">{shipment.description}</p>
+                    <p className="text-sm text-muted-foreground mb-2">Destination Country</p>
+                    <p className="text-foreground">{shipment.destination_country}</p>
                   </div>
                 )}
 
@@ -286,82 +231,22 @@ export default function PublicTrackingPage() {
               </CardContent>
             </Card>
 
-            {/* Client Information */}
-            {shipment.client_name && (
+            {/* Status History */}
+            {shipment.history?.length > 0 && (
               <Card className="shadow-card">
                 <CardContent className="p-8">
-                  <h3 className="text-xl font-bold text-foreground mb-4">Client Information</h3>
-                  <div className="grid grid-cols-2 gap-6">
-                    <div className="flex items-start gap-3">
-                      <User className="w-5 h-5 text-primary mt-1" />
-                      <div>
-                        <p className="text-sm text-muted-foreground">Name</p>
-                        <p className="font-semibold text-foreground">{shipment.client_name}</p>
-                      </div>
-                    </div>
-                    {shipment.client_contact && (
-                      <div className="flex items-start gap-3">
-                        <Phone className="w-5 h-5 text-primary mt-1" />
-                        <div>
-                          <p className="text-sm text-muted-foreground">Contact</p>
-                          <p className="font-semibold text-foreground">{shipment.client_contact}</p>
-                        </div>
-                      </div>
-                    )}
-                  </div>
-                </CardContent>
-              </Card>
-            )}
-
-            {/* Invoice Details */}
-            {invoice && (
-              <Card className="shadow-card">
-                <CardContent className="p-8">
-                  <div className="flex items-center gap-3 mb-6">
-                    <FileText className="w-6 h-6 text-primary" />
-                    <h3 className="text-xl font-bold text-foreground">Invoice Details</h3>
-                  </div>
-
-                  <div className="space-y-4">
-                    <div className="flex justify-between items-center pb-3 border-b border-border">
-                      <span className="text-muted-foreground">Invoice Number</span>
-                      <span className="font-semibold text-foreground">#{invoice.id}</span>
-                    </div>
-
-                    <div className="flex justify-between items-center pb-3 border-b border-border">
-                      <span className="text-muted-foreground">Amount HT</span>
-                      <span className="font-semibold text-foreground">{invoice.amount_ht} DA</span>
-                    </div>
-
-                    <div className="flex justify-between items-center pb-3 border-b border-border">
-                      <span className="text-muted-foreground">TVA (19%)</span>
-                      <span className="font-semibold text-foreground">{invoice.tva} DA</span>
-                    </div>
-
-                    <div className="flex justify-between items-center pt-2">
-                      <span className="text-lg font-bold text-foreground">Total TTC</span>
-                      <span className="text-2xl font-bold text-primary">{invoice.amount_ttc} DA</span>
-                    </div>
-
-                    <div className="mt-6 pt-6 border-t border-border">
-                      <div className="flex justify-between items-center">
-                        <span className="text-muted-foreground">Payment Status</span>
-                        <span className={`px-4 py-2 rounded-full font-semibold ${
-                          invoice.status === 'PAID' ? 'bg-green-100 text-green-700 dark:bg-green-900/20 dark:text-green-400' :
-                          invoice.status === 'PARTIAL' ? 'bg-yellow-100 text-yellow-700 dark:bg-yellow-900/20 dark:text-yellow-400' :
-                          'bg-red-100 text-red-700 dark:bg-red-900/20 dark:text-red-400'
-                        }`}>
-                          {invoice.status === 'PAID' ? 'Payé' : 
-                           invoice.status === 'PARTIAL' ? 'Partiellement Payé' : 'Impayé'}
+                  <h3 className="text-xl font-bold text-foreground mb-4">History</h3>
+                  <div className="space-y-3">
+                    {shipment.history.map((entry: any, index: number) => (
+                      <div key={index} className="flex justify-between items-center pb-3 border-b border-border last:border-0 last:pb-0">
+                        <span className={`px-3 py-1 rounded-full text-sm font-semibold ${getStatusColor(entry.status)}`}>
+                          {getStatusText(entry.status)}
+                        </span>
+                        <span className="text-muted-foreground">
+                          {new Date(entry.timestamp).toLocaleString('fr-FR')}
                         </span>
                       </div>
-                      {invoice.status !== 'PAID' && (
-                        <div className="mt-3 flex justify-between items-center">
-                          <span className="text-muted-foreground">Remaining Balance</span>
-                          <span className="font-bold text-destructive">{invoice.amount_ttc - invoice.paid_amount} DA</span>
-                        </div>
-                      )}
-                    </div>
+                    ))}
                   </div>
                 </CardContent>
               </Card>
@@ -39,7 +39,7 @@ export default function HomePage() {
         return
       }
 
-      const shipmentData = await shipmentRes.json()
+      const shipmentData = (await shipmentRes.json()).results
       
       if (!shipmentData || shipmentData.length === 0) {
         setError('Tracking number not found. Please check and try again.')
@@ -0,0 +1,774 @@
+#!/usr/bin/env python
+"""
+Performance benchmarks for the logistics backend.
+
+Every run creates a throwaway test database (the same one `manage.py test`
+uses), seeds it with synthetic rows and drops it at the end, so db.sqlite3
+is never touched.
+
+Usage:
+    python benchmark.py dashboard --sizes 1000 10000 100000
+"""
+import os
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+import django
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'transport_system.settings')
+django.setup()
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connection, reset_queries, OperationalError
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.test.utils import setup_test_environment, teardown_test_environment, CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from logistics.models import (
+    User, Client, Driver, Vehicle, Destination, ServiceType, PricingRule, Shipment,
+    ShipmentStatusHistory, Tour, Invoice, Incident, DriverLocation, pricing_rule_index,
+)
+from logistics.pagination import DateIdCursorPagination
+from logistics.pricing import reprice_shipments
+from logistics.billing import run_billing
+from logistics.analytics import rebuild_monthly_stats
+from logistics.history import status_history_writer
+from logistics.tracking import ingest_fixes, tracking_page
+from logistics.loading import plan_loads
+from logistics.dispatching import dispatch
+from logistics.distances import DistanceMatrix, haversine_matrix
+from logistics.routing import distance_matrix, nearest_neighbour_route, route_length, solve_route, solve_zone
+from logistics.serializers import ShipmentSerializer
+
+BENCHMARKS = {}
+STATUSES = [choice for choice, _ in Shipment.Status.choices]
+
+
+def benchmark(name, file_db=False):
+    """
+    Register a scenario. `file_db` scenarios run on an SQLite file instead of
+    the in-memory test database, for locking behaviour across threads.
+    """
+    def register(func):
+        func.file_db = file_db
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def seed_reference_data():
+    """Create the small lookup tables every benchmark needs."""
+    destinations = [Destination.objects.create(name=f"Destination {i}", zone=f"Zone {i % 4}") for i in range(10)]
+    services = [ServiceType.objects.create(name=name) for name in ['Standard', 'Express', 'Economique']]
+    for dest in destinations:
+        for service in services:
+            PricingRule.objects.create(
+                destination=dest,
+                service_type=service,
+                base_tariff=Decimal('500.00'),
+                weight_rate=Decimal('25.00'),
+                volume_rate=Decimal('50.00'),
+            )
+    clients = [
+        Client.objects.create(name=f"Client {i}", address="Alger", contact_info=f"0555{i:06d}")
+        for i in range(20)
+    ]
+    drivers = [
+        Driver.objects.create(name=f"Driver {i}", license_number=f"{i:08d}", phone=f"0666{i:06d}")
+        for i in range(10)
+    ]
+    user = User.objects.create_user(username='bench', password='bench', role='ADMIN')
+    return {
+        'destinations': destinations,
+        'services': services,
+        'clients': clients,
+        'drivers': drivers,
+        'user': user,
+    }
+
+
+def seed_shipments(target, refs, batch_size=5000):
+    """Grow the shipment table to `target` rows with bulk inserts."""
+    start = Shipment.objects.count()
+    for offset in range(start, target, batch_size):
+        batch = []
+        for i in range(offset, min(offset + batch_size, target)):
+            batch.append(Shipment(
+                tracking_number=f"BENCH{i:09d}",
+                client=refs['clients'][i % len(refs['clients'])],
+                destination=refs['destinations'][i % len(refs['destinations'])],
+                service_type=refs['services'][i % len(refs['services'])],
+                driver=refs['drivers'][i % len(refs['drivers'])],
+                weight=Decimal(i % 50 + 1),
+                volume=Decimal(i % 7 + 1),
+                status=STATUSES[i % len(STATUSES)],
+                calculated_cost=Decimal('1000.00'),
+            ))
+        Shipment.objects.bulk_create(batch)
+
+
+def timed(func, repeat=5):
+    """Best wall-clock time of `repeat` calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(func):
+    """Run `func` once and return its peak Python heap allocation, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def count_queries(func):
+    """Run `func` once and return (result, number of SQL queries it issued)."""
+    # The query log is a bounded deque, so clear what seeding left behind first
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        result = func()
+    return result, len(queries)
+
+
+def api_client(refs):
+    client = APIClient()
+    client.force_authenticate(user=refs['user'])
+    return client
+
+
+@benchmark('dashboard')
+def bench_dashboard(sizes):
+    refs = seed_reference_data()
+    client = api_client(refs)
+    print(f"{'rows':>10} {'cold ms':>10} {'warm ms':>10} {'queries':>8} {'bytes':>8}")
+    for size in sizes:
+        seed_shipments(size, refs)
+
+        def cold():
+            cache.clear()
+            return client.get('/api/dashboard/summary/')
+
+        response, query_count = count_queries(cold)
+        cold_time = timed(cold)
+        warm_time = timed(lambda: client.get('/api/dashboard/summary/'))
+        print(f"{size:>10} {cold_time * 1000:>10.2f} {warm_time * 1000:>10.2f} "
+              f"{query_count:>8} {len(response.content):>8}")
+
+
+@benchmark('pagination')
+def bench_pagination(sizes):
+    """
+    First page vs. a page 90% deep into /api/shipments/, against serializing the
+    whole table the way the endpoint did before it was paginated.
+    The unpaginated baseline is skipped above 100k rows, where it takes minutes.
+    """
+    refs = seed_reference_data()
+    client = api_client(refs)
+    print(f"{'rows':>10} {'page':>6} {'ms':>10} {'peak KB':>10}")
+    for size in sizes:
+        seed_shipments(size, refs)
+        deep_row = Shipment.objects.order_by('-date', '-id')[size * 9 // 10]
+        cursor = DateIdCursorPagination().encode_cursor(deep_row)
+        cases = [
+            ('first', lambda: client.get('/api/shipments/')),
+            ('deep', lambda: client.get('/api/shipments/', {'cursor': cursor})),
+        ]
+        if size <= 100000:
+            cases.append(('all', lambda: ShipmentSerializer(Shipment.objects.all(), many=True).data))
+        for label, func in cases:
+            repeat = 1 if label == 'all' else 5
+            elapsed = timed(func, repeat=repeat)
+            peak = peak_memory(func)
+            print(f"{size:>10} {label:>6} {elapsed * 1000:>10.2f} {peak / 1024:>10.0f}")
+
+
+@benchmark('pricing')
+def bench_pricing(sizes):
+    """Shipment.calculate_cost throughput on unsaved instances, with the pricing index warm."""
+    refs = seed_reference_data()
+    print(f"{'rows':>10} {'ms':>10} {'rows/s':>12} {'queries':>8}")
+    for size in sizes:
+        shipments = [
+            Shipment(
+                destination=refs['destinations'][i % len(refs['destinations'])],
+                service_type=refs['services'][i % len(refs['services'])],
+                weight=Decimal(i % 50 + 1),
+                volume=Decimal(i % 7 + 1),
+                is_international=(i % 5 == 0),
+                requires_customs_clearance=(i % 10 == 0),
+                customs_value=Decimal(150000) if i % 20 == 0 else None,
+            )
+            for i in range(size)
+        ]
+        pricing_rule_index.invalidate()
+
+        def price_all():
+            for shipment in shipments:
+                shipment.calculate_cost()
+
+        _, query_count = count_queries(price_all)
+        elapsed = timed(price_all, repeat=3)
+        print(f"{size:>10} {elapsed * 1000:>10.2f} {size / elapsed:>12.0f} {query_count:>8}")
+
+
+@benchmark('reprice')
+def bench_reprice(sizes):
+    """
+    Per-row calculate_cost() + save(), as fix_services_invoices.py does, against
+    reprice_shipments(). The per-row path is only timed up to 20k rows.
+    """
+    refs = seed_reference_data()
+    print(f"{'rows':>10} {'per-row/s':>12} {'bulk/s':>12} {'speedup':>8}")
+    for size in sizes:
+        seed_shipments(size, refs)
+
+        def per_row():
+            for shipment in Shipment.objects.all():
+                shipment.calculated_cost = shipment.calculate_cost()
+                shipment.save()
+
+        per_row_rate = None
+        if size <= 20000:
+            Shipment.objects.update(calculated_cost=Decimal('1.00'))
+            per_row_rate = size / timed(per_row, repeat=1)
+        Shipment.objects.update(calculated_cost=Decimal('1.00'))
+        bulk_rate = size / timed(reprice_shipments, repeat=1)
+        speedup = f"{bulk_rate / per_row_rate:>7.1f}x" if per_row_rate else f"{'-':>8}"
+        per_row_text = f"{per_row_rate:>12.0f}" if per_row_rate else f"{'-':>12}"
+        print(f"{size:>10} {per_row_text} {bulk_rate:>12.0f} {speedup}")
+
+
+@benchmark('export')
+def bench_export(sizes):
+    """Time to first byte, total time and peak heap of /api/shipments/export/."""
+    refs = seed_reference_data()
+    client = api_client(refs)
+    print(f"{'rows':>10} {'format':>7} {'ttfb ms':>10} {'total ms':>10} {'MB':>8} {'peak KB':>10}")
+    for size in sizes:
+        seed_shipments(size, refs)
+        for export_format in ('csv', 'ndjson'):
+            def run():
+                started = time.perf_counter()
+                response = client.get('/api/shipments/export/', {'export_format': export_format})
+                chunks = iter(response.streaming_content)
+                size_bytes = len(next(chunks))
+                first_byte = time.perf_counter() - started
+                for chunk in chunks:
+                    size_bytes += len(chunk)
+                return first_byte, time.perf_counter() - started, size_bytes
+
+            first_byte, total, size_bytes = run()
+            peak = peak_memory(run)
+            print(f"{size:>10} {export_format:>7} {first_byte * 1000:>10.2f} {total * 1000:>10.2f} "
+                  f"{size_bytes / 1e6:>8.1f} {peak / 1024:>10.0f}")
+
+
+@benchmark('slips')
+def bench_slips(sizes):
+    """
+    Slips per second through /api/shipments/{id}/slip/: cold (empty document
+    cache), warm (cached bytes) and revalidated (If-None-Match -> 304).
+    `sizes` is the number of distinct shipments requested per pass.
+    """
+    refs = seed_reference_data()
+    client = api_client(refs)
+    print(f"{'slips':>10} {'cold/s':>10} {'warm/s':>10} {'304/s':>10}")
+    with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'documents': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+    }):
+        for size in sizes:
+            seed_shipments(size, refs)
+            ids = list(Shipment.objects.order_by('id').values_list('id', flat=True)[:size])
+            etags = {}
+
+            def fetch_all():
+                for pk in ids:
+                    etags[pk] = client.get(f'/api/shipments/{pk}/slip/')['ETag']
+
+            def revalidate_all():
+                for pk in ids:
+                    client.get(f'/api/shipments/{pk}/slip/', HTTP_IF_NONE_MATCH=etags[pk])
+
+            caches['documents'].clear()
+            cold = timed(fetch_all, repeat=1)
+            warm = timed(fetch_all, repeat=3)
+            revalidated = timed(revalidate_all, repeat=3)
+            print(f"{size:>10} {size / cold:>10.0f} {size / warm:>10.0f} {size / revalidated:>10.0f}")
+
+
+@benchmark('slip-batch')
+def bench_slip_batch(sizes):
+    """
+    One /api/shipments/slips/ request per batch size, one slip per page and as
+    label sheets, against the same number of single /slip/ calls.
+    """
+    refs = seed_reference_data()
+    client = api_client(refs)
+    seed_shipments(max(sizes), refs)
+    print(f"{'slips':>10} {'single (s)':>12} {'batch (s)':>12} {'sheet (s)':>12} {'queries':>8}")
+    # Rendered in the request at every size, as the document worker would render a queued batch
+    with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'documents': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+        'tracking': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    }, SLIP_BATCH_QUEUE_THRESHOLD=max(sizes)):
+        for size in sizes:
+            ids = list(Shipment.objects.order_by('id').values_list('id', flat=True)[:size])
+            url = '/api/shipments/slips/?ids=' + ','.join(map(str, ids))
+
+            def single():
+                caches['documents'].clear()
+                for pk in ids:
+                    client.get(f'/api/shipments/{pk}/slip/')
+
+            def batch(layout='page'):
+                b''.join(client.get(f'{url}&layout={layout}').streaming_content)
+
+            one_by_one = timed(single, repeat=1)
+            pages = timed(batch, repeat=3)
+            sheets = timed(lambda: batch('sheet'), repeat=3)
+            _, queries = count_queries(batch)
+            print(f"{size:>10} {one_by_one:>12.3f} {pages:>12.3f} {sheets:>12.3f} {queries:>8}")
+
+
+@benchmark('invoice-pdf')
+def bench_invoice_pdf(sizes):
+    """
+    /api/invoices/{id}/pdf/ for one invoice holding `size` shipments: pages,
+    cold render time and peak heap, and the cached response time.
+    """
+    refs = seed_reference_data()
+    client = api_client(refs)
+    seed_shipments(max(sizes), refs)
+    Through = Invoice.shipments.through
+    print(f"{'lines':>10} {'pages':>6} {'cold (s)':>10} {'peak MB':>8} {'cached (s)':>11}")
+    with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'documents': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+    }):
+        for size in sizes:
+            invoice = Invoice.objects.create(client=refs['clients'][0])
+            ids = Shipment.objects.order_by('id').values_list('id', flat=True)[:size]
+            Through.objects.bulk_create([Through(invoice_id=invoice.id, shipment_id=pk) for pk in ids], batch_size=5000)
+            invoice.calculate_totals()
+            url = f'/api/invoices/{invoice.id}/pdf/'
+
+            def cold():
+                caches['documents'].clear()
+                return client.get(url).content
+
+            pdf = cold()
+            pages = pdf.count(b'/Type /Page\n')
+            cold_time = timed(cold, repeat=3)
+            peak = peak_memory(cold)
+            cached = timed(lambda: client.get(url), repeat=5)
+            print(f"{size:>10} {pages:>6} {cold_time:>10.3f} {peak / 1e6:>8.1f} {cached:>11.4f}")
+
+
+@benchmark('billing')
+def bench_billing(sizes):
+    """
+    Month-end billing run over `size` uninvoiced shipments (20 clients):
+    dry run, then the real run that creates the invoices and links.
+    """
+    refs = seed_reference_data()
+    today = date.today()
+    start = today.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    print(f"{'shipments':>10} {'dry run (s)':>12} {'run (s)':>10} {'queries':>8} {'invoices':>9}")
+    for size in sizes:
+        seed_shipments(size, refs)
+        dry = timed(lambda: run_billing(start, end, dry_run=True), repeat=1)
+        started = time.perf_counter()
+        report, queries = count_queries(lambda: run_billing(start, end))
+        elapsed = time.perf_counter() - started
+        print(f"{size:>10} {dry:>12.3f} {elapsed:>10.3f} {queries:>8} {len(report['invoices']):>9}")
+        # Start the next size from an unbilled table again
+        Invoice.shipments.through.objects.all().delete()
+        Invoice.objects.all().delete()
+
+
+@benchmark('stats')
+def bench_stats(sizes):
+    """
+    /api/shipments/stats/ served from the monthly rollups, against the former
+    TruncMonth aggregates over the full tables. Also times a full rebuild.
+    """
+    def full_scan():
+        list(Shipment.objects.values('status').annotate(count=Count('status')))
+        list(Shipment.objects.annotate(month=TruncMonth('date')).values('month')
+             .annotate(revenue=Sum('calculated_cost')).order_by('month'))
+        list(Incident.objects.annotate(month=TruncMonth('date')).values('month')
+             .annotate(count=Count('id')).order_by('month'))
+
+    refs = seed_reference_data()
+    client = api_client(refs)
+    print(f"{'shipments':>10} {'scan (ms)':>10} {'rollup (ms)':>12} {'rebuild (s)':>12}")
+    for size in sizes:
+        seed_shipments(size, refs)
+        # bulk_create skips the rollup signals, so start from a rebuild
+        rebuild = timed(rebuild_monthly_stats, repeat=1)
+        scan = timed(full_scan)
+        rollup = timed(lambda: client.get('/api/shipments/stats/'))
+        print(f"{size:>10} {scan * 1000:>10.1f} {rollup * 1000:>12.1f} {rebuild:>12.2f}")
+
+
+@benchmark('drivers', file_db=True)
+def bench_drivers(sizes):
+    """
+    `size` simulated drivers, each on its own thread and connection, PATCHing
+    the status of their shipments at the same time. Runs with the stock SQLite
+    settings, with SQLITE_PERFORMANCE_OPTIONS, and with those plus coalesced
+    status history. Reports status updates per second and lock errors.
+    """
+    updates_per_driver = 50
+    refs = seed_reference_data()
+    drivers = []
+    for size in range(max(sizes)):
+        user = User.objects.create_user(username=f'driver{size}', password='driver', role='DRIVER')
+        driver = Driver.objects.get(user=user)
+        shipments = [
+            Shipment.objects.create(
+                tracking_number=f'DRV{size:03d}-{i}', client=refs['clients'][0],
+                destination=refs['destinations'][0], service_type=refs['services'][0],
+                driver=driver, weight=Decimal('5'), volume=Decimal('1'),
+            )
+            for i in range(5)
+        ]
+        drivers.append((user, [shipment.pk for shipment in shipments]))
+
+    def drive(user, shipment_ids, interval, errors):
+        # Each driver is a separate process, like the workers of a WSGI server
+        with override_settings(STATUS_HISTORY_COALESCE_INTERVAL=interval):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            failed = 0
+            for i in range(updates_per_driver):
+                pk = shipment_ids[i % len(shipment_ids)]
+                try:
+                    client.patch(f'/api/shipments/{pk}/', {'status': STATUSES[i % len(STATUSES)]}, format='json')
+                except OperationalError:
+                    failed += 1
+            if interval:
+                # Forked children skip atexit handlers
+                status_history_writer().flush()
+        errors.put(failed)
+
+    modes = [
+        ('stock', {}, 0),
+        ('tuned', settings.SQLITE_PERFORMANCE_OPTIONS, 0),
+        ('tuned+coalesced', settings.SQLITE_PERFORMANCE_OPTIONS, 0.2),
+    ]
+    context = multiprocessing.get_context('fork')
+    print(f"{'drivers':>8} {'mode':>16} {'updates/s':>10} {'lock errors':>12}")
+    # Stock settings first: WAL mode, once set, is stored in the database file
+    for mode, options, interval in modes:
+        connection.settings_dict['OPTIONS'] = options
+        for size in sizes:
+            # Children must open their own connections
+            connection.close()
+            errors = context.Queue()
+            processes = [
+                context.Process(target=drive, args=(user, shipment_ids, interval, errors))
+                for user, shipment_ids in drivers[:size]
+            ]
+            started = time.perf_counter()
+            for process in processes:
+                process.start()
+            failed = sum(errors.get() for _ in processes)
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - started
+            done = size * updates_per_driver - failed
+            print(f"{size:>8} {mode:>16} {done / elapsed:>10.0f} {failed:>12}")
+
+
+@benchmark('locations')
+def bench_locations(sizes):
+    """
+    GPS fixes for the 10 seeded drivers posted as NDJSON batches of 500 to
+    /api/drivers/locations/ (and through ingest_fixes directly), until the
+    track holds `size` fixes. Then times /api/driver-location/<tracking>/.
+    """
+    batch_size = 500
+    refs = seed_reference_data()
+    client = api_client(refs)
+    seed_shipments(10, refs)
+    Shipment.objects.update(status='IN_TRANSIT')
+    started_at = timezone.now() - timedelta(days=1)
+
+    def batch(offset):
+        return [
+            {'driver': refs['drivers'][i % 10].pk, 'recorded_at': (started_at + timedelta(seconds=i)).timestamp(),
+             'lat': 36.7 + (i % 1000) / 10000, 'lng': 3.05, 'speed': 40, 'heading': 90}
+            for i in range(offset, offset + batch_size)
+        ]
+
+    print(f"{'fixes':>10} {'api fixes/s':>12} {'direct fixes/s':>15} {'lookup (ms)':>12}")
+    for size in sizes:
+        offset = DriverLocation.objects.count()
+        half = offset + (size - offset) // 2
+        started = time.perf_counter()
+        for start in range(offset, half, batch_size):
+            body = '\n'.join(json.dumps(fix) for fix in batch(start))
+            client.post('/api/drivers/locations/', body, content_type='application/x-ndjson')
+        api_rate = (half - offset) / (time.perf_counter() - started)
+        started = time.perf_counter()
+        for start in range(half, size, batch_size):
+            ingest_fixes(batch(start))
+        direct_rate = (size - half) / (time.perf_counter() - started)
+        lookup = timed(lambda: client.get('/api/driver-location/BENCH000000003/'), repeat=50)
+        print(f"{size:>10} {api_rate:>12.0f} {direct_rate:>15.0f} {lookup * 1000:>12.2f}")
+
+
+@benchmark('routing')
+def bench_routing(sizes):
+    """
+    Route optimization on synthetic tours of `size` stops scattered over about
+    100 x 100 km (run with --sizes 50 200 500 2000): distance matrix, nearest
+    neighbour construction and the full 2-opt/Or-opt search, with the route
+    length before and after. Then four such zones solved one after the other
+    and on a pool of ROUTE_OPTIMIZER_WORKERS processes.
+    """
+    rng = random.Random(42)
+
+    def instance(size):
+        return [(36.3 + rng.random(), 2.6 + rng.random() * 1.1) for _ in range(size + 1)]
+
+    print(f"{'stops':>6} {'matrix (s)':>11} {'solve (s)':>10} {'nn (km)':>9} {'opt (km)':>9} {'gain':>6}"
+          f" {'4 zones (s)':>12} {'pool (s)':>9}")
+    for size in sizes:
+        points = instance(size)
+        started = time.perf_counter()
+        matrix = distance_matrix(points)
+        matrix_time = time.perf_counter() - started
+        constructed = route_length(nearest_neighbour_route(matrix), matrix)
+        started = time.perf_counter()
+        _, optimized = solve_route(matrix)
+        solve_time = time.perf_counter() - started
+
+        zones = [[(zone, points, [None] * len(points))] for zone, points in enumerate(instance(size) for _ in range(4))]
+        inline = timed(lambda: [solve_zone(problems) for problems in zones], repeat=1)
+        with ProcessPoolExecutor(max_workers=settings.ROUTE_OPTIMIZER_WORKERS) as pool:
+            pooled = timed(lambda: list(pool.map(solve_zone, zones)), repeat=1)
+        print(f"{size:>6} {matrix_time:>11.2f} {solve_time:>10.2f} {constructed:>9.0f} {optimized:>9.0f}"
+              f" {1 - optimized / constructed:>6.1%} {inline:>12.2f} {pooled:>9.2f}")
+
+
+@benchmark('distances')
+def bench_distances(sizes):
+    """
+    Destination distance matrix for `size` geocoded destinations: a pure
+    Python haversine loop (up to 2000 points) against the NumPy version,
+    building the memory-mapped file, appending 10 new destinations, single
+    pair lookups, and reading the block for a 500-stop tour.
+    """
+    def python_matrix(points):
+        radians = [(math.radians(lat), math.radians(lng)) for lat, lng in points]
+        return [
+            [2 * 6371.0088 * math.asin(math.sqrt(
+                math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+            )) for lat2, lng2 in radians]
+            for lat1, lng1 in radians
+        ]
+
+    rng = random.Random(7)
+    print(f"{'points':>7} {'python (s)':>11} {'numpy (s)':>10} {'build (s)':>10} {'+10 (ms)':>9}"
+          f" {'lookups/s':>10} {'500 block (ms)':>15} {'file (MB)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        matrix = DistanceMatrix(directory)
+        for size in sizes:
+            Destination.objects.bulk_create([
+                Destination(name=f'Geo {i}', zone=f'Zone {i % 4}',
+                            latitude=35 + rng.random() * 2, longitude=-1 + rng.random() * 8)
+                for i in range(Destination.objects.count(), size)
+            ])
+            points = list(Destination.objects.order_by('id').values_list('latitude', 'longitude'))
+            python = timed(lambda: python_matrix(points), repeat=1) if size <= 2000 else float('nan')
+            vectorized = timed(lambda: haversine_matrix(points, points), repeat=1)
+            build = timed(lambda: matrix.update(rebuild=True), repeat=1)
+            Destination.objects.bulk_create([
+                Destination(name=f'New {size}-{i}', latitude=36, longitude=3 + i / 100) for i in range(10)
+            ])
+            append = timed(matrix.update, repeat=1)
+            ids = list(Destination.objects.values_list('id', flat=True))
+            pairs = [(rng.choice(ids), rng.choice(ids)) for _ in range(100000)]
+            started = time.perf_counter()
+            for a, b in pairs:
+                matrix.distance(a, b)
+            lookups = len(pairs) / (time.perf_counter() - started)
+            tour = rng.sample(list(Destination.objects.values_list('id', 'latitude', 'longitude')), min(500, len(ids)))
+            block = timed(lambda: matrix.matrix([row[1:] for row in tour], [row[0] for row in tour]))
+            megabytes = os.path.getsize(matrix.distances_path) / 1e6
+            print(f"{size:>7} {python:>11.2f} {vectorized:>10.3f} {build:>10.2f} {append * 1000:>9.1f}"
+                  f" {lookups:>10.0f} {block * 1000:>15.1f} {megabytes:>10.1f}")
+
+
+@benchmark('loads')
+def bench_loads(sizes):
+    """
+    Load plan for `size` pending shipments (1-50 kg, 1-7 m3, 4 zones) over a
+    fleet of vans and trucks sized to carry about 20% more than the load.
+    Reports planning time (queries included), vehicles used and their mean
+    weight and volume utilization.
+    """
+    refs = seed_reference_data()
+    today = timezone.localdate()
+    print(f"{'shipments':>10} {'vehicles':>9} {'plan (s)':>9} {'used':>6} {'planned':>8} {'weight %':>9} {'volume %':>9}")
+    for size in sizes:
+        Shipment.objects.all().delete()
+        Vehicle.objects.all().delete()
+        seed_shipments(size, refs)
+        Shipment.objects.update(status=Shipment.Status.PENDING)
+        # Seeded shipments average 25.5 kg and 4 m3; two vans (400 kg / 12 m3) per truck (1500 kg / 40 m3)
+        fleet = int(size * 4 * 1.2 / ((2 * 12 + 40) / 3)) + 1
+        Vehicle.objects.bulk_create([
+            Vehicle(license_plate=f'{i:06d}-16', vehicle_type='Fourgon' if i % 3 else 'Camion',
+                    capacity=400 if i % 3 else 1500, volume_capacity=12 if i % 3 else 40)
+            for i in range(fleet)
+        ])
+        plan = None
+
+        def run():
+            nonlocal plan
+            plan = plan_loads(today)
+
+        elapsed = timed(run, repeat=3)
+        loads = plan['loads']
+        weight = sum(load['weight_utilization'] for load in loads) / max(len(loads), 1)
+        volume = sum(load['volume_utilization'] for load in loads) / max(len(loads), 1)
+        print(f"{size:>10} {fleet:>9} {elapsed:>9.2f} {len(loads):>6} {plan['planned']:>8} {weight:>9.1f} {volume:>9.1f}")
+
+
+@benchmark('dispatch')
+def bench_dispatch(sizes):
+    """
+    Dispatch of a day with `size` pending shipments: the load plan, driver
+    matching over one driver per vehicle with random last positions, and the
+    bulk writes of tours, links and driver assignments. Reports the dry run
+    and the real run, and the queries of the latter.
+    """
+    refs = seed_reference_data()
+    for i, destination in enumerate(refs['destinations']):
+        destination.latitude, destination.longitude = 35 + i * 0.2, -1 + i * 0.6
+    Destination.objects.bulk_update(refs['destinations'], ['latitude', 'longitude'])
+    rng = random.Random(7)
+    today = timezone.localdate()
+    print(f"{'shipments':>10} {'drivers':>8} {'dry run (s)':>12} {'dispatch (s)':>13} {'tours':>6} {'queries':>8}")
+    for size in sizes:
+        Tour.objects.all().delete()
+        Shipment.objects.all().delete()
+        Vehicle.objects.all().delete()
+        Driver.objects.exclude(id__in=[driver.id for driver in refs['drivers']]).delete()
+        seed_shipments(size, refs)
+        Shipment.objects.update(status=Shipment.Status.PENDING, driver=None)
+        # Seeded drivers stay but sit the day out, one fresh driver per vehicle
+        Driver.objects.update(status=Driver.Status.OFF_DUTY)
+        fleet = int(size * 4 * 1.2 / ((2 * 12 + 40) / 3)) + 1
+        Vehicle.objects.bulk_create([
+            Vehicle(license_plate=f'{i:06d}-16', vehicle_type='Fourgon' if i % 3 else 'Camion',
+                    capacity=400 if i % 3 else 1500, volume_capacity=12 if i % 3 else 40)
+            for i in range(fleet)
+        ])
+        drivers = Driver.objects.bulk_create([
+            Driver(name=f'Driver {i}', license_number=f'9{i:07d}', phone=f'0777{i:06d}') for i in range(fleet)
+        ])
+        now = timezone.now()
+        DriverLocation.objects.bulk_create([
+            DriverLocation(driver=driver, day=today, recorded_at=now,
+                           lat=rng.uniform(35, 37), lng=rng.uniform(-1, 5))
+            for driver in drivers
+        ])
+        dry_run = timed(lambda: dispatch(today, dry_run=True), repeat=3)
+        report = None
+
+        def run():
+            nonlocal report
+            report = dispatch(today)
+
+        with CaptureQueriesContext(connection) as queries:
+            elapsed = timed(run, repeat=1)
+        print(f"{size:>10} {fleet:>9} {dry_run:>12.2f} {elapsed:>13.2f} {len(report['tours']):>6} {len(queries):>8}")
+
+
+@benchmark('tracking')
+def bench_tracking(sizes):
+    """
+    Public tracking lookups per second for `size` distinct shipments with
+    three history rows each: the full /api/shipments/{id}/ record, then
+    /api/track/<tracking>/ cold (empty tracking cache) and warm, and
+    tracking_page() warm without the request cycle.
+    """
+    refs = seed_reference_data()
+    client = APIClient()
+    print(f"{'lookups':>10} {'retrieve/s':>11} {'cold/s':>10} {'warm/s':>10} {'direct/s':>10}")
+    for size in sizes:
+        seed_shipments(size, refs)
+        rows = list(Shipment.objects.order_by('id').values_list('id', 'tracking_number')[:size])
+        ShipmentStatusHistory.objects.all().delete()
+        ShipmentStatusHistory.objects.bulk_create([
+            ShipmentStatusHistory(shipment_id=pk, status=status)
+            for pk, _ in rows for status in ('PENDING', 'IN_TRANSIT', 'SORTING_CENTER')
+        ], batch_size=5000)
+
+        def retrieve_all():
+            for pk, _ in rows:
+                client.get(f'/api/shipments/{pk}/')
+
+        def track_all():
+            for _, number in rows:
+                client.get(f'/api/track/{number}/')
+
+        def pages_all():
+            for _, number in rows:
+                tracking_page(number)
+
+        retrieve = timed(retrieve_all, repeat=1)
+        caches['tracking'].clear()
+        cold = timed(track_all, repeat=1)
+        warm = timed(track_all, repeat=3)
+        direct = timed(pages_all, repeat=3)
+        print(f"{size:>10} {size / retrieve:>11.0f} {size / cold:>10.0f} {size / warm:>10.0f} {size / direct:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    scenario = BENCHMARKS[args.name]
+    with tempfile.TemporaryDirectory() as directory:
+        if scenario.file_db and connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            scenario(sorted(args.sizes))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
@@ -46,11 +46,9 @@ def fix_service_types_and_invoices():
         print(f"Updated {shipment.tracking_number} to International service")
     
     # Ensure every shipment has an invoice
-    shipments_without_invoice = []
-    for shipment in Shipment.objects.all():
-        has_invoice = Invoice.objects.filter(shipments=shipment).exists()
-        if not has_invoice:
-            shipments_without_invoice.append(shipment)
+    shipments_without_invoice = list(
+        Shipment.objects.filter(invoices__isnull=True).select_related('client')
+    )
     
     print(f"Found {len(shipments_without_invoice)} shipments without invoices")
     
@@ -96,7 +94,7 @@ def fix_service_types_and_invoices():
         print(f"  {service.name}: {count} shipments")
     
     print(f"\nTotal Invoices: {Invoice.objects.count()}")
-    print(f"Shipments without invoice: {len([s for s in Shipment.objects.all() if not Invoice.objects.filter(shipments=s).exists()])}")
+    print(f"Shipments without invoice: {Shipment.objects.filter(invoices__isnull=True).count()}")
     
     # Revenue by service type
     print("\nRevenue by Service Type:")
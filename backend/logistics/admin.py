@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
     User, Client, Driver, Vehicle, Destination, ServiceType, 
-    PricingRule, Shipment, Tour, Invoice, Incident, Claim
+    PricingRule, Shipment, Tour, Invoice, Incident, Claim, DocumentJob
 )
 
 class CustomUserAdmin(BaseUserAdmin):
@@ -28,3 +28,4 @@ admin.site.register(Tour)
 admin.site.register(Invoice)
 admin.site.register(Incident)
 admin.site.register(Claim)
+admin.site.register(DocumentJob)
@@ -0,0 +1,131 @@
+from datetime import datetime, time
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .models import Shipment, Incident, ShipmentMonthlyStat, IncidentMonthlyStat
+
+def month_start(month):
+    """Aware midnight of a rollup month, the value TruncMonth used to return"""
+    return timezone.make_aware(datetime.combine(month, time.min))
+
+def as_month(value):
+    # TruncMonth gives a datetime on some backends and a date on others
+    return value.date() if isinstance(value, datetime) else value
+
+def compute_shipment_rollups(shipments=None, since=None):
+    """{(month, status, destination_id, service_type_id): (count, revenue)} in one GROUP BY"""
+    shipments = Shipment.objects.all() if shipments is None else shipments
+    if since:
+        shipments = shipments.filter(date__gte=month_start(since))
+    rows = (
+        shipments.annotate(month=TruncMonth('date'))
+        .values_list('month', 'status', 'destination_id', 'service_type_id')
+        .annotate(count=Count('id'), revenue=Sum('calculated_cost'))
+        .order_by()
+    )
+    return {
+        (as_month(month), status, destination_id, service_type_id): (count, revenue or Decimal('0.00'))
+        for month, status, destination_id, service_type_id, count, revenue in rows
+    }
+
+def compute_incident_rollups(incidents=None, since=None):
+    """{month: count} in one GROUP BY"""
+    incidents = Incident.objects.all() if incidents is None else incidents
+    if since:
+        incidents = incidents.filter(date__gte=month_start(since))
+    rows = incidents.annotate(month=TruncMonth('date')).values_list('month').annotate(count=Count('id')).order_by()
+    return {as_month(month): count for month, count in rows}
+
+def stored_shipment_rollups(since=None):
+    stats = ShipmentMonthlyStat.objects.exclude(shipment_count=0, revenue=0)
+    if since:
+        stats = stats.filter(month__gte=since)
+    return {
+        (month, status, destination_id, service_type_id): (count, revenue)
+        for month, status, destination_id, service_type_id, count, revenue in stats.values_list(
+            'month', 'status', 'destination_id', 'service_type_id', 'shipment_count', 'revenue'
+        )
+    }
+
+def stored_incident_rollups(since=None):
+    stats = IncidentMonthlyStat.objects.exclude(incident_count=0)
+    if since:
+        stats = stats.filter(month__gte=since)
+    return dict(stats.values_list('month', 'incident_count'))
+
+def check_monthly_stats(since=None):
+    """
+    Compare the rollup tables with a fresh aggregate of the source tables.
+    Returns a list of (table, key, stored, actual) for every bucket that differs.
+    """
+    differences = []
+    for table, stored, actual in [
+        ('shipments', stored_shipment_rollups(since), compute_shipment_rollups(since=since)),
+        ('incidents', stored_incident_rollups(since), compute_incident_rollups(since=since)),
+    ]:
+        for key in sorted(stored.keys() | actual.keys(), key=str):
+            if stored.get(key) != actual.get(key):
+                differences.append((table, key, stored.get(key), actual.get(key)))
+    return differences
+
+def rebuild_monthly_stats(since=None):
+    """
+    Replace the rollup rows (all of them, or the months from `since` on) with
+    a fresh aggregate of the source tables. Also drops buckets that the signal
+    bookkeeping has left at zero. Returns (shipment buckets, incident buckets).
+    """
+    shipments = compute_shipment_rollups(since=since)
+    incidents = compute_incident_rollups(since=since)
+    with transaction.atomic():
+        shipment_stats = ShipmentMonthlyStat.objects.all()
+        incident_stats = IncidentMonthlyStat.objects.all()
+        if since:
+            shipment_stats = shipment_stats.filter(month__gte=since)
+            incident_stats = incident_stats.filter(month__gte=since)
+        shipment_stats.delete()
+        incident_stats.delete()
+        ShipmentMonthlyStat.objects.bulk_create([
+            ShipmentMonthlyStat(
+                month=month, status=status, destination_id=destination_id,
+                service_type_id=service_type_id, shipment_count=count, revenue=revenue,
+            )
+            for (month, status, destination_id, service_type_id), (count, revenue) in shipments.items()
+        ], batch_size=1000)
+        IncidentMonthlyStat.objects.bulk_create([
+            IncidentMonthlyStat(month=month, incident_count=count) for month, count in incidents.items()
+        ], batch_size=1000)
+    return len(shipments), len(incidents)
+
+def monthly_stats():
+    """
+    The ShipmentViewSet.stats payload, read from the rollup tables: the work
+    grows with the number of months, not with the number of shipments.
+    """
+    status_distribution = (
+        ShipmentMonthlyStat.objects.values('status')
+        .annotate(count=Sum('shipment_count'))
+        .filter(count__gt=0)
+        .order_by('status')
+    )
+    revenue_over_time = (
+        ShipmentMonthlyStat.objects.values('month')
+        .annotate(count=Sum('shipment_count'), total=Sum('revenue'))
+        .filter(count__gt=0)
+        .order_by('month')
+    )
+    incidents_over_time = (
+        IncidentMonthlyStat.objects.filter(incident_count__gt=0)
+        .values('month', count=F('incident_count'))
+        .order_by('month')
+    )
+    return {
+        'status_distribution': list(status_distribution),
+        'revenue_over_time': [
+            {'month': month_start(row['month']), 'revenue': row['total']} for row in revenue_over_time
+        ],
+        'incidents_over_time': [
+            {'month': month_start(row['month']), 'count': row['count']} for row in incidents_over_time
+        ],
+    }
@@ -0,0 +1,174 @@
+from datetime import datetime, time
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Sum
+from django.utils import timezone
+from .models import Invoice, Shipment
+
+CENT = Decimal('0.01')
+TOTAL_FIELDS = ['amount_ht', 'tva', 'amount_ttc', 'status']
+
+def invoice_totals(invoices):
+    """
+    {invoice id: sum of shipment costs} for every invoice in `invoices`, computed
+    with a single GROUP BY over the invoice/shipment link table.
+    """
+    through = Invoice.shipments.through
+    return dict(
+        through.objects.filter(invoice__in=invoices)
+        .values('invoice_id')
+        .annotate(total=Sum('shipment__calculated_cost'))
+        .values_list('invoice_id', 'total')
+    )
+
+def recalculate_invoice_totals(invoices=None, chunk_size=2000, dry_run=False):
+    """
+    Recompute HT/TVA/TTC (and the payment status that depends on TTC) for many
+    invoices at once, with the same arithmetic as Invoice.calculate_totals.
+
+    Invoices whose stored totals already match to the cent are left alone, the
+    others are written with bulk_update. Returns (scanned, changed).
+    """
+    if invoices is None:
+        invoices = Invoice.objects.all()
+    totals = invoice_totals(invoices)
+    scanned = changed = 0
+    last_id = 0
+
+    while True:
+        chunk = list(
+            invoices.filter(id__gt=last_id).order_by('id')
+            .only('id', 'amount_ht', 'tva', 'amount_ttc', 'paid_amount', 'status')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+        scanned += len(chunk)
+
+        updates = []
+        for invoice in chunk:
+            stored = (invoice.amount_ht, invoice.tva, invoice.amount_ttc, invoice.status)
+            invoice.set_totals(totals.get(invoice.id) or Decimal('0.00'))
+            # bulk_update skips the pre_save signal that keeps the status in step
+            invoice.update_status()
+            fresh = (
+                invoice.amount_ht.quantize(CENT), invoice.tva.quantize(CENT),
+                invoice.amount_ttc.quantize(CENT), invoice.status,
+            )
+            if fresh != stored:
+                updates.append(invoice)
+
+        changed += len(updates)
+        if updates and not dry_run:
+            with transaction.atomic():
+                Invoice.objects.bulk_update(updates, TOTAL_FIELDS, batch_size=500)
+
+    return scanned, changed
+
+def uninvoiced_shipments(start, end, clients=None, statuses=None):
+    """
+    Shipments dated in [start, end) that no invoice links to yet, as a single
+    NOT EXISTS anti-join against the invoice/shipment link table.
+    """
+    linked = Invoice.shipments.through.objects.filter(shipment_id=OuterRef('pk'))
+    # Compare against datetimes so the date column's index can be used
+    shipments = Shipment.objects.filter(
+        date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        date__lt=timezone.make_aware(datetime.combine(end, time.min)),
+    ).filter(~Exists(linked))
+    if clients:
+        shipments = shipments.filter(client_id__in=clients)
+    if statuses:
+        shipments = shipments.filter(status__in=statuses)
+    return shipments
+
+def lock_candidates(shipments, chunk_size):
+    """
+    Lock the rows of `shipments` in chunks walked by id, skipping rows another
+    billing run holds (PostgreSQL; SQLite serializes writers by itself).
+    Returns [(id, client_id, client name, calculated_cost)] of the rows taken.
+    """
+    rows = []
+    after = 0
+    while True:
+        chunk = list(
+            shipments.filter(id__gt=after).order_by('id')
+            .select_for_update(skip_locked=True, of=('self',))
+            .values_list('id', 'client_id', 'client__name', 'calculated_cost')[:chunk_size]
+        )
+        rows += chunk
+        if len(chunk) < chunk_size:
+            return rows
+        after = chunk[-1][0]
+
+def client_groups(rows):
+    """Per-client counts and amounts of lock_candidates rows, shaped like the GROUP BY of a dry run"""
+    groups = {}
+    for _, client_id, client_name, cost in rows:
+        group = groups.setdefault(client_id, {
+            'client_id': client_id, 'client__name': client_name, 'shipments': 0, 'amount_ht': Decimal('0.00'),
+        })
+        group['shipments'] += 1
+        group['amount_ht'] += cost or Decimal('0.00')
+    return [groups[client_id] for client_id in sorted(groups)]
+
+def run_billing(start, end, clients=None, statuses=None, dry_run=False, chunk_size=5000):
+    """
+    Invoice every uninvoiced shipment dated in [start, end): one invoice per
+    client, holding all of that client's shipments for the period.
+
+    A dry run reports per-client counts and amounts from one GROUP BY over the
+    anti-join and takes no locks. A real run first locks the candidate rows
+    (see lock_candidates), so two runs at once never invoice a shipment twice:
+    rows the other run holds are left to it, and rows it linked just before
+    they were locked are dropped by a second look at the link table. Invoices
+    and their shipment links are written with bulk_create, and the totals are
+    then recomputed from the links in SQL. Everything runs in one transaction;
+    shipments created after the run started are left for the next run.
+
+    Returns {'invoices': [ids], 'shipments': n, 'amount_ht': total,
+    'clients': [{'client', 'client_name', 'shipments', 'amount_ht'}, ...]}.
+    """
+    Through = Invoice.shipments.through
+    with transaction.atomic():
+        pending = uninvoiced_shipments(start, end, clients, statuses)
+        if dry_run:
+            groups = list(
+                pending.values('client_id', 'client__name')
+                .annotate(shipments=Count('id'), amount_ht=Sum('calculated_cost'))
+                .order_by('client_id')
+            )
+        else:
+            rows = lock_candidates(pending, chunk_size)
+            # A run that committed while these rows were being locked may have linked some
+            linked = set()
+            for offset in range(0, len(rows), chunk_size):
+                linked.update(Through.objects.filter(
+                    shipment_id__in=[row[0] for row in rows[offset:offset + chunk_size]]
+                ).values_list('shipment_id', flat=True))
+            rows = [row for row in rows if row[0] not in linked]
+            groups = client_groups(rows)
+        report = {
+            'invoices': [],
+            'shipments': sum(group['shipments'] for group in groups),
+            'amount_ht': sum((group['amount_ht'] or Decimal('0.00') for group in groups), Decimal('0.00')),
+            'clients': [
+                {'client': group['client_id'], 'client_name': group['client__name'],
+                 'shipments': group['shipments'], 'amount_ht': group['amount_ht'] or Decimal('0.00')}
+                for group in groups
+            ],
+        }
+        if dry_run or not groups:
+            return report
+
+        invoices = Invoice.objects.bulk_create([Invoice(client_id=group['client_id']) for group in groups])
+        invoice_for_client = {invoice.client_id: invoice.id for invoice in invoices}
+        for offset in range(0, len(rows), chunk_size):
+            Through.objects.bulk_create([
+                Through(invoice_id=invoice_for_client[client_id], shipment_id=shipment_id)
+                for shipment_id, client_id, _, _ in rows[offset:offset + chunk_size]
+            ])
+
+        recalculate_invoice_totals(Invoice.objects.filter(id__in=invoice_for_client.values()))
+        report['invoices'] = [invoice.id for invoice in invoices]
+    return report
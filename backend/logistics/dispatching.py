@@ -0,0 +1,166 @@
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.utils import timezone
+from .models import Destination, Driver, DriverLocation, Shipment, Tour, Vehicle, forget_tracking_pages_now_and_on_commit
+from .loading import available_vehicles, plan_loads
+from .distances import haversine_matrix
+
+def min_cost_assignment(cost):
+    """
+    Hungarian method (shortest augmenting paths with potentials) on a
+    rectangular cost matrix, vectorized over columns. Every row of the
+    smaller side is matched. Returns [(row, column)] sorted by row.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return []
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    rows, columns = cost.shape
+    u = np.zeros(rows + 1)
+    v = np.zeros(columns + 1)
+    # match[j]: row (1-based) matched to column j (1-based), 0 when free; column 0 is the sentinel
+    match = np.zeros(columns + 1, dtype=np.int64)
+    way = np.zeros(columns + 1, dtype=np.int64)
+    for row in range(1, rows + 1):
+        match[0] = row
+        column = 0
+        shortest = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = match[column]
+            reduced = cost[current_row - 1] - u[current_row] - v[1:]
+            free = ~used[1:]
+            better = free & (reduced < shortest[1:])
+            shortest[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, shortest[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            shortest[1:][free] -= delta
+            column = next_column
+            if match[column] == 0:
+                break
+        while column:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+    pairs = [(int(match[column]) - 1, column - 1) for column in range(1, columns + 1) if match[column]]
+    if transposed:
+        pairs = [(column, row) for row, column in pairs]
+    return sorted(pairs)
+
+def available_drivers(day):
+    """AVAILABLE drivers without a tour on `day`"""
+    return Driver.objects.filter(status=Driver.Status.AVAILABLE).exclude(
+        id__in=Tour.objects.filter(date=day).values('driver_id')
+    )
+
+def driver_costs(drivers, loads):
+    """
+    Cost of giving each load to each driver: km from the driver's last
+    reported position (the depot when unknown) to the middle of the load's
+    destinations, plus DISPATCH_BALANCE_KM for every tour the driver drove in
+    the last DISPATCH_BALANCE_DAYS days, so that work is spread out.
+    """
+    depot = (settings.DEPOT_LATITUDE, settings.DEPOT_LONGITUDE)
+    driver_points = np.array([
+        (lat, lng) if lat is not None else depot for _, lat, lng, _ in drivers
+    ], dtype=np.float64).reshape(-1, 2)
+    recent_tours = np.array([tours for _, _, _, tours in drivers], dtype=np.float64)
+
+    coordinates = {
+        destination_id: (lat, lng)
+        for destination_id, lat, lng in Destination.objects.filter(
+            id__in={destination for load in loads for destination in load['destinations']},
+            latitude__isnull=False, longitude__isnull=False,
+        ).values_list('id', 'latitude', 'longitude')
+    }
+    load_points = []
+    for load in loads:
+        points = [coordinates[destination] for destination in load['destinations'] if destination in coordinates]
+        load_points.append(np.mean(points, axis=0) if points else depot)
+    load_points = np.array(load_points, dtype=np.float64).reshape(-1, 2)
+
+    distances = haversine_matrix(driver_points, load_points)
+    return distances + settings.DISPATCH_BALANCE_KM * recent_tours[:, None]
+
+def dispatch(day, dry_run=False):
+    """
+    Turn the load plan of `day` (logistics.loading) into tours: match the
+    AVAILABLE drivers to the planned vehicle loads by cost, then create the
+    tours, link their shipments and assign the drivers in bulk, all in one
+    transaction. With dry_run the assignment is returned and nothing is
+    written. Returns a report dict.
+    """
+    with transaction.atomic():
+        # Serialize concurrent dispatch runs on the vehicles they share (PostgreSQL)
+        list(available_vehicles(day).select_for_update().values_list('id', flat=True))
+        plan = plan_loads(day)
+        since = day - timedelta(days=settings.DISPATCH_BALANCE_DAYS)
+        latest = DriverLocation.objects.filter(driver=OuterRef('pk')).order_by('-recorded_at')
+        drivers = list(
+            available_drivers(day).order_by('id').annotate(
+                lat=Subquery(latest.values('lat')[:1]),
+                lng=Subquery(latest.values('lng')[:1]),
+                recent_tours=Count('tour', filter=Q(tour__date__gte=since, tour__date__lt=day)),
+            ).values_list('id', 'lat', 'lng', 'recent_tours')
+        )
+        loads = plan['loads']
+        cost = driver_costs(drivers, loads) if drivers and loads else None
+        pairs = min_cost_assignment(cost) if cost is not None else []
+
+        assignments = [
+            {
+                'tour': None,
+                'driver': drivers[driver][0],
+                'vehicle': loads[load]['vehicle'],
+                'zone': loads[load]['zone'],
+                'shipments': loads[load]['shipments'],
+                'cost': round(float(cost[driver, load]), 1),
+            }
+            for driver, load in pairs
+        ]
+        assigned_loads = {load for _, load in pairs}
+        report = {
+            'date': day,
+            'dry_run': dry_run,
+            'drivers_available': len(drivers),
+            'vehicles_available': plan['vehicles_available'],
+            'shipments': plan['shipments'],
+            'dispatched': sum(len(assignment['shipments']) for assignment in assignments),
+            'tours': assignments,
+            # Loads packed into a vehicle but left without a driver, and shipments that fit no vehicle
+            'loads_without_driver': [load for index, load in enumerate(loads) if index not in assigned_loads],
+            'unassigned': plan['unassigned'],
+        }
+        if dry_run or not assignments:
+            return report
+
+        tours = Tour.objects.bulk_create([
+            Tour(driver_id=assignment['driver'], vehicle_id=assignment['vehicle'], date=day)
+            for assignment in assignments
+        ])
+        now = timezone.now()
+        links, shipments = [], []
+        for tour, assignment in zip(tours, assignments):
+            assignment['tour'] = tour.pk
+            for shipment_id in assignment['shipments']:
+                links.append(Tour.shipments.through(tour_id=tour.pk, shipment_id=shipment_id))
+                shipments.append(Shipment(id=shipment_id, driver_id=assignment['driver'], updated_at=now))
+        Tour.shipments.through.objects.bulk_create(links, batch_size=1000)
+        Shipment.objects.bulk_update(shipments, ['driver', 'updated_at'], batch_size=1000)
+        # bulk_update sends no post_save, and the public tracking page shows updated_at
+        forget_tracking_pages_now_and_on_commit(list(
+            Shipment.objects.filter(tours__in=tours).values_list('tracking_number', flat=True)
+        ))
+        # Tour.save does this for tours created one by one
+        Vehicle.reconcile_statuses(Vehicle.objects.filter(id__in=[tour.vehicle_id for tour in tours]))
+    return report
@@ -0,0 +1,180 @@
+import os
+import threading
+import numpy as np
+from django.conf import settings
+from .models import Destination
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_matrix(a, b):
+    """Great-circle km from every (lat, lng) point of `a` to every point of `b`, as an (len(a), len(b)) array"""
+    a = np.radians(np.asarray(a, dtype=np.float64).reshape(-1, 2))
+    b = np.radians(np.asarray(b, dtype=np.float64).reshape(-1, 2))
+    lat1, lng1 = a[:, :1], a[:, 1:]
+    lat2, lng2 = b[:, 0], b[:, 1]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+def row_offset(slot):
+    """Position of row `slot` in the packed lower triangle (works on arrays too)"""
+    return slot * (slot + 1) // 2
+
+class DistanceMatrix:
+    """
+    Straight-line km between all geocoded destinations, kept on disk as the
+    packed lower triangle of a float32 matrix (distances.f32, row s holds the
+    distances to slots 0..s) and memory-mapped, so every process reads the
+    same pages from the OS cache. slots.npy maps slots to destination ids and
+    the coordinates their row was computed from.
+
+    manage.py update_distance_matrix appends rows for new destinations and
+    rewrites those of moved ones; the file only ever grows, so mappings held
+    by other processes stay valid. Readers check the stored coordinates and
+    compute any pair the file does not have right yet.
+    """
+    def __init__(self, directory):
+        self.slots_path = os.path.join(directory, 'slots.npy')
+        self.distances_path = os.path.join(directory, 'distances.f32')
+        self.directory = directory
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+        # (slot per destination id, stored coordinates per slot, packed distances)
+        self._state = ({}, np.empty((0, 2)), np.empty(0, dtype=np.float32))
+
+    def refresh(self):
+        """Reload the slot table if the writer replaced it since the last load (one stat call otherwise)"""
+        try:
+            mtime = os.stat(self.slots_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._loaded_mtime:
+            return self._state
+        with self._lock:
+            if mtime is None:
+                slots = np.empty((0, 3))
+            else:
+                slots = np.load(self.slots_path)
+            size = row_offset(len(slots))
+            distances = (
+                np.memmap(self.distances_path, dtype=np.float32, mode='r', shape=(size,))
+                if size else np.empty(0, dtype=np.float32)
+            )
+            slot_of = {int(destination_id): slot for slot, destination_id in enumerate(slots[:, 0]) if destination_id >= 0}
+            self._state = (slot_of, slots[:, 1:], distances)
+            self._loaded_mtime = mtime
+        return self._state
+
+    def distance(self, a, b):
+        """Stored km between destinations `a` and `b`, or None when either has no row yet"""
+        slot_of, _, distances = self.refresh()
+        first, second = slot_of.get(a), slot_of.get(b)
+        if first is None or second is None:
+            return None
+        if first < second:
+            first, second = second, first
+        return float(distances[row_offset(first) + second])
+
+    def matrix(self, points, destination_ids):
+        """
+        Full km matrix between `points`. destination_ids[i] names the
+        destination at points[i], or is None for another place (the depot).
+        Pairs of destinations stored at these coordinates are read from the
+        file, the rows of every other point are computed.
+        """
+        slot_of, stored, distances = self.refresh()
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        slots = np.array([slot_of.get(destination_id, -1) for destination_id in destination_ids], dtype=np.int64)
+        known = slots >= 0
+        known[known] = (stored[slots[known]] == points[known]).all(axis=1)
+        result = np.empty((len(points), len(points)))
+
+        stored_rows = np.flatnonzero(known)
+        if len(stored_rows):
+            found = slots[stored_rows]
+            high, low = np.maximum.outer(found, found), np.minimum.outer(found, found)
+            result[np.ix_(stored_rows, stored_rows)] = distances[row_offset(high) + low]
+        computed_rows = np.flatnonzero(~known)
+        if len(computed_rows):
+            rows = haversine_matrix(points[computed_rows], points)
+            result[computed_rows, :] = rows
+            result[:, computed_rows] = rows.T
+        return result
+
+    def update(self, rebuild=False):
+        """
+        Bring the files in line with the Destination table: append rows for
+        new destinations, recompute the rows of moved ones and retire the
+        slots of deleted ones. With `rebuild` every row is recomputed into a
+        new file. Returns (added, moved, removed).
+
+        Meant for a single writer (the management command) at a time.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        current = {
+            destination_id: (latitude, longitude)
+            for destination_id, latitude, longitude in Destination.objects.filter(
+                latitude__isnull=False, longitude__isnull=False
+            ).values_list('id', 'latitude', 'longitude')
+        }
+        rebuild = rebuild or not os.path.exists(self.slots_path)
+        slots = np.empty((0, 3)) if not os.path.exists(self.slots_path) else np.load(self.slots_path)
+        stored = len(slots)
+
+        moved, removed = [], 0
+        for slot in range(stored):
+            destination_id = int(slots[slot, 0])
+            if destination_id < 0:
+                continue
+            point = current.pop(destination_id, None)
+            if point is None:
+                slots[slot, 0] = -1
+                removed += 1
+            elif tuple(slots[slot, 1:]) != point:
+                slots[slot, 1:] = point
+                moved.append(slot)
+        added = [(destination_id, *point) for destination_id, point in sorted(current.items())]
+        slots = np.concatenate([slots, np.array(added, dtype=np.float64).reshape(-1, 3)])
+
+        if rebuild:
+            temporary = self.distances_path + '.tmp'
+            with open(temporary, 'wb') as output:
+                self.write_rows(output, slots, 0)
+            os.replace(temporary, self.distances_path)
+        else:
+            if moved:
+                distances = np.memmap(self.distances_path, dtype=np.float32, mode='r+', shape=(row_offset(stored),))
+                for slot in moved:
+                    row = haversine_matrix(slots[slot, 1:], slots[:stored, 1:])[0]
+                    distances[row_offset(slot):row_offset(slot) + slot + 1] = row[:slot + 1]
+                    later = np.arange(slot + 1, stored)
+                    distances[row_offset(later) + slot] = row[slot + 1:]
+                distances.flush()
+                del distances
+            with open(self.distances_path, 'r+b') as output:
+                # Drop rows a failed run appended without recording their slots
+                output.truncate(row_offset(stored) * 4)
+                output.seek(0, os.SEEK_END)
+                self.write_rows(output, slots, stored)
+
+        # Rows are on disk before readers can see the slots that point at them
+        temporary = self.slots_path + '.tmp'
+        with open(temporary, 'wb') as output:
+            np.save(output, slots)
+        os.replace(temporary, self.slots_path)
+        return len(added), len(moved), removed
+
+    @staticmethod
+    def write_rows(output, slots, start):
+        for slot in range(start, len(slots)):
+            haversine_matrix(slots[slot, 1:], slots[:slot + 1, 1:])[0].astype(np.float32).tofile(output)
+
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+def destination_distances():
+    """The process-wide DistanceMatrix for DISTANCE_MATRIX_DIR"""
+    directory = str(settings.DISTANCE_MATRIX_DIR)
+    with _matrices_lock:
+        if directory not in _matrices:
+            _matrices[directory] = DistanceMatrix(directory)
+        return _matrices[directory]
@@ -0,0 +1,192 @@
+import hashlib
+import tempfile
+from io import BytesIO
+from django.core.cache import caches
+from django.db.models import Count, Max, Sum
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+
+# Bump when the slip layout changes so cached PDFs are not served any more
+SLIP_TEMPLATE_VERSION = 1
+SLIP_FORM = 'slip_template'
+
+# Columns a slip needs, fetched with a single values() query
+SLIP_VALUES = (
+    'id', 'updated_at', 'tracking_number', 'client__name', 'destination__name',
+    'service_type__name', 'weight', 'volume', 'status',
+)
+
+INVOICE_TEMPLATE_VERSION = 1
+# Shipment lines read from the database per round trip
+INVOICE_CHUNK_SIZE = 2000
+INVOICE_LINE_HEIGHT = 20
+# Lowest baseline for a shipment line before the invoice moves to a new page
+INVOICE_BOTTOM_Y = 80
+
+LABEL_X = 100
+VALUE_X = 200
+# Vertical distance between two slips on an n-up label sheet
+SLIP_PITCH = 190
+SLIPS_PER_SHEET = 4
+# (static label, y, variable value)
+SLIP_LINES = [
+    ('Shipment Slip:', 750, '{tracking_number}'),
+    ('Client:', 730, '{client__name}'),
+    ('Destination:', 710, '{destination__name}'),
+    ('Service:', 690, '{service_type__name}'),
+    ('Weight:', 670, '{weight} kg'),
+    ('Volume:', 650, '{volume} m3'),
+    ('Status:', 630, '{status}'),
+]
+
+def draw_slip_template(pdf):
+    """
+    Draw the static part of a slip (labels and frame) once into a reusable
+    form XObject. Every slip page of the document then only references it.
+    """
+    pdf.beginForm(SLIP_FORM)
+    pdf.rect(LABEL_X - 20, 610, 420, 165)
+    for label, y, _ in SLIP_LINES:
+        pdf.drawString(LABEL_X, y, label)
+    pdf.endForm()
+
+def place_slip(pdf, values, slot=0):
+    """Draw one slip (template plus values) in the given slot from the top of the page"""
+    pdf.saveState()
+    pdf.translate(0, -slot * SLIP_PITCH)
+    pdf.doForm(SLIP_FORM)
+    for _, y, value in SLIP_LINES:
+        pdf.drawString(VALUE_X, y, value.format(**values))
+    pdf.restoreState()
+
+def draw_slip(pdf, values):
+    """Overlay one shipment's values on the slip template and end the page"""
+    place_slip(pdf, values)
+    pdf.showPage()
+
+def render_slip(values):
+    buffer = BytesIO()
+    # invariant output: the same values always give the same bytes
+    pdf = canvas.Canvas(buffer, pagesize=letter, invariant=1)
+    draw_slip_template(pdf)
+    draw_slip(pdf, values)
+    pdf.save()
+    return buffer.getvalue()
+
+def slip_etag(values):
+    """
+    Fingerprint of everything printed on the slip: the shipment id and
+    updated_at, plus the related names that can change without touching it.
+    """
+    fingerprint = repr((SLIP_TEMPLATE_VERSION,) + tuple(values[name] for name in SLIP_VALUES))
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+def cached_slip(values, etag=None):
+    """Slip PDF bytes from the 'documents' cache, rendered on a miss"""
+    key = f"slip:{etag or slip_etag(values)}"
+    cache = caches['documents']
+    pdf = cache.get(key)
+    if pdf is None:
+        pdf = render_slip(values)
+        cache.set(key, pdf)
+    return pdf
+
+def render_slips(rows, output, per_page=1):
+    """
+    Write one PDF holding a slip for every row to the file object `output`:
+    one slip per page, or `per_page` slips stacked on each label sheet.
+    """
+    pdf = canvas.Canvas(output, pagesize=letter, invariant=1)
+    draw_slip_template(pdf)
+    slot = 0
+    for values in rows:
+        place_slip(pdf, values, slot)
+        slot += 1
+        if slot == per_page:
+            pdf.showPage()
+            slot = 0
+    if slot:
+        pdf.showPage()
+    pdf.save()
+
+def slip_batch(rows, per_page=1):
+    """
+    Render a slip batch and return it as an open temporary file positioned at
+    the start. Batches above SLIP_BATCH_QUEUE_THRESHOLD do not come here: the
+    slips view hands them to the document worker (see logistics.jobs).
+    """
+    output = tempfile.TemporaryFile()
+    render_slips(rows, output, per_page)
+    output.seek(0)
+    return output
+
+def invoice_etag(invoice):
+    """
+    Fingerprint of the invoice's last-modified state: its own printed fields
+    and, from one aggregate query, which shipments it holds and when the
+    latest of them changed.
+    """
+    state = invoice.shipments.aggregate(
+        count=Count('id'), id_sum=Sum('id'), last_modified=Max('updated_at')
+    )
+    fingerprint = repr((
+        INVOICE_TEMPLATE_VERSION, invoice.pk, invoice.client.name, invoice.date,
+        invoice.amount_ht, invoice.tva, invoice.amount_ttc,
+        state['count'], state['id_sum'], state['last_modified'],
+    ))
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+def end_invoice_page(pdf, page):
+    pdf.drawString(480, 40, f"Page {page}")
+    pdf.showPage()
+
+def render_invoice(invoice, lines, output):
+    """
+    Write the invoice PDF to `output`. `lines` is an iterable of
+    (tracking_number, calculated_cost) pairs, consumed once; pages are added
+    as the shipment list runs past the bottom margin.
+    """
+    pdf = canvas.Canvas(output, pagesize=letter, invariant=1)
+    pdf.drawString(100, 750, f"INVOICE #{invoice.id}")
+    pdf.drawString(100, 730, f"Client: {invoice.client.name}")
+    pdf.drawString(100, 710, f"Date: {invoice.date}")
+    pdf.drawString(100, 680, "Shipments:")
+    y = 660
+    page = 1
+    for tracking_number, calculated_cost in lines:
+        if y < INVOICE_BOTTOM_Y:
+            end_invoice_page(pdf, page)
+            page += 1
+            pdf.drawString(100, 750, f"INVOICE #{invoice.id} (continued)")
+            y = 720
+        pdf.drawString(120, y, f"- {tracking_number}: ${calculated_cost}")
+        y -= INVOICE_LINE_HEIGHT
+
+    # The three total lines go below the list, on a fresh page if they do not fit
+    if y - 60 < INVOICE_BOTTOM_Y:
+        end_invoice_page(pdf, page)
+        page += 1
+        pdf.drawString(100, 750, f"INVOICE #{invoice.id} (continued)")
+        y = 730
+    pdf.drawString(100, y-20, f"Total HT: ${invoice.amount_ht}")
+    pdf.drawString(100, y-40, f"TVA (19%): ${invoice.tva}")
+    pdf.drawString(100, y-60, f"Total TTC: ${invoice.amount_ttc}")
+    end_invoice_page(pdf, page)
+    pdf.save()
+
+def cached_invoice(invoice, etag=None):
+    """Invoice PDF bytes from the 'documents' cache, rendered on a miss"""
+    key = f"invoice:{etag or invoice_etag(invoice)}"
+    cache = caches['documents']
+    pdf = cache.get(key)
+    if pdf is None:
+        lines = (
+            invoice.shipments.order_by('id')
+            .values_list('tracking_number', 'calculated_cost')
+            .iterator(chunk_size=INVOICE_CHUNK_SIZE)
+        )
+        buffer = BytesIO()
+        render_invoice(invoice, lines, buffer)
+        pdf = buffer.getvalue()
+        cache.set(key, pdf)
+    return pdf
@@ -0,0 +1,101 @@
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import Shipment, ShipmentStatusHistory, forget_tracking_pages
+
+logger = logging.getLogger(__name__)
+
+class StatusHistoryWriter:
+    """
+    Buffers status history rows and inserts them with one bulk_create per
+    `interval` seconds (or as soon as `max_batch` rows are waiting) from a
+    background thread. On SQLite this turns many tiny write transactions,
+    each competing for the database lock, into one.
+
+    Rows carry the time of the status change, not the time they are written.
+    A row is visible to readers only after the next flush, and rows still
+    buffered when the process is killed are lost. A batch that cannot be
+    written goes back to the front of the buffer and is retried, waiting
+    twice as long after each failure up to `max_backoff` seconds.
+    """
+    def __init__(self, interval, max_batch=500, max_backoff=60):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, shipment_id, status, timestamp=None):
+        with self.lock:
+            self.pending.append(ShipmentStatusHistory(
+                shipment_id=shipment_id, status=status, timestamp=timestamp or timezone.now()
+            ))
+            full = len(self.pending) >= self.max_batch
+            if self.thread is None:
+                self.start()
+        if full:
+            self.wakeup.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='status-history-writer', daemon=True)
+        self.thread.start()
+        # Write whatever is still buffered on a normal shutdown
+        atexit.register(self.flush)
+
+    def flush(self):
+        """Insert every buffered row now; returns how many were written"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            try:
+                with transaction.atomic():
+                    ShipmentStatusHistory.objects.bulk_create(batch, batch_size=500)
+            except Exception:
+                # Ahead of rows added meanwhile, so the history keeps its order
+                with self.lock:
+                    self.pending[:0] = batch
+                raise
+            # bulk_create sends no post_save, so the tracking pages are dropped here
+            forget_tracking_pages(Shipment.objects.filter(
+                id__in={row.shipment_id for row in batch}
+            ).values_list('tracking_number', flat=True))
+        return len(batch)
+
+    def run(self):
+        backoff = self.interval
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write buffered status history, retrying in %s seconds', backoff)
+                # Drop a connection the error left unusable; the next flush opens a new one
+                close_old_connections()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            else:
+                backoff = self.interval
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def status_history_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = StatusHistoryWriter(settings.STATUS_HISTORY_COALESCE_INTERVAL)
+        return _writer
+
+def record_status_change(shipment, status):
+    """History entry for a status change: buffered when coalescing is enabled, written now otherwise"""
+    if settings.STATUS_HISTORY_COALESCE_INTERVAL > 0:
+        status_history_writer().add(shipment.pk, status)
+    else:
+        ShipmentStatusHistory.objects.create(shipment=shipment, status=status)
@@ -0,0 +1,98 @@
+import secrets
+import time
+from django.db import transaction
+from .models import (
+    Client, Destination, ServiceType, Driver, Shipment, pricing_rule_index, compute_shipment_cost,
+    record_new_shipments,
+)
+from .serializers import ShipmentBulkItemSerializer
+
+# Relation field -> model whose ids the whole batch is checked against
+RELATED_MODELS = {
+    'client': Client,
+    'destination': Destination,
+    'service_type': ServiceType,
+    'driver': Driver,
+}
+
+def allocate_tracking_numbers(count):
+    """
+    Reserve `count` tracking numbers in one step: a shared millisecond timestamp
+    and random batch token, followed by the position in the batch.
+    """
+    prefix = f"SH-{int(time.time() * 1000)}{secrets.token_hex(2).upper()}"
+    return [f"{prefix}-{i:05d}" for i in range(count)]
+
+def bulk_create_shipments(items):
+    """
+    Validate, price and insert a batch of shipment payloads.
+
+    Every item is validated before anything is written; items that fail are
+    reported by position and the rest are still created. Relations and
+    tracking number uniqueness are checked with one query per table for the
+    whole batch, prices come from a single read of the pricing rule table and
+    the rows are inserted with one bulk_create in one transaction.
+
+    Returns ([(index, created shipment), ...], {index: errors}).
+    """
+    errors = {}
+    valid = {}
+    for index, item in enumerate(items):
+        serializer = ShipmentBulkItemSerializer(data=item)
+        if serializer.is_valid():
+            valid[index] = serializer.validated_data
+        else:
+            errors[index] = serializer.errors
+
+    # Relations: one id lookup per related table
+    for field, model in RELATED_MODELS.items():
+        wanted = {data[field] for data in valid.values() if data.get(field) is not None}
+        existing = set(model.objects.filter(id__in=wanted).values_list('id', flat=True))
+        for index, data in list(valid.items()):
+            value = data.get(field)
+            if value is not None and value not in existing:
+                errors[index] = {field: [f'Invalid pk "{value}" - object does not exist.']}
+                del valid[index]
+
+    # Client supplied tracking numbers: unique within the batch and against the table
+    supplied = {}
+    for index, data in list(valid.items()):
+        number = data.get('tracking_number')
+        if number is None:
+            continue
+        if number in supplied:
+            errors[index] = {'tracking_number': ['Duplicate tracking number in this batch.']}
+            del valid[index]
+        else:
+            supplied[number] = index
+    taken = Shipment.objects.filter(tracking_number__in=supplied).values_list('tracking_number', flat=True)
+    for number in taken:
+        index = supplied[number]
+        errors[index] = {'tracking_number': ['shipment with this tracking number already exists.']}
+        del valid[index]
+
+    missing = [index for index, data in valid.items() if not data.get('tracking_number')]
+    for index, number in zip(missing, allocate_tracking_numbers(len(missing))):
+        valid[index]['tracking_number'] = number
+
+    rules = pricing_rule_index.rules()
+    indices = sorted(valid)
+    shipments = []
+    for index in indices:
+        data = valid[index]
+        shipment = Shipment(**{
+            f'{name}_id' if name in RELATED_MODELS else name: value
+            for name, value in data.items()
+        })
+        shipment.calculated_cost = compute_shipment_cost(
+            rules.get((shipment.destination_id, shipment.service_type_id)),
+            shipment.weight, shipment.volume, shipment.is_international,
+            shipment.requires_customs_clearance, shipment.customs_value,
+        )
+        shipments.append(shipment)
+
+    with transaction.atomic():
+        created = Shipment.objects.bulk_create(shipments, batch_size=1000)
+        record_new_shipments(created)
+
+    return list(zip(indices, created)), errors
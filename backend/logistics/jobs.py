@@ -0,0 +1,115 @@
+from datetime import timedelta
+from io import BytesIO
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import DocumentJob, Invoice, Shipment
+from .documents import SLIP_VALUES, SLIPS_PER_SHEET, cached_invoice, cached_slip, render_slips
+
+def enqueue_jobs(kind, params_list, requested_by=None):
+    """Queue one job of `kind` per params dict with a single insert"""
+    return DocumentJob.objects.bulk_create([
+        DocumentJob(
+            kind=kind, params=params, requested_by=requested_by,
+            max_attempts=settings.DOCUMENT_JOB_MAX_ATTEMPTS,
+        )
+        for params in params_list
+    ], batch_size=1000)
+
+def render_job(job):
+    """Render the document a job describes; returns (filename, pdf bytes)"""
+    params = job.params
+    if job.kind == DocumentJob.Kind.INVOICE:
+        invoice = Invoice.objects.select_related('client').get(pk=params['invoice'])
+        return f"invoice_{invoice.id}.pdf", cached_invoice(invoice)
+
+    if job.kind == DocumentJob.Kind.SLIP:
+        values = Shipment.objects.values(*SLIP_VALUES).get(pk=params['shipment'])
+        return f"shipment_{values['tracking_number']}.pdf", cached_slip(values)
+
+    if job.kind == DocumentJob.Kind.SLIP_BATCH:
+        shipments = Shipment.objects.all()
+        if 'ids' in params:
+            shipments = shipments.filter(id__in=params['ids'])
+        if 'tour' in params:
+            shipments = shipments.filter(tours=params['tour'])
+        rows = shipments.order_by('id').values(*SLIP_VALUES)
+        per_page = SLIPS_PER_SHEET if params.get('layout') == 'sheet' else 1
+        buffer = BytesIO()
+        render_slips(rows.iterator(chunk_size=2000), buffer, per_page)
+        return f"shipment_slips_{job.id}.pdf", buffer.getvalue()
+
+    raise ValueError(f"Unknown document kind {job.kind!r}")
+
+def run_job(job_id):
+    """Worker process entry point: only reads the database, the parent records the outcome"""
+    return render_job(DocumentJob.objects.get(pk=job_id))
+
+def claim_jobs(limit, now=None):
+    """
+    Move up to `limit` due jobs from QUEUED to RUNNING and return their ids.
+    Each claim is a conditional UPDATE, so two workers never take the same job.
+    """
+    now = now or timezone.now()
+    candidates = (
+        DocumentJob.objects.filter(status=DocumentJob.Status.QUEUED, available_at__lte=now)
+        .order_by('available_at', 'id')
+        .values_list('id', flat=True)[:limit * 2]
+    )
+    claimed = []
+    for job_id in candidates:
+        if len(claimed) == limit:
+            break
+        if DocumentJob.objects.filter(pk=job_id, status=DocumentJob.Status.QUEUED).update(
+            status=DocumentJob.Status.RUNNING, attempts=F('attempts') + 1, started_at=now
+        ):
+            claimed.append(job_id)
+    return claimed
+
+def complete_job(job_id, name, content):
+    DocumentJob.objects.filter(pk=job_id).update(
+        status=DocumentJob.Status.DONE, result=content, result_name=name,
+        error='', finished_at=timezone.now(),
+    )
+
+def fail_job(job_id, error):
+    """
+    Put a failed job back in the queue with exponential backoff, or mark it
+    failed (the dead-letter state) once it has used all its attempts.
+    """
+    job = DocumentJob.objects.only('attempts', 'max_attempts').get(pk=job_id)
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        DocumentJob.objects.filter(pk=job_id).update(
+            status=DocumentJob.Status.DEAD, error=error, finished_at=now
+        )
+        return DocumentJob.Status.DEAD
+    delay = settings.DOCUMENT_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+    DocumentJob.objects.filter(pk=job_id).update(
+        status=DocumentJob.Status.QUEUED, error=error,
+        available_at=now + timedelta(seconds=delay),
+    )
+    return DocumentJob.Status.QUEUED
+
+def requeue_stale_jobs(now=None, exclude=()):
+    """
+    Treat jobs left RUNNING by a worker that died as failed attempts. A
+    worker sweeping while it renders passes its own jobs in `exclude`.
+    """
+    now = now or timezone.now()
+    stale = list(DocumentJob.objects.filter(
+        status=DocumentJob.Status.RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.DOCUMENT_JOB_STALE_AFTER),
+    ).exclude(id__in=list(exclude)).values_list('id', flat=True))
+    for job_id in stale:
+        fail_job(job_id, 'Worker stopped before the job finished')
+    return len(stale)
+
+def prune_jobs(days, now=None):
+    """Delete finished and failed jobs, with their PDFs, that ended more than `days` days ago"""
+    now = now or timezone.now()
+    deleted, _ = DocumentJob.objects.filter(
+        status__in=[DocumentJob.Status.DONE, DocumentJob.Status.DEAD],
+        finished_at__lt=now - timedelta(days=days),
+    ).delete()
+    return deleted
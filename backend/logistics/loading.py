@@ -0,0 +1,189 @@
+import math
+from datetime import datetime, time, timedelta
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .models import Shipment, Tour, Vehicle
+
+# Slack for float rounding when comparing a load against a capacity
+EPSILON = 1e-6
+
+class Load:
+    """Shipments packed into one vehicle for one zone"""
+    def __init__(self, vehicle, zone):
+        self.vehicle = vehicle
+        self.zone = zone
+        self.weight = 0.0
+        self.volume = 0.0
+        self.items = []
+
+    def fits(self, weight, volume):
+        _, weight_capacity, volume_capacity = self.vehicle
+        return (self.weight + weight <= weight_capacity + EPSILON
+                and self.volume + volume <= volume_capacity + EPSILON)
+
+    def add(self, item):
+        self.items.append(item)
+        self.weight += item[1]
+        self.volume += item[2]
+
+def vehicle_fits(vehicle, weight, volume):
+    _, weight_capacity, volume_capacity = vehicle
+    return weight <= weight_capacity + EPSILON and volume <= volume_capacity + EPSILON
+
+def fill(load):
+    """Share of the vehicle used along its tighter dimension"""
+    _, weight_capacity, volume_capacity = load.vehicle
+    return max(load.weight / weight_capacity if weight_capacity else 0,
+               load.volume / volume_capacity if volume_capacity else 0)
+
+def pack(items, vehicles):
+    """
+    Two-dimensional (weight, volume) bin packing of `items` into `vehicles`.
+
+    items are (id, weight, volume, zone, ...) and vehicles (id, weight capacity,
+    volume capacity), with math.inf for a capacity that is not limited. A
+    vehicle only carries one zone. Zones are packed biggest first; within a
+    zone items go first-fit-decreasing into the vehicles already opened for
+    it, and a new vehicle (the largest one left that takes the item) is
+    opened when none fits. Then two improvement passes: empty lightly
+    loaded vehicles into the others of their zone, and move every load to
+    the smallest unused vehicle that still carries it.
+
+    Returns (loads, [(item, reason)] for the items left over).
+    """
+    vehicles = sorted(vehicles, key=lambda vehicle: (vehicle[1], vehicle[2]), reverse=True)
+    # Sizes relative to the largest vehicle, so weight and volume weigh alike
+    max_weight = max((vehicle[1] for vehicle in vehicles), default=1) or 1
+    finite_volumes = [vehicle[2] for vehicle in vehicles if math.isfinite(vehicle[2])]
+    max_volume = max(finite_volumes, default=0)
+
+    def size(item):
+        return max(item[1] / max_weight, item[2] / max_volume if max_volume else 0)
+
+    zones = {}
+    for item in items:
+        zones.setdefault(item[3], []).append(item)
+    pool = list(vehicles)
+    loads, leftovers = [], []
+    for zone, zone_items in sorted(zones.items(), key=lambda entry: sum(map(size, entry[1])), reverse=True):
+        zone_loads = []
+        for item in sorted(zone_items, key=size, reverse=True):
+            for load in zone_loads:
+                if load.fits(item[1], item[2]):
+                    load.add(item)
+                    break
+            else:
+                vehicle = next((vehicle for vehicle in pool if vehicle_fits(vehicle, item[1], item[2])), None)
+                if vehicle is None:
+                    too_large = not any(vehicle_fits(vehicle, item[1], item[2]) for vehicle in vehicles)
+                    leftovers.append((item, 'too_large' if too_large else 'no_capacity'))
+                    continue
+                pool.remove(vehicle)
+                load = Load(vehicle, zone)
+                load.add(item)
+                zone_loads.append(load)
+        pool.extend(load.vehicle for load in merge_loads(zone_loads))
+        loads.extend(zone_loads)
+    downsize(loads, pool)
+    return loads, leftovers
+
+def merge_loads(loads):
+    """
+    Try to spread the least filled load of a zone over the others, repeatedly.
+    Removes the emptied loads from `loads` and returns them.
+    """
+    emptied = []
+    improved = True
+    while improved and len(loads) > 1:
+        improved = False
+        for victim in sorted(loads, key=fill):
+            others = [load for load in loads if load is not victim]
+            added = {id(load): (0.0, 0.0) for load in others}
+            moves = []
+            for item in sorted(victim.items, key=lambda item: (item[1], item[2]), reverse=True):
+                for load in others:
+                    weight, volume = added[id(load)]
+                    if load.fits(weight + item[1], volume + item[2]):
+                        added[id(load)] = (weight + item[1], volume + item[2])
+                        moves.append((load, item))
+                        break
+                else:
+                    break
+            else:
+                for load, item in moves:
+                    load.add(item)
+                loads.remove(victim)
+                emptied.append(victim)
+                improved = True
+                break
+    return emptied
+
+def downsize(loads, pool):
+    """Swap each load, biggest vehicles first, onto the smallest unused vehicle that carries it"""
+    for load in sorted(loads, key=lambda load: (load.vehicle[1], load.vehicle[2]), reverse=True):
+        smaller = [
+            vehicle for vehicle in pool
+            if vehicle_fits(vehicle, load.weight, load.volume) and (vehicle[1], vehicle[2]) < load.vehicle[1:]
+        ]
+        if smaller:
+            vehicle = min(smaller, key=lambda vehicle: (vehicle[1], vehicle[2]))
+            pool.remove(vehicle)
+            pool.append(load.vehicle)
+            load.vehicle = vehicle
+
+def pending_shipments(day):
+    """PENDING shipments created up to the end of `day` that are on no tour yet"""
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    on_tour = Tour.shipments.through.objects.filter(shipment_id=OuterRef('pk'))
+    return Shipment.objects.filter(status=Shipment.Status.PENDING, date__lt=end).filter(~Exists(on_tour))
+
+def available_vehicles(day):
+    """AVAILABLE vehicles without a tour on `day`"""
+    return Vehicle.objects.filter(status=Vehicle.Status.AVAILABLE).exclude(
+        id__in=Tour.objects.filter(date=day).values('vehicle_id')
+    )
+
+def percent(used, capacity):
+    return round(100 * used / capacity, 1) if math.isfinite(capacity) and capacity else None
+
+def plan_loads(day):
+    """
+    Pack the pending shipments of `day` into the available vehicles, one
+    zone per vehicle. Two queries; the proposal (tours without a driver yet)
+    and a utilization report come from the same run.
+    """
+    items = [
+        (shipment_id, float(weight), float(volume), zone, destination_id)
+        for shipment_id, weight, volume, zone, destination_id in pending_shipments(day).order_by('id').values_list(
+            'id', 'weight', 'volume', 'destination__zone', 'destination_id'
+        )
+    ]
+    vehicles = [
+        (vehicle_id, capacity, volume_capacity if volume_capacity is not None else math.inf)
+        for vehicle_id, capacity, volume_capacity in available_vehicles(day).filter(capacity__gt=0).values_list(
+            'id', 'capacity', 'volume_capacity'
+        )
+    ]
+    loads, leftovers = pack(items, vehicles)
+    loads.sort(key=lambda load: (load.zone or '', load.vehicle[0]))
+    return {
+        'date': day,
+        'shipments': len(items),
+        'planned': sum(len(load.items) for load in loads),
+        'vehicles_available': len(vehicles),
+        'vehicles_used': len(loads),
+        'loads': [
+            {
+                'vehicle': load.vehicle[0],
+                'zone': load.zone,
+                'shipments': sorted(item[0] for item in load.items),
+                'destinations': sorted({item[4] for item in load.items}),
+                'weight': round(load.weight, 2),
+                'volume': round(load.volume, 2),
+                'weight_utilization': percent(load.weight, load.vehicle[1]),
+                'volume_utilization': percent(load.volume, load.vehicle[2]),
+            }
+            for load in loads
+        ],
+        'unassigned': [{'shipment': item[0], 'reason': reason} for item, reason in leftovers],
+    }
@@ -0,0 +1,35 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from logistics.dispatching import dispatch
+from logistics.routing import plan_routes, save_plans
+
+class Command(BaseCommand):
+    help = 'Create the tours of a day: pack pending shipments into vehicles and match drivers to them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Tour date (YYYY-MM-DD), today by default')
+        parser.add_argument('--dry-run', action='store_true', help='Report the assignment without writing')
+        parser.add_argument('--optimize-routes', action='store_true', help='Order the stops of the new tours')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate()
+        report = dispatch(day, dry_run=options['dry_run'])
+        for tour in report['tours']:
+            self.stdout.write(
+                f"Driver {tour['driver']} on vehicle {tour['vehicle']} ({tour['zone'] or 'no zone'}): "
+                f"{len(tour['shipments'])} shipments, cost {tour['cost']}"
+            )
+        for load in report['loads_without_driver']:
+            self.stdout.write(f"No driver for vehicle {load['vehicle']} ({len(load['shipments'])} shipments)")
+        for entry in report['unassigned']:
+            self.stdout.write(f"Shipment {entry['shipment']} not planned: {entry['reason']}")
+
+        verb = 'Would dispatch' if options['dry_run'] else 'Dispatched'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report['dispatched']} of {report['shipments']} shipments on {len(report['tours'])} tours for {day}"
+        ))
+        if options['optimize_routes'] and not options['dry_run'] and report['tours']:
+            plans = plan_routes([tour['tour'] for tour in report['tours']], workers=settings.ROUTE_OPTIMIZER_WORKERS)
+            self.stdout.write(self.style.SUCCESS(f'Optimized {save_plans(plans)} routes'))
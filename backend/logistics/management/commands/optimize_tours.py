@@ -0,0 +1,34 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from logistics.models import Tour
+from logistics.routing import plan_routes, save_plans
+
+class Command(BaseCommand):
+    help = 'Order the stops of the planned tours of a day and estimate their distance and duration'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Tour date (YYYY-MM-DD), today by default')
+        parser.add_argument(
+            '--workers', type=int, default=settings.ROUTE_OPTIMIZER_WORKERS,
+            help='Processes solving zones in parallel (0 or 1 solves in this process)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Print the plans without saving them')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate()
+        tour_ids = list(
+            Tour.objects.filter(date=day, status=Tour.Status.PLANNED).order_by('id').values_list('id', flat=True)
+        )
+        plans = plan_routes(tour_ids, workers=options['workers'])
+        for plan in plans.values():
+            unrouted = f", {len(plan['unrouted'])} unrouted" if plan['unrouted'] else ''
+            self.stdout.write(
+                f"Tour {plan['tour']} ({plan['zone'] or 'no zone'}): {len(plan['stops'])} stops, "
+                f"{plan['distance_km']} km, {plan['duration_hours']} h{unrouted}"
+            )
+        if options['dry_run']:
+            return
+        saved = save_plans(plans)
+        self.stdout.write(self.style.SUCCESS(f'Optimized {saved} tours for {day}'))
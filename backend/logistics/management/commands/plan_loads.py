@@ -0,0 +1,25 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from logistics.loading import plan_loads
+
+class Command(BaseCommand):
+    help = 'Pack the pending shipments into the available vehicles and report their utilization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Planning day (YYYY-MM-DD), today by default')
+
+    def handle(self, *args, **options):
+        plan = plan_loads(options['date'] or timezone.localdate())
+        for load in plan['loads']:
+            volume = f"{load['volume_utilization']}%" if load['volume_utilization'] is not None else 'n/a'
+            self.stdout.write(
+                f"Vehicle {load['vehicle']} ({load['zone'] or 'no zone'}): {len(load['shipments'])} shipments, "
+                f"{load['weight']} kg ({load['weight_utilization']}%), {load['volume']} m3 ({volume})"
+            )
+        for entry in plan['unassigned']:
+            self.stdout.write(f"Shipment {entry['shipment']} not planned: {entry['reason']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Planned {plan['planned']} of {plan['shipments']} shipments on "
+            f"{plan['vehicles_used']} of {plan['vehicles_available']} vehicles"
+        ))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from logistics.jobs import prune_jobs
+
+class Command(BaseCommand):
+    help = 'Delete finished and failed document jobs, and their PDFs, past the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.DOCUMENT_JOB_RETENTION_DAYS,
+            help='Days to keep a job after it finished or failed'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days cannot be negative')
+        deleted = prune_jobs(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} document jobs older than {options['days']} days"))
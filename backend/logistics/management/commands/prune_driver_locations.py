@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from logistics.models import DriverLocation
+
+class Command(BaseCommand):
+    help = 'Drop GPS fixes older than the retention period, a whole day at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.DRIVER_LOCATION_RETENTION_DAYS,
+            help='Days of fixes to keep, today included'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        cutoff = timezone.localdate() - timedelta(days=options['days'] - 1)
+        # No signals or relations on DriverLocation, so this is one DELETE on the day index
+        deleted, _ = DriverLocation.objects.filter(day__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} driver locations before {cutoff}'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from logistics.analytics import check_monthly_stats, rebuild_monthly_stats
+from logistics.management.months import parse_month
+
+class Command(BaseCommand):
+    help = 'Check the monthly analytics rollups against the shipment and incident tables, or rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_month, help='Only months from YYYY-MM on (periodic compaction)')
+        parser.add_argument('--check', action='store_true', help='Report differences without rewriting the rollups')
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if options['check']:
+            differences = check_monthly_stats(since)
+            for table, key, stored, actual in differences:
+                self.stdout.write(f'{table} {key}: stored {stored}, actual {actual}')
+            if differences:
+                raise CommandError(f'{len(differences)} rollup buckets are out of date')
+            self.stdout.write(self.style.SUCCESS('Monthly rollups are consistent'))
+            return
+
+        shipment_buckets, incident_buckets = rebuild_monthly_stats(since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {shipment_buckets} shipment and {incident_buckets} incident monthly rollups'
+        ))
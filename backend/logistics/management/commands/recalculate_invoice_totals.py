@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from logistics.models import Invoice
+from logistics.billing import recalculate_invoice_totals
+
+class Command(BaseCommand):
+    help = 'Recompute HT/TVA/TTC for invoices from the costs of their shipments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', type=int, action='append', help='Client id (repeatable)')
+        parser.add_argument('--status', action='append', choices=Invoice.Status.values, help='Invoice status (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['client']:
+            invoices = invoices.filter(client_id__in=options['client'])
+        if options['status']:
+            invoices = invoices.filter(status__in=options['status'])
+
+        scanned, changed = recalculate_invoice_totals(
+            invoices, chunk_size=options['chunk_size'], dry_run=options['dry_run']
+        )
+
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(f'{verb} totals of {changed} of {scanned} invoices'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from logistics.models import Shipment
+from logistics.pricing import reprice_shipments
+
+class Command(BaseCommand):
+    help = 'Recompute calculated_cost for shipments after a tariff change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--destination', type=int, action='append', help='Destination id (repeatable)')
+        parser.add_argument('--service-type', type=int, action='append', help='Service type id (repeatable)')
+        parser.add_argument('--status', action='append', choices=Shipment.Status.values, help='Shipment status (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        shipments = Shipment.objects.all()
+        if options['destination']:
+            shipments = shipments.filter(destination_id__in=options['destination'])
+        if options['service_type']:
+            shipments = shipments.filter(service_type_id__in=options['service_type'])
+        if options['status']:
+            shipments = shipments.filter(status__in=options['status'])
+
+        scanned, changed, amount_delta = reprice_shipments(
+            shipments, chunk_size=options['chunk_size'], dry_run=options['dry_run']
+        )
+
+        verb = 'Would reprice' if options['dry_run'] else 'Repriced'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} {changed} of {scanned} shipments (total change: {amount_delta} DA)')
+        )
@@ -0,0 +1,49 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from logistics.models import Shipment, DocumentJob
+from logistics.billing import run_billing
+from logistics.jobs import enqueue_jobs
+from logistics.management.months import parse_month
+
+class Command(BaseCommand):
+    help = 'Create one invoice per client for all uninvoiced shipments of a period (month-end billing)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Bill a calendar month, as YYYY-MM')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day of the period (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Day after the period (YYYY-MM-DD)')
+        parser.add_argument('--client', type=int, action='append', help='Client id (repeatable)')
+        parser.add_argument('--status', action='append', choices=Shipment.Status.values, help='Shipment status (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--render-pdfs', action='store_true', help='Queue a PDF job for every new invoice')
+        parser.add_argument('--dry-run', action='store_true', help='Report counts and amounts without writing')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            start = parse_month(options['month'])
+            end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        elif options['start'] and options['end']:
+            start, end = options['start'], options['end']
+        else:
+            raise CommandError('Give --month or both --start and --end')
+
+        report = run_billing(
+            start, end, clients=options['client'], statuses=options['status'],
+            dry_run=options['dry_run'], chunk_size=options['chunk_size'],
+        )
+
+        for row in report['clients']:
+            self.stdout.write(f"{row['client_name']}: {row['shipments']} shipments, {row['amount_ht']} DA HT")
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Would create {len(report['clients'])} invoices for {report['shipments']} shipments "
+                f"({report['amount_ht']} DA HT)"
+            ))
+            return
+
+        if options['render_pdfs'] and report['invoices']:
+            enqueue_jobs(DocumentJob.Kind.INVOICE, [{'invoice': pk} for pk in report['invoices']])
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(report['invoices'])} invoices for {report['shipments']} shipments "
+            f"({report['amount_ht']} DA HT)"
+        ))
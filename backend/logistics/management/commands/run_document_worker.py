@@ -0,0 +1,104 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from logistics.jobs import claim_jobs, complete_job, fail_job, requeue_stale_jobs, run_job
+
+class Command(BaseCommand):
+    help = 'Render queued document jobs (invoice and slip PDFs) on a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: one per CPU, 0 renders in this process)')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between queue checks when idle')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        self.done = self.failed = 0
+        self.next_sweep = 0
+        self.sweep()
+
+        if workers == 0:
+            self.run_inline(options)
+        else:
+            self.run_pool(workers or multiprocessing.cpu_count(), options)
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {self.done} documents ({self.failed} failed attempts)'))
+
+    def sweep(self, running=()):
+        """
+        Requeue jobs abandoned by a dead worker, at most every
+        DOCUMENT_JOB_SWEEP_INTERVAL seconds. Jobs this worker is rendering
+        are left alone however long they take.
+        """
+        if time.monotonic() < self.next_sweep:
+            return
+        self.next_sweep = time.monotonic() + settings.DOCUMENT_JOB_SWEEP_INTERVAL
+        requeued = requeue_stale_jobs(exclude=running)
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} abandoned jobs')
+
+    def record(self, job_id, outcome):
+        """`outcome` is a callable returning (name, content) or raising the job's error"""
+        try:
+            name, content = outcome()
+        except Exception as exc:
+            self.failed += 1
+            status = fail_job(job_id, f'{type(exc).__name__}: {exc}')
+            self.stderr.write(f'Job {job_id} failed ({status}): {exc}')
+        else:
+            self.done += 1
+            complete_job(job_id, name, content)
+
+    def run_inline(self, options):
+        while True:
+            self.sweep()
+            claimed = claim_jobs(1)
+            for job_id in claimed:
+                self.record(job_id, lambda: run_job(job_id))
+            if not claimed:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+
+    def new_pool(self, workers):
+        # Fresh interpreters: forked children would share the parent's database connections
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+
+    def run_pool(self, workers, options):
+        pool = self.new_pool(workers)
+        pending = {}
+        try:
+            while True:
+                self.sweep(running=pending.values())
+                for job_id in claim_jobs(workers - len(pending)):
+                    pending[pool.submit(run_job, job_id)] = job_id
+                if not pending:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                finished, _ = wait(pending, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    job_id = pending.pop(future)
+                    broken = broken or isinstance(future.exception(), BrokenProcessPool)
+                    self.record(job_id, future.result)
+                if broken:
+                    # A worker died (e.g. out of memory): every job still on the pool is lost too
+                    for job_id in pending.values():
+                        fail_job(job_id, 'Worker pool restarted')
+                    pending = {}
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.new_pool(workers)
+        finally:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from logistics.distances import destination_distances
+
+class Command(BaseCommand):
+    help = 'Extend the memory-mapped destination distance matrix with new and moved destinations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every row instead of only the changed ones')
+
+    def handle(self, *args, **options):
+        added, moved, removed = destination_distances().update(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Distance matrix updated: {added} destinations added, {moved} moved, {removed} removed'
+        ))
@@ -5,10 +5,11 @@ class Command(BaseCommand):
     help = 'Update vehicle statuses based on active tours'
 
     def handle(self, *args, **options):
-        vehicles = Vehicle.objects.all()
-        for vehicle in vehicles:
-            vehicle.update_status()
-        
+        now_in_use, now_available = Vehicle.reconcile_statuses()
+
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully updated {vehicles.count()} vehicle statuses')
+            self.style.SUCCESS(
+                f'Successfully updated {now_in_use + now_available} vehicle statuses '
+                f'({now_in_use} now in use, {now_available} now available)'
+            )
         )
@@ -0,0 +1,10 @@
+from datetime import date
+from django.core.management.base import CommandError
+
+def parse_month(value):
+    """First day of a YYYY-MM month given on the command line"""
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        return date(year, month, 1)
+    except ValueError:
+        raise CommandError(f'Invalid month "{value}", expected YYYY-MM')
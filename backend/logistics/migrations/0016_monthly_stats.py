@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:34
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def as_month(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def populate_monthly_stats(apps, schema_editor):
+    Shipment = apps.get_model('logistics', 'Shipment')
+    Incident = apps.get_model('logistics', 'Incident')
+    ShipmentMonthlyStat = apps.get_model('logistics', 'ShipmentMonthlyStat')
+    IncidentMonthlyStat = apps.get_model('logistics', 'IncidentMonthlyStat')
+
+    rows = (
+        Shipment.objects.annotate(month=TruncMonth('date'))
+        .values_list('month', 'status', 'destination_id', 'service_type_id')
+        .annotate(count=Count('id'), revenue=Sum('calculated_cost'))
+        .order_by()
+    )
+    ShipmentMonthlyStat.objects.bulk_create([
+        ShipmentMonthlyStat(
+            month=as_month(month), status=status, destination_id=destination_id,
+            service_type_id=service_type_id, shipment_count=count, revenue=revenue or 0,
+        )
+        for month, status, destination_id, service_type_id, count, revenue in rows
+    ], batch_size=1000)
+
+    rows = Incident.objects.annotate(month=TruncMonth('date')).values_list('month').annotate(count=Count('id')).order_by()
+    IncidentMonthlyStat.objects.bulk_create([
+        IncidentMonthlyStat(month=as_month(month), incident_count=count) for month, count in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0015_documentjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentMonthlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('incident_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShipmentMonthlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('IN_TRANSIT', 'In Transit'), ('SORTING_CENTER', 'Sorting Center'), ('OUT_FOR_DELIVERY', 'Out for Delivery'), ('DELIVERED', 'Delivered'), ('DELIVERY_FAILED', 'Delivery Failed')], max_length=20)),
+                ('shipment_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='logistics.destination')),
+                ('service_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='logistics.servicetype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('month', 'status', 'destination', 'service_type'), name='shipment_monthly_stat_unique')],
+            },
+        ),
+        migrations.RunPython(populate_monthly_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0016_monthly_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='documentjob',
+            name='documentjob_queue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='claim',
+            index=models.Index(fields=['date'], name='claim_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentjob',
+            index=models.Index(condition=models.Q(('status', 'QUEUED')), fields=['available_at', 'id'], name='documentjob_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['date', 'id'], name='incident_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['date', 'id'], name='invoice_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['date', 'id'], name='shipment_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['status', 'date'], name='shipment_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['client', 'date'], name='shipment_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['driver', 'date'], name='shipment_driver_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['destination', 'date'], name='shipment_pending_dest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipmentstatushistory',
+            index=models.Index(fields=['shipment', '-timestamp'], name='status_history_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['date', 'vehicle'], name='tour_date_vehicle_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['date', 'id'], name='tour_date_id_idx'),
+        ),
+    ]
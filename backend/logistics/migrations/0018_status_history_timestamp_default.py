@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0017_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shipmentstatushistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0018_status_history_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('recorded_at', models.DateTimeField()),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('speed', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('heading', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('driver', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='logistics.driver')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['driver', 'recorded_at'], name='driverlocation_track_idx'), models.Index(fields=['day'], name='driverlocation_day_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0020_route_planning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0021_client_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='volume_capacity',
+            field=models.FloatField(blank=True, help_text='Cargo volume in m3, empty if not limited', null=True),
+        ),
+    ]
@@ -1,12 +1,16 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
+from django.core.cache import caches, InvalidCacheBackendError
 from decimal import Decimal
 import re
 import secrets
+import threading
+import time
 from django.utils import timezone
 from datetime import timedelta
 
@@ -53,6 +57,9 @@ class Client(models.Model):
     contact_info = models.CharField(max_length=255, validators=[validate_algerian_phone], help_text="Format: 0555123456")
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.ACTIVE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Geocoded `address`, for pickups and distance estimates (logistics.distances)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -83,23 +90,36 @@ class Vehicle(models.Model):
 
     license_plate = models.CharField(max_length=20, unique=True, validators=[validate_algerian_plate], help_text="Format: 123456-16")
     capacity = models.FloatField(help_text="Capacity in kg or m3")
+    # The load planner (logistics.loading) reads `capacity` as kg and this as the cargo volume
+    volume_capacity = models.FloatField(null=True, blank=True, help_text="Cargo volume in m3, empty if not limited")
     vehicle_type = models.CharField(max_length=50)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.AVAILABLE)
 
     def update_status(self):
         """Automatically update status based on active tours"""
-        from django.utils import timezone
-        today = timezone.now().date()
-        
-        # Check if vehicle has an active tour today
-        active_tour = self.tour_set.filter(date=today).exists()
-        
-        if active_tour and self.status != self.Status.MAINTENANCE:
-            self.status = self.Status.IN_USE
-        elif self.status == self.Status.IN_USE:
-            self.status = self.Status.AVAILABLE
-        
-        self.save()
+        Vehicle.reconcile_statuses(Vehicle.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['status'])
+
+    @classmethod
+    def reconcile_statuses(cls, vehicles=None, today=None):
+        """
+        Set-based version of update_status for many vehicles: IN_USE when the
+        vehicle has a tour today, back to AVAILABLE when it no longer has one.
+        Vehicles in MAINTENANCE are never touched. Runs as two conditional
+        UPDATE statements and returns how many vehicles became (in use, available).
+        """
+        if vehicles is None:
+            vehicles = cls.objects.all()
+        today = today or timezone.now().date()
+        on_tour = Tour.objects.filter(date=today).values('vehicle_id')
+
+        now_in_use = vehicles.filter(id__in=on_tour).exclude(
+            status__in=[cls.Status.IN_USE, cls.Status.MAINTENANCE]
+        ).update(status=cls.Status.IN_USE)
+        now_available = vehicles.filter(status=cls.Status.IN_USE).exclude(
+            id__in=on_tour
+        ).update(status=cls.Status.AVAILABLE)
+        return now_in_use, now_available
 
     def __str__(self):
         return f"{self.vehicle_type} - {self.license_plate}"
@@ -107,6 +127,9 @@ class Vehicle(models.Model):
 class Destination(models.Model):
     name = models.CharField(max_length=255)
     zone = models.CharField(max_length=50, blank=True, null=True)
+    # Delivery point used for route planning (logistics.routing); tours skip destinations without one
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -127,6 +150,75 @@ class PricingRule(models.Model):
     def __str__(self):
         return f"{self.destination} - {self.service_type}"
 
+class PricingRuleIndex:
+    """
+    Process-local table of every PricingRule keyed by (destination_id, service_type_id).
+    Loaded with a single query on first use and dropped whenever a rule is saved or
+    deleted in this process. Changes made elsewhere (other workers, queryset.update(),
+    bulk_create) are picked up after PRICING_RULE_INDEX_TTL seconds.
+    """
+    def __init__(self):
+        self._rules = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def rules(self):
+        rules = self._rules
+        if rules is None or time.monotonic() - self._loaded_at > settings.PRICING_RULE_INDEX_TTL:
+            rules = self._load()
+        return rules
+
+    def get(self, destination_id, service_type_id):
+        return self.rules().get((destination_id, service_type_id))
+
+    def _load(self):
+        with self._lock:
+            generation = self._generation
+            rules = {}
+            for rule in PricingRule.objects.order_by('id'):
+                # Keep the oldest rule when duplicates exist for the same pair
+                rules.setdefault((rule.destination_id, rule.service_type_id), rule)
+            # Do not publish a table that an invalidation raced with
+            if generation == self._generation:
+                self._rules = rules
+                self._loaded_at = time.monotonic()
+            return rules
+
+    def invalidate(self):
+        self._generation += 1
+        self._rules = None
+
+pricing_rule_index = PricingRuleIndex()
+
+def compute_shipment_cost(rule, weight, volume, is_international, requires_customs_clearance, customs_value):
+    """
+    Shipment cost formula, shared by Shipment.calculate_cost and the bulk
+    re-pricing in logistics.pricing so both agree to the cent.
+    """
+    if rule is None:
+        return Decimal('0.00')
+
+    base_cost = rule.base_tariff + (weight * rule.weight_rate) + (volume * rule.volume_rate)
+    
+    # Add international shipment surcharge
+    if is_international:
+        # International shipments typically cost 2-3x more due to customs, documentation, and handling
+        international_multiplier = Decimal('2.5')
+        base_cost = base_cost * international_multiplier
+        
+        # Add customs clearance fee if required
+        if requires_customs_clearance:
+            customs_fee = Decimal('5000.00')  # Base customs clearance fee in DZD
+            base_cost = base_cost + customs_fee
+        
+        # Add surcharge based on customs value (higher value = higher insurance/customs cost)
+        if customs_value and customs_value > Decimal('100000'):
+            value_surcharge = (customs_value - Decimal('100000')) * Decimal('0.05')  # 5% of value above 100k
+            base_cost = base_cost + value_surcharge
+    
+    return base_cost
+
 class Shipment(models.Model):
     class Status(models.TextChoices):
         PENDING = 'PENDING', _('Pending')
@@ -162,47 +254,70 @@ class Shipment(models.Model):
     
     calculated_cost = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination (newest first) and date-range scans (billing, rollups)
+            models.Index(fields=['date', 'id'], name='shipment_date_id_idx'),
+            # The list filters, each still ordered by date so a page is one range scan
+            models.Index(fields=['status', 'date'], name='shipment_status_date_idx'),
+            models.Index(fields=['client', 'date'], name='shipment_client_date_idx'),
+            models.Index(fields=['driver', 'date'], name='shipment_driver_date_idx'),
+            # Work queue of shipments waiting to be dispatched, per destination
+            models.Index(
+                fields=['destination', 'date'], name='shipment_pending_dest_idx',
+                condition=models.Q(status='PENDING'),
+            ),
+        ]
+
     def calculate_cost(self):
-        # Find pricing rule
-        try:
-            rule = PricingRule.objects.get(destination=self.destination, service_type=self.service_type)
-            base_cost = rule.base_tariff + (self.weight * rule.weight_rate) + (self.volume * rule.volume_rate)
-            
-            # Add international shipment surcharge
-            if self.is_international:
-                # International shipments typically cost 2-3x more due to customs, documentation, and handling
-                international_multiplier = Decimal('2.5')
-                base_cost = base_cost * international_multiplier
-                
-                # Add customs clearance fee if required
-                if self.requires_customs_clearance:
-                    customs_fee = Decimal('5000.00')  # Base customs clearance fee in DZD
-                    base_cost = base_cost + customs_fee
-                
-                # Add surcharge based on customs value (higher value = higher insurance/customs cost)
-                if self.customs_value and self.customs_value > Decimal('100000'):
-                    value_surcharge = (self.customs_value - Decimal('100000')) * Decimal('0.05')  # 5% of value above 100k
-                    base_cost = base_cost + value_surcharge
-            
-            return base_cost
-        except PricingRule.DoesNotExist:
-            return Decimal('0.00')
+        # Find pricing rule (served from memory, see PricingRuleIndex)
+        rule = pricing_rule_index.get(self.destination_id, self.service_type_id)
+        return compute_shipment_cost(
+            rule, self.weight, self.volume, self.is_international,
+            self.requires_customs_clearance, self.customs_value,
+        )
 
     def save(self, *args, **kwargs):
         if not self.calculated_cost:
             self.calculated_cost = self.calculate_cost()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which monthly rollup bucket the row was loaded in, so a save
+        # can move it without reading the old row back
+        if not ROLLUP_FIELDS & instance.get_deferred_fields():
+            instance._rollup_entry = instance.rollup_entry()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        if not ROLLUP_FIELDS & self.get_deferred_fields():
+            self._rollup_entry = self.rollup_entry()
+
+    def rollup_entry(self):
+        """(ShipmentMonthlyStat key, revenue) this shipment counts towards"""
+        key = {
+            'month': month_of(self.date),
+            'status': self.status,
+            'destination_id': self.destination_id,
+            'service_type_id': self.service_type_id,
+        }
+        return key, self.calculated_cost or Decimal('0.00')
+
     def __str__(self):
         return self.tracking_number
 
 class ShipmentStatusHistory(models.Model):
     shipment = models.ForeignKey(Shipment, on_delete=models.CASCADE, related_name='status_history')
     status = models.CharField(max_length=20, choices=Shipment.Status.choices)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the change happens, so rows written later in a batch keep their time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['shipment', '-timestamp'], name='status_history_timeline_idx')]
     
     def __str__(self):
         return f"{self.shipment.tracking_number} - {self.status} at {self.timestamp}"
@@ -222,11 +337,20 @@ class Tour(models.Model):
     fuel_consumption = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     incidents = models.TextField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PLANNED)
+    # Shipment ids in delivery order, written by the route optimizer (manage.py optimize_tours)
+    stop_order = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        indexes = [
+            # Vehicles on tour on a given day (Vehicle.reconcile_statuses), answered from the index alone
+            models.Index(fields=['date', 'vehicle'], name='tour_date_vehicle_idx'),
+            models.Index(fields=['date', 'id'], name='tour_date_id_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         # Update vehicle status when tour is created
-        self.vehicle.update_status()
+        Vehicle.reconcile_statuses(Vehicle.objects.filter(pk=self.vehicle_id))
     
     def __str__(self):
         return f"Tour {self.id} - {self.driver}"
@@ -248,6 +372,9 @@ class Invoice(models.Model):
     paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.UNPAID)
 
+    class Meta:
+        indexes = [models.Index(fields=['date', 'id'], name='invoice_date_id_idx')]
+
     @property
     def remaining_balance(self):
         return self.amount_ttc - self.paid_amount
@@ -261,12 +388,16 @@ class Invoice(models.Model):
         else:
             self.status = self.Status.UNPAID
 
-    def calculate_totals(self):
-
-        total_ht = sum(s.calculated_cost for s in self.shipments.all() if s.calculated_cost)
+    def set_totals(self, total_ht):
+        """Derive TVA and TTC from the sum of the shipment costs"""
         self.amount_ht = total_ht
         self.tva = total_ht * Decimal('0.19') # 19% TVA
         self.amount_ttc = self.amount_ht + self.tva
+
+    def calculate_totals(self):
+        # Let the database add up the costs instead of loading every shipment
+        total_ht = self.shipments.aggregate(total=models.Sum('calculated_cost'))['total']
+        self.set_totals(total_ht or Decimal('0.00'))
         self.save()
 
     def __str__(self):
@@ -282,6 +413,9 @@ class Incident(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.OPEN)
 
+    class Meta:
+        indexes = [models.Index(fields=['date', 'id'], name='incident_date_id_idx')]
+
     def __str__(self):
         return f"Incident on {self.shipment}"
 
@@ -312,9 +446,163 @@ class Claim(models.Model):
     resolved_date = models.DateTimeField(null=True, blank=True)
     resolution_notes = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['date'], name='claim_date_idx')]
+
     def __str__(self):
         return f"Claim #{self.id} - {self.client.name}"
 
+class DocumentJob(models.Model):
+    """
+    A PDF render queued for the document worker (manage.py run_document_worker).
+    The finished file is kept on the row until manage.py prune_document_jobs
+    deletes the job, DOCUMENT_JOB_RETENTION_DAYS after it ended.
+    """
+    class Kind(models.TextChoices):
+        INVOICE = 'INVOICE', _('Invoice')
+        SLIP = 'SLIP', _('Shipment Slip')
+        SLIP_BATCH = 'SLIP_BATCH', _('Slip Batch')
+
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', _('Queued')
+        RUNNING = 'RUNNING', _('Running')
+        DONE = 'DONE', _('Done')
+        DEAD = 'DEAD', _('Failed')
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # Earliest time the worker may pick the job up; pushed back after a failure
+    available_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    result = models.BinaryField(null=True, editable=False)
+    result_name = models.CharField(max_length=255, blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='document_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Only queued jobs are ever looked up by due time
+            models.Index(
+                fields=['available_at', 'id'], name='documentjob_queue_idx',
+                condition=models.Q(status='QUEUED'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job #{self.id} ({self.status})"
+
+class DriverLocation(models.Model):
+    """
+    One GPS fix reported by a driver's device. Rows are only ever inserted
+    (see logistics.tracking) and dropped a whole day at a time by
+    manage.py prune_driver_locations; `day` is the partition key.
+    """
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='locations', db_index=False)
+    day = models.DateField()
+    recorded_at = models.DateTimeField()
+    lat = models.FloatField()
+    lng = models.FloatField()
+    # km/h and degrees from north, when the device reports them
+    speed = models.PositiveSmallIntegerField(null=True, blank=True)
+    heading = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # A driver's track and their latest fix (cache miss)
+            models.Index(fields=['driver', 'recorded_at'], name='driverlocation_track_idx'),
+            models.Index(fields=['day'], name='driverlocation_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.driver_id} at {self.recorded_at}: {self.lat}, {self.lng}"
+
+class ShipmentMonthlyStat(models.Model):
+    """
+    Shipment count and revenue per month, status, destination and service type.
+    Kept current by the Shipment signals below; rebuilt from scratch by
+    manage.py rebuild_monthly_stats (see logistics.analytics).
+    """
+    month = models.DateField()
+    status = models.CharField(max_length=20, choices=Shipment.Status.choices)
+    destination = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='+')
+    service_type = models.ForeignKey(ServiceType, on_delete=models.CASCADE, related_name='+')
+    shipment_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['month', 'status', 'destination', 'service_type'], name='shipment_monthly_stat_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.status}: {self.shipment_count}"
+
+class IncidentMonthlyStat(models.Model):
+    """Incidents opened per month, maintained like ShipmentMonthlyStat"""
+    month = models.DateField(unique=True)
+    incident_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.month:%Y-%m}: {self.incident_count}"
+
+# Shipment columns the monthly rollup depends on
+ROLLUP_FIELDS = {'date', 'status', 'destination_id', 'service_type_id', 'calculated_cost'}
+_unknown = object()
+
+def month_of(moment, zone=None):
+    """First day of the month `moment` falls in, in the current time zone (as TruncMonth)"""
+    return timezone.localtime(moment, zone).date().replace(day=1)
+
+def bump_rollup(model, key, **deltas):
+    """Add `deltas` to the rollup row for `key`, creating it on first use"""
+    changes = {name: models.F(name) + delta for name, delta in deltas.items()}
+    if model.objects.filter(**key).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another request created the row in the meantime
+        model.objects.filter(**key).update(**changes)
+
+def record_new_shipments(shipments):
+    """Rollup bookkeeping for shipments inserted with bulk_create (no signals fire)"""
+    buckets = {}
+    for shipment in shipments:
+        key, revenue = shipment.rollup_entry()
+        bucket = tuple(sorted(key.items()))
+        count, total = buckets.get(bucket, (0, Decimal('0.00')))
+        buckets[bucket] = (count + 1, total + revenue)
+    for bucket, (count, revenue) in buckets.items():
+        bump_rollup(ShipmentMonthlyStat, dict(bucket), shipment_count=count, revenue=revenue)
+
+def tracking_page_key(tracking_number):
+    return f'tracking-page:{tracking_number}'
+
+def forget_tracking_pages(tracking_numbers):
+    """Drop the cached public tracking pages (logistics.tracking.tracking_page) of these shipments"""
+    keys = [tracking_page_key(number) for number in tracking_numbers]
+    if not keys:
+        return
+    try:
+        cache = caches['tracking']
+    except InvalidCacheBackendError:
+        # Settings without the alias serve no cached pages, so there is nothing to drop
+        return
+    cache.delete_many(keys)
+
+def forget_tracking_pages_now_and_on_commit(tracking_numbers):
+    """Drop the pages now and again once the change is committed, in case a reader cached the old rows meanwhile"""
+    forget_tracking_pages(tracking_numbers)
+    transaction.on_commit(lambda: forget_tracking_pages(tracking_numbers))
+
 @receiver(pre_save, sender=Invoice)
 def update_invoice_status(sender, instance, **kwargs):
     """Update invoice status before saving"""
@@ -328,6 +616,13 @@ def update_invoice_status(sender, instance, **kwargs):
     else:
         instance.status = Invoice.Status.UNPAID
 
+@receiver(post_save, sender=PricingRule)
+@receiver(post_delete, sender=PricingRule)
+def invalidate_pricing_rule_index(sender, instance, **kwargs):
+    """Drop the cached pricing table now and again once the change is committed"""
+    pricing_rule_index.invalidate()
+    transaction.on_commit(pricing_rule_index.invalidate)
+
 @receiver(post_save, sender=User)
 def create_driver_profile(sender, instance, created, **kwargs):
     """Automatically create Driver record when a DRIVER user is created"""
@@ -340,3 +635,59 @@ def create_driver_profile(sender, instance, created, **kwargs):
             email=instance.email,
             status=Driver.Status.AVAILABLE
         )
+
+@receiver(pre_save, sender=Shipment)
+def remember_shipment_rollup_entry(sender, instance, raw=False, **kwargs):
+    """Fetch the stored rollup bucket of an updated row that was not loaded in full"""
+    if raw or instance._state.adding or getattr(instance, '_rollup_entry', _unknown) is not _unknown:
+        return
+    stored = Shipment.objects.filter(pk=instance.pk).only(*ROLLUP_FIELDS).first()
+    instance._rollup_entry = stored.rollup_entry() if stored else None
+
+@receiver(post_save, sender=Shipment)
+def update_shipment_rollup(sender, instance, created, raw=False, **kwargs):
+    """Move the shipment between monthly rollup buckets when it changes"""
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_rollup_entry', None)
+    current = instance.rollup_entry()
+    if previous == current:
+        return
+    if previous:
+        key, revenue = previous
+        bump_rollup(ShipmentMonthlyStat, key, shipment_count=-1, revenue=-revenue)
+    key, revenue = current
+    bump_rollup(ShipmentMonthlyStat, key, shipment_count=1, revenue=revenue)
+    instance._rollup_entry = current
+
+@receiver(post_delete, sender=Shipment)
+def remove_shipment_from_rollup(sender, instance, **kwargs):
+    key, revenue = getattr(instance, '_rollup_entry', None) or instance.rollup_entry()
+    bump_rollup(ShipmentMonthlyStat, key, shipment_count=-1, revenue=-revenue)
+
+@receiver(post_save, sender=Incident)
+def add_incident_to_rollup(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump_rollup(IncidentMonthlyStat, {'month': month_of(instance.date)}, incident_count=1)
+
+@receiver(post_delete, sender=Incident)
+def remove_incident_from_rollup(sender, instance, **kwargs):
+    bump_rollup(IncidentMonthlyStat, {'month': month_of(instance.date)}, incident_count=-1)
+
+@receiver(post_save, sender=Shipment)
+@receiver(post_delete, sender=Shipment)
+def invalidate_tracking_page(sender, instance, raw=False, **kwargs):
+    """Drop the cached tracking page now and again once the change is committed"""
+    if not raw:
+        forget_tracking_pages_now_and_on_commit([instance.tracking_number])
+
+@receiver(post_save, sender=ShipmentStatusHistory)
+def invalidate_tracking_page_history(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # record_status_change hands over the shipment it just saved; anything else costs one indexed lookup
+    if ShipmentStatusHistory.shipment.is_cached(instance):
+        numbers = [instance.shipment.tracking_number]
+    else:
+        numbers = list(Shipment.objects.filter(pk=instance.shipment_id).values_list('tracking_number', flat=True))
+    forget_tracking_pages_now_and_on_commit(numbers)
@@ -0,0 +1,96 @@
+from base64 import b64decode, b64encode
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class DateIdCursorPagination(BasePagination):
+    """
+    Keyset pagination over (date, id), newest first.
+    The cursor holds the (date, id) of the last row sent, so every page is one
+    range scan on the ordering columns no matter how deep the client has paged.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+    # Date or datetime column the keyset starts with
+    date_field = 'date'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request, queryset)
+
+        queryset = queryset.order_by(f'-{self.date_field}', '-id')
+        if position is not None:
+            date, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{self.date_field}__lt': date}) | Q(**{self.date_field: date, 'id__lt': pk})
+            )
+
+        # Fetch one extra row to know whether another page follows
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            date, pk = b64decode(encoded.encode('ascii')).decode('ascii').rsplit('|', 1)
+            date = queryset.model._meta.get_field(self.date_field).to_python(date)
+            pk = int(pk)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        if date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return date, pk
+
+    def encode_cursor(self, instance):
+        position = f"{getattr(instance, self.date_field).isoformat()}|{instance.pk}"
+        return b64encode(position.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'first': self.get_first_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+class CreatedAtCursorPagination(DateIdCursorPagination):
+    """The same keyset pagination for tables without a business date"""
+    date_field = 'created_at'
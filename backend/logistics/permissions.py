@@ -46,3 +46,11 @@ class IsDriver(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         return request.user.role == 'DRIVER'
+
+class CanDispatch(permissions.BasePermission):
+    """
+    Admin, Manager, Agent: Can plan loads and dispatch tours
+    Others: No access
+    """
+    def has_permission(self, request, view):
+        return request.user.role in ['ADMIN', 'MANAGER', 'AGENT']
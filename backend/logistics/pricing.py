@@ -0,0 +1,175 @@
+from decimal import Decimal
+import numpy as np
+from django.db import connections, router, transaction
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Coalesce, Round
+from django.utils import timezone
+from .models import (
+    Shipment, ShipmentMonthlyStat, bump_rollup, compute_shipment_cost, forget_tracking_pages_now_and_on_commit,
+    month_of, pricing_rule_index,
+)
+
+CENT = Decimal('0.01')
+
+def in_cents(name):
+    """A decimal(·, 2) column as a whole number of cents, converted by the database"""
+    return Cast(Round(F(name) * 100), BigIntegerField())
+
+# Columns price_rows needs after (destination_id, service_type_id), in
+# compute_shipment_cost's argument order, with the amounts in cents
+PRICING_COLUMNS = {
+    'weight_cents': in_cents('weight'),
+    'volume_cents': in_cents('volume'),
+    'international': F('is_international'),
+    'customs_clearance': F('requires_customs_clearance'),
+    'customs_value_cents': Coalesce(in_cents('customs_value'), 0),
+}
+
+# In units of 10**-5 the formula is exact integer arithmetic: the rate products
+# have 4 decimals and the 2.5 multiplier adds a fifth. Rows whose worst case
+# could leave int64 are priced through compute_shipment_cost instead.
+SCALE = 10 ** 5
+INT64_SAFE = float(2 ** 62)
+
+def cents_array(values):
+    """Whole cents (None as 0) as an int64 array"""
+    return np.fromiter((value or 0 for value in values), dtype=np.int64, count=len(values))
+
+def from_cents(value):
+    return None if value is None else Decimal(value).scaleb(-2)
+
+def price_rows(rows):
+    """
+    Price (destination_id, service_type_id, *PRICING_COLUMNS) tuples in one pass
+    over NumPy arrays. Returns an int64 array of costs in cents, in the same order,
+    equal to compute_shipment_cost(...).quantize(CENT) (ties go to the even cent).
+    """
+    if not rows:
+        return np.zeros(0, dtype=np.int64)
+    destination_ids, service_type_ids, weight, volume, international, customs, customs_value = zip(*rows)
+    weight, volume, customs_value = (np.array(column, dtype=np.int64) for column in (weight, volume, customs_value))
+    international = np.array(international, dtype=bool)
+    customs = np.array(customs, dtype=bool) & international
+
+    # One rule lookup per distinct (destination, service type) pair; rows without a rule cost 0.00
+    destination_ids, service_type_ids = np.array(destination_ids, dtype=np.int64), np.array(service_type_ids, dtype=np.int64)
+    stride = int(service_type_ids.max()) + 1
+    pairs, slot = np.unique(destination_ids * stride + service_type_ids, return_inverse=True)
+    rules = pricing_rule_index.rules()
+    table = [rules.get(divmod(pair, stride)) for pair in pairs.tolist()]
+    priced = np.array([rule is not None for rule in table])[slot]
+    tariffs = np.array(
+        [[int(amount * 100) for amount in (rule.base_tariff, rule.weight_rate, rule.volume_rate)] if rule else [0, 0, 0]
+         for rule in table],
+        dtype=np.int64,
+    )
+    base_tariff, weight_rate, volume_rate = tariffs[slot].T
+
+    # Same steps as compute_shipment_cost
+    cost = (base_tariff * 100 + weight * weight_rate + volume * volume_rate) * np.where(international, 25, 10)
+    cost += np.where(customs, 5000 * SCALE, 0)
+    surcharged = international & (customs_value > 100000 * 100)
+    cost += np.where(surcharged, (customs_value - 100000 * 100) * 5 * 10, 0)
+    cost = np.where(priced, cost, 0)
+
+    # Round to the cent, ties to even: floor division leaves a remainder in [0, 1000)
+    cents, remainder = np.divmod(cost, SCALE // 100)
+    cents += (remainder > 500) | ((remainder == 500) & (cents % 2 == 1))
+
+    # Upper bound of |cost| in floating point, which cannot wrap around like int64 does
+    size = lambda column: np.abs(column).astype(np.float64)
+    worst = (
+        (size(base_tariff) * 100 + size(weight) * size(weight_rate) + size(volume) * size(volume_rate)) * 25
+        + size(customs_value) * 50 + 5000 * SCALE
+    )
+    for index in np.flatnonzero(priced & (worst >= INT64_SAFE)).tolist():
+        destination_id, service_type_id, weight_cents, volume_cents, is_international, requires_customs, value_cents = rows[index]
+        exact = compute_shipment_cost(
+            rules.get((destination_id, service_type_id)), from_cents(weight_cents), from_cents(volume_cents),
+            is_international, requires_customs, from_cents(value_cents),
+        )
+        cents[index] = int(exact.quantize(CENT).scaleb(2))
+    return cents
+
+def write_costs(updates, updated_at):
+    """
+    Write [(shipment id, tracking number, cost), ...] with one prepared UPDATE run
+    through executemany. QuerySet.bulk_update would build a CASE/WHEN expression
+    per row, which costs more than the pricing itself. Values are adapted by the
+    model fields exactly as Shipment.save() would store them.
+    """
+    using = router.db_for_write(Shipment)
+    connection = connections[using]
+    cost_field = Shipment._meta.get_field('calculated_cost')
+    updated_field = Shipment._meta.get_field('updated_at')
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} = %s, {} = %s WHERE {} = %s'.format(
+        quote(Shipment._meta.db_table), quote(cost_field.column),
+        quote(updated_field.column), quote(Shipment._meta.pk.column),
+    )
+    updated_at = updated_field.get_db_prep_save(updated_at, connection)
+    params = [(cost_field.get_db_prep_save(cost, connection), updated_at, pk) for pk, _, cost in updates]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+        # The UPDATE sends no post_save, and the public tracking page shows updated_at
+        forget_tracking_pages_now_and_on_commit([tracking_number for _, tracking_number, _ in updates])
+
+def reprice_shipments(queryset=None, chunk_size=5000, dry_run=False):
+    """
+    Recompute calculated_cost for every shipment in `queryset` (all shipments by default).
+
+    Shipments are read in primary key order, `chunk_size` rows at a time, as
+    plain tuples. Only rows whose cost changed to the cent are written back,
+    one batched UPDATE per chunk, together with the revenue change of each
+    monthly rollup bucket the chunk touched (the UPDATE sends no signals).
+    Returns (scanned, changed, amount_delta).
+    """
+    if queryset is None:
+        queryset = Shipment.objects.all()
+    queryset = queryset.order_by('id')
+    scanned = changed = 0
+    amount_delta = Decimal('0.00')
+    last_id = 0
+    # Looked up once: month_of() would resolve the current time zone per row
+    zone = timezone.get_current_timezone()
+
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id).annotate(cost_cents=in_cents('calculated_cost'), **PRICING_COLUMNS).values_list(
+                'id', 'tracking_number', 'cost_cents', 'date', 'status',
+                'destination_id', 'service_type_id', *PRICING_COLUMNS
+            )[:chunk_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        scanned += len(rows)
+
+        costs = price_rows([row[5:] for row in rows])
+        old_costs = [row[2] for row in rows]
+        # A NULL cost is always rewritten, even when the new one is 0.00
+        stale = (costs != cents_array(old_costs)) | np.array([cost is None for cost in old_costs])
+        updates = []
+        # Revenue change per ShipmentMonthlyStat bucket, as Shipment.rollup_entry keys it
+        revenue = {}
+        for index in np.flatnonzero(stale).tolist():
+            pk, tracking_number, old_cents, date, status, destination_id, service_type_id, *_ = rows[index]
+            # To the cent, as numeric(10, 2) stores it; SQLite would keep every digit and SUM() them
+            new_cost = Decimal(int(costs[index])).scaleb(-2)
+            delta = new_cost - Decimal(old_cents or 0).scaleb(-2)
+            amount_delta += delta
+            updates.append((pk, tracking_number, new_cost))
+            bucket = (month_of(date, zone), status, destination_id, service_type_id)
+            revenue[bucket] = revenue.get(bucket, 0) + delta
+
+        changed += len(updates)
+        if updates and not dry_run:
+            with transaction.atomic():
+                write_costs(updates, timezone.now())
+                for (month, status, destination_id, service_type_id), delta in revenue.items():
+                    bump_rollup(ShipmentMonthlyStat, {
+                        'month': month, 'status': status,
+                        'destination_id': destination_id, 'service_type_id': service_type_id,
+                    }, revenue=delta)
+
+    return scanned, changed, amount_delta
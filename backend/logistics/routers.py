@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import connections
+
+REPLICA = 'replica'
+
+# Set while a read-only API action runs (see ReplicaReadMixin in views.py)
+replica_reads = ContextVar('replica_reads', default=False)
+
+@contextmanager
+def reading_from_replica(enabled=True):
+    """Route the reads made inside the block to the replica, when one is configured"""
+    token = replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+class ReadReplicaRouter:
+    """
+    Writes, and reads outside reading_from_replica(), go to the primary so a
+    request always sees its own changes. Reads inside it go to the replica.
+    Without a 'replica' database everything stays on 'default'.
+    """
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and REPLICA in connections.settings:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives the schema through replication
+        return db != REPLICA
@@ -0,0 +1,247 @@
+import heapq
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from .models import Tour
+from .distances import destination_distances, haversine_matrix
+
+# Candidate partners per stop in the local search: enough for near-optimal
+# tours, and it keeps each pass linear in the number of stops
+NEIGHBOURS = 10
+# Ignore "improvements" smaller than rounding noise so the search terminates
+EPSILON = 1e-9
+
+def distance_matrix(points):
+    """Straight-line km between every pair of (lat, lng) points, as a list of rows"""
+    return haversine_matrix(points, points).tolist()
+
+def route_length(route, matrix):
+    """Length of the closed tour visiting `route` in order and returning to route[0]"""
+    return sum(matrix[a][b] for a, b in zip(route, route[1:] + route[:1]))
+
+def nearest_neighbours(matrix, k):
+    """The k closest other nodes of every node, closest first"""
+    k = min(k, len(matrix) - 1)
+    return [
+        [j for j in heapq.nsmallest(k + 1, range(len(row)), key=row.__getitem__) if j != i][:k]
+        for i, row in enumerate(matrix)
+    ]
+
+def nearest_neighbour_route(matrix):
+    """Construction: start at node 0 (the depot) and always drive to the closest unvisited node"""
+    unvisited = set(range(1, len(matrix)))
+    route = [0]
+    while unvisited:
+        row = matrix[route[-1]]
+        node = min(unvisited, key=row.__getitem__)
+        unvisited.remove(node)
+        route.append(node)
+    return route
+
+def reverse_segment(route, position, p, q):
+    """
+    2-opt move: replace the edges leaving positions p and q by reversing the
+    path between them. route[0] never moves, so the depot stays first.
+    """
+    lo, hi = min(p, q) + 1, max(p, q)
+    route[lo:hi + 1] = route[lo:hi + 1][::-1]
+    for index in range(lo, hi + 1):
+        position[route[index]] = index
+
+def two_opt(route, matrix, neighbours):
+    """
+    Replace pairs of crossing edges until no exchange between a stop and one
+    of its neighbours shortens the tour. Changes `route` in place and returns
+    whether anything improved.
+    """
+    size = len(route)
+    position = [0] * size
+    for index, node in enumerate(route):
+        position[node] = index
+    improved, changed = False, True
+    while changed:
+        changed = False
+        for i in range(size):
+            a = route[i]
+            for step in (1, -1):
+                # step 1: edges (a, next a) and (c, next c); step -1: the edges arriving at a and c
+                i_edge = i if step == 1 else (i - 1) % size
+                b = route[(i + step) % size]
+                ab = matrix[a][b]
+                for c in neighbours[a]:
+                    ac = matrix[a][c]
+                    if ac >= ab:
+                        break
+                    j = position[c]
+                    d = route[(j + step) % size]
+                    if c == b or d == a:
+                        continue
+                    if ac + matrix[b][d] - ab - matrix[c][d] < -EPSILON:
+                        j_edge = j if step == 1 else (j - 1) % size
+                        reverse_segment(route, position, i_edge, j_edge)
+                        changed = improved = True
+                        break
+                if route[i] != a:
+                    break
+    return improved
+
+def or_opt(route, matrix, neighbours, max_segment=3):
+    """
+    Move runs of 1 to `max_segment` consecutive stops, either way round, next
+    to one of their neighbours when that shortens the tour. Changes `route`
+    in place and returns whether anything improved.
+    """
+    size = len(route)
+    position = [0] * size
+    for index, node in enumerate(route):
+        position[node] = index
+    improved = False
+    for length in range(1, max_segment + 1):
+        i = 1
+        while i + length <= size:
+            segment = route[i:i + length]
+            first, last = segment[0], segment[-1]
+            before, after = route[i - 1], route[(i + length) % size]
+            gain = matrix[before][first] + matrix[last][after] - matrix[before][after]
+            best = None
+            inside = set(segment)
+            for x in set(neighbours[first]) | set(neighbours[last]):
+                if x in inside:
+                    continue
+                index = position[x]
+                # The edges on either side of x once the segment is taken out
+                successor = route[(index + 1) % size]
+                predecessor = route[index - 1]
+                edges = [
+                    (x, after if successor == first else successor),
+                    (before if predecessor == last else predecessor, x),
+                ]
+                for u, v in edges:
+                    if {u, v} == {before, after}:
+                        continue
+                    for forward in (True, False):
+                        head, tail = (first, last) if forward else (last, first)
+                        cost = matrix[u][head] + matrix[tail][v] - matrix[u][v]
+                        if cost < gain - EPSILON and (best is None or cost < best[0]):
+                            best = (cost, u, forward)
+            if best is None:
+                i += 1
+                continue
+            _, u, forward = best
+            insert_at = position[u] + 1 - (length if position[u] > i else 0)
+            del route[i:i + length]
+            route[insert_at:insert_at] = segment if forward else segment[::-1]
+            for index, node in enumerate(route):
+                position[node] = index
+            improved = True
+    return improved
+
+def solve_route(matrix, max_rounds=50):
+    """
+    Order the nodes of `matrix` (node 0 is the depot) into a short closed tour:
+    nearest neighbour construction, then 2-opt and Or-opt until neither finds
+    an improvement. Returns (route starting with 0, length).
+    """
+    route = nearest_neighbour_route(matrix)
+    if len(route) > 3:
+        neighbours = nearest_neighbours(matrix, NEIGHBOURS)
+        for _ in range(max_rounds):
+            exchanged = two_opt(route, matrix, neighbours)
+            moved = or_opt(route, matrix, neighbours)
+            if not exchanged and not moved:
+                break
+    return route, route_length(route, matrix)
+
+def solve_zone(problems):
+    """
+    Worker entry point: [(tour id, points, destination ids)] -> [(tour id, route, km)].
+    No database access; distances between destinations come from the shared
+    memory-mapped matrix.
+    """
+    solved = []
+    for tour_id, points, destination_ids in problems:
+        matrix = destination_distances().matrix(points, destination_ids).tolist()
+        route, length = solve_route(matrix)
+        solved.append((tour_id, route, length))
+    return solved
+
+def load_stops(tour_ids):
+    """
+    {tour id: (stops, unrouted shipment ids)} with one query. A stop is a
+    destination with coordinates and the tour's shipments going there.
+    """
+    rows = (
+        Tour.shipments.through.objects.filter(tour_id__in=tour_ids).order_by('shipment_id').values_list(
+            'tour_id', 'shipment_id', 'shipment__destination_id', 'shipment__destination__zone',
+            'shipment__destination__latitude', 'shipment__destination__longitude',
+        )
+    )
+    tours = {tour_id: ({}, []) for tour_id in tour_ids}
+    for tour_id, shipment_id, destination_id, zone, latitude, longitude in rows:
+        stops, unrouted = tours[tour_id]
+        if latitude is None or longitude is None:
+            unrouted.append(shipment_id)
+            continue
+        stop = stops.setdefault(destination_id, {
+            'destination': destination_id, 'zone': zone, 'point': (latitude, longitude), 'shipments': [],
+        })
+        stop['shipments'].append(shipment_id)
+    return {tour_id: (list(stops.values()), unrouted) for tour_id, (stops, unrouted) in tours.items()}
+
+def plan_routes(tour_ids, workers=0):
+    """
+    Optimized stop order, distance and duration for each tour. Tours are
+    grouped by the zone most of their stops are in, and with `workers` > 1
+    the zones are solved in parallel in a process pool.
+
+    Returns {tour id: plan}, see `make_plan`.
+    """
+    tours = load_stops(tour_ids)
+    depot = (settings.DEPOT_LATITUDE, settings.DEPOT_LONGITUDE)
+    zones = {}
+    for tour_id, (stops, _) in tours.items():
+        zone = Counter(stop['zone'] for stop in stops).most_common(1)[0][0] if stops else None
+        zones.setdefault(zone, []).append((
+            tour_id, [depot] + [stop['point'] for stop in stops], [None] + [stop['destination'] for stop in stops]
+        ))
+
+    if workers > 1 and len(zones) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(zones))) as pool:
+            results = list(pool.map(solve_zone, zones.values()))
+    else:
+        results = [solve_zone(problems) for problems in zones.values()]
+
+    plans = {}
+    for zone, solved in zip(zones, results):
+        for tour_id, route, length in solved:
+            stops, unrouted = tours[tour_id]
+            plans[tour_id] = make_plan(tour_id, zone, [stops[node - 1] for node in route[1:]], unrouted, length)
+    return plans
+
+def make_plan(tour_id, zone, stops, unrouted, length):
+    distance = length * settings.ROUTE_ROAD_FACTOR
+    hours = distance / settings.ROUTE_AVERAGE_SPEED_KMH + len(stops) * settings.ROUTE_STOP_MINUTES / 60
+    return {
+        'tour': tour_id,
+        'zone': zone,
+        'stops': [{'destination': stop['destination'], 'shipments': stop['shipments']} for stop in stops],
+        # Shipments whose destination has no coordinates, left for the driver to fit in
+        'unrouted': unrouted,
+        'distance_km': Decimal(distance).quantize(Decimal('0.01')),
+        'duration_hours': Decimal(hours).quantize(Decimal('0.1')),
+    }
+
+def save_plans(plans):
+    """Write stop order, distance and duration of every plan with one bulk update"""
+    tours = []
+    for plan in plans.values():
+        stop_order = [shipment for stop in plan['stops'] for shipment in stop['shipments']] + plan['unrouted']
+        tours.append(Tour(
+            id=plan['tour'], stop_order=stop_order,
+            distance_km=plan['distance_km'], duration_hours=plan['duration_hours'],
+        ))
+    with transaction.atomic():
+        Tour.objects.bulk_update(tours, ['stop_order', 'distance_km', 'duration_hours'], batch_size=500)
+    return len(tours)
@@ -1,5 +1,8 @@
 from rest_framework import serializers
-from .models import User, Client, Driver, Vehicle, Destination, ServiceType, PricingRule, Shipment, ShipmentStatusHistory, Tour, Invoice, Incident
+from django.conf import settings
+from django.db import transaction
+from .models import User, Client, Driver, Vehicle, Destination, ServiceType, PricingRule, Shipment, ShipmentStatusHistory, Tour, Invoice, Incident, DocumentJob
+from .history import record_status_change
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False)
@@ -58,12 +61,33 @@ class PricingRuleSerializer(serializers.ModelSerializer):
         model = PricingRule
         fields = '__all__'
 
+def requested_fields(request, param):
+    """Comma separated names from a query parameter such as ?fields=id,status"""
+    if request is None:
+        return set()
+    return {name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()}
+
+class DynamicFieldsMixin:
+    """
+    Trims the representation to the names given in ?fields= on GET requests.
+    Unknown names are ignored.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        allowed = requested_fields(request, 'fields')
+        if allowed:
+            for name in set(self.fields) - allowed:
+                self.fields.pop(name)
+
 class ShipmentStatusHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ShipmentStatusHistory
         fields = '__all__'
 
-class ShipmentSerializer(serializers.ModelSerializer):
+class ShipmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     client_name = serializers.CharField(source='client.name', read_only=True)
     client_contact = serializers.CharField(source='client.contact_info', read_only=True)
     destination_name = serializers.CharField(source='destination.name', read_only=True)
@@ -80,20 +104,59 @@ class ShipmentSerializer(serializers.ModelSerializer):
         old_status = instance.status
         new_status = validated_data.get('status', old_status)
         
-        # Update shipment
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-        
-        # Create history entry if status changed
-        if old_status != new_status:
-            ShipmentStatusHistory.objects.create(
-                shipment=instance,
-                status=new_status
-            )
+        # One write transaction for the shipment, its rollup and its history
+        with transaction.atomic():
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+            
+            # Create history entry if status changed
+            if old_status != new_status:
+                record_status_change(instance, new_status)
         
         return instance
 
+class ShipmentListSerializer(ShipmentSerializer):
+    """
+    Compact row for the shipments table: no customs details and no nested
+    status history unless the request asks for it with ?expand=status_history.
+    """
+    class Meta:
+        model = Shipment
+        fields = [
+            'id', 'tracking_number', 'client', 'client_name', 'destination', 'destination_name',
+            'service_type', 'service_type_name', 'driver', 'driver_name', 'weight', 'volume',
+            'date', 'status', 'calculated_cost', 'is_international', 'status_history',
+        ]
+        read_only_fields = ['calculated_cost']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'status_history' not in requested_fields(self.context.get('request'), 'expand'):
+            self.fields.pop('status_history', None)
+
+class ShipmentBulkItemSerializer(serializers.ModelSerializer):
+    """
+    Validates one item of POST /api/shipments/bulk/ without touching the database.
+    Relations are taken as raw ids and tracking numbers are not checked for
+    uniqueness here: logistics.intake checks both for the whole batch at once.
+    """
+    tracking_number = serializers.CharField(max_length=50, required=False)
+    client = serializers.IntegerField()
+    destination = serializers.IntegerField()
+    service_type = serializers.IntegerField()
+    driver = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta:
+        model = Shipment
+        fields = [
+            'tracking_number', 'client', 'destination', 'service_type', 'driver',
+            'weight', 'volume', 'description', 'status',
+            'is_international', 'origin_country', 'destination_country', 'customs_value',
+            'customs_currency', 'customs_declaration', 'hs_code',
+            'requires_customs_clearance', 'customs_cleared',
+        ]
+
 class TourSerializer(serializers.ModelSerializer):
     driver_name = serializers.CharField(source='driver.name', read_only=True)
     vehicle_plate = serializers.CharField(source='vehicle.license_plate', read_only=True)
@@ -101,6 +164,7 @@ class TourSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tour
         fields = '__all__'
+        read_only_fields = ['stop_order']
 
 class InvoiceSerializer(serializers.ModelSerializer):
     remaining_balance = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
@@ -138,3 +202,83 @@ class IncidentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Incident
         fields = '__all__'
+
+class BillingRunSerializer(serializers.Serializer):
+    """Parameters of a month-end billing run (see logistics.billing.run_billing)"""
+    start = serializers.DateField()
+    end = serializers.DateField()
+    clients = serializers.ListField(child=serializers.IntegerField(), required=False)
+    statuses = serializers.ListField(child=serializers.ChoiceField(choices=Shipment.Status.choices), required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['end'] <= attrs['start']:
+            raise serializers.ValidationError({'end': 'end must be after start'})
+        return attrs
+
+class LoadPlanSerializer(serializers.Serializer):
+    """Query parameters of a load plan (see logistics.loading.plan_loads)"""
+    date = serializers.DateField(required=False)
+
+class DispatchSerializer(serializers.Serializer):
+    """Parameters of a dispatch run (see logistics.dispatching.dispatch)"""
+    date = serializers.DateField(required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+class DocumentJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DocumentJob
+        fields = ['id', 'kind', 'params', 'status', 'attempts', 'error', 'created_at', 'finished_at', 'download_url']
+        read_only_fields = ['id', 'status', 'attempts', 'error', 'created_at', 'finished_at']
+
+    def get_download_url(self, obj):
+        if obj.status != DocumentJob.Status.DONE:
+            return None
+        url = f'/api/document-jobs/{obj.id}/download/'
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def validate(self, attrs):
+        """Check the params each kind of document needs and keep only those"""
+        kind = attrs['kind']
+        params = attrs.get('params') or {}
+        if not isinstance(params, dict):
+            raise serializers.ValidationError({'params': 'Expected an object'})
+
+        def integer(name):
+            value = params.get(name)
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise serializers.ValidationError({'params': f'{name} must be an integer id'})
+            return value
+
+        if kind == DocumentJob.Kind.INVOICE:
+            invoice = integer('invoice')
+            if not Invoice.objects.filter(pk=invoice).exists():
+                raise serializers.ValidationError({'params': f'Invoice {invoice} does not exist'})
+            attrs['params'] = {'invoice': invoice}
+        elif kind == DocumentJob.Kind.SLIP:
+            shipment = integer('shipment')
+            if not Shipment.objects.filter(pk=shipment).exists():
+                raise serializers.ValidationError({'params': f'Shipment {shipment} does not exist'})
+            attrs['params'] = {'shipment': shipment}
+        else:
+            cleaned = {'layout': params.get('layout', 'page')}
+            if cleaned['layout'] not in ('page', 'sheet'):
+                raise serializers.ValidationError({'params': 'layout must be page or sheet'})
+            if 'ids' in params:
+                ids = params['ids']
+                if not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+                    raise serializers.ValidationError({'params': 'ids must be a list of integer ids'})
+                if not ids or len(ids) > settings.SLIP_BATCH_MAX_ITEMS:
+                    raise serializers.ValidationError(
+                        {'params': f'ids must hold between 1 and {settings.SLIP_BATCH_MAX_ITEMS} shipments'}
+                    )
+                cleaned['ids'] = ids
+            if 'tour' in params:
+                cleaned['tour'] = integer('tour')
+            if 'ids' not in cleaned and 'tour' not in cleaned:
+                raise serializers.ValidationError({'params': 'A slip batch needs ids or a tour'})
+            attrs['params'] = cleaned
+        return attrs
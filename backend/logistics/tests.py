@@ -1,3 +1,1566 @@
-from django.test import TestCase
+import itertools
+import json
+import math
+import os
+import re
+import tempfile
+import time
+from base64 import b64encode
+from decimal import Decimal
+from io import StringIO
+from datetime import date, timedelta
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.core.cache import caches
+from django.core.management import call_command, CommandError
+from django.db import connection, connections, OperationalError
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models import Exists, OuterRef, Q, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import (
+    User, Client, Driver, Vehicle, Destination, ServiceType, PricingRule,
+    Shipment, ShipmentStatusHistory, Tour, Invoice, Incident, Claim, DocumentJob, ShipmentMonthlyStat,
+    DriverLocation, compute_shipment_cost, pricing_rule_index
+)
+from .pricing import from_cents, price_rows, reprice_shipments, CENT
+from . import billing
+from .billing import recalculate_invoice_totals, run_billing
+from .jobs import requeue_stale_jobs
+from .management.commands.run_document_worker import Command as RunDocumentWorker
+from .analytics import check_monthly_stats, month_start
+from .routers import ReadReplicaRouter, reading_from_replica, replica_reads
+from .views import ShipmentViewSet
+from .history import StatusHistoryWriter
+from .distances import DistanceMatrix, haversine_matrix, row_offset
+from .loading import Load, merge_loads, pack
+from .dispatching import min_cost_assignment
+from .routing import distance_matrix, nearest_neighbour_route, route_length, solve_route
 
-# Create your tests here.
+# In-memory stand-ins for every cache alias, so tests never write to the on-disk document cache
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'documents': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-documents'},
+    'positions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-positions'},
+    'tracking': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-tracking'},
+}
+
+def create_reference_data():
+    """Minimal set of rows shared by the API tests"""
+    destination = Destination.objects.create(name='Alger Centre', zone='Alger')
+    service_type = ServiceType.objects.create(name='Standard')
+    PricingRule.objects.create(
+        destination=destination,
+        service_type=service_type,
+        base_tariff=Decimal('500.00'),
+        weight_rate=Decimal('25.00'),
+        volume_rate=Decimal('50.00'),
+    )
+    client = Client.objects.create(name='SARL Naftal Distribution', address='Alger', contact_info='0555123456')
+    driver = Driver.objects.create(name='Karim Benali', license_number='01123456', phone='0666789012')
+    vehicle = Vehicle.objects.create(license_plate='123456-16', capacity=3500, vehicle_type='Fourgon')
+    return {
+        'destination': destination,
+        'service_type': service_type,
+        'client': client,
+        'driver': driver,
+        'vehicle': vehicle,
+    }
+
+def create_shipment(refs, number, **kwargs):
+    fields = {
+        'tracking_number': f"DZ2024{number:04d}",
+        'client': refs['client'],
+        'destination': refs['destination'],
+        'service_type': refs['service_type'],
+        'driver': refs['driver'],
+        'weight': Decimal('10.00'),
+        'volume': Decimal('1.00'),
+    }
+    fields.update(kwargs)
+    return Shipment.objects.create(**fields)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    List and detail endpoints must issue a fixed number of queries whatever the
+    number of rows. A failure here means a serializer started reading a relation
+    the viewset queryset does not load up front.
+    """
+    ROWS = 10
+    BUDGETS = {
+        'shipment-list': 1,           # compact rows with joined FKs
+        'shipment-list-expanded': 2,  # + status history prefetch
+        'shipment-detail': 2,
+        'invoice-list': 2,            # invoices + client, shipment ids prefetch
+        'invoice-detail': 2,
+        'tour-list': 2,               # tours + driver/vehicle, shipment ids prefetch
+        'tour-detail': 2,
+        'incident-list': 1,
+        'incident-detail': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        refs = create_reference_data()
+        cls.user = User.objects.create_user(username='admin', password='admin', role='ADMIN')
+        cls.shipments = []
+        for i in range(cls.ROWS):
+            shipment = create_shipment(refs, i)
+            ShipmentStatusHistory.objects.create(shipment=shipment, status=Shipment.Status.PENDING)
+            ShipmentStatusHistory.objects.create(shipment=shipment, status=Shipment.Status.IN_TRANSIT)
+            Incident.objects.create(shipment=shipment, description='Retard')
+            invoice = Invoice.objects.create(client=refs['client'])
+            invoice.shipments.set([shipment])
+            tour = Tour.objects.create(driver=refs['driver'], vehicle=refs['vehicle'], date=date(2024, 1, 1 + i))
+            tour.shipments.set([shipment])
+            cls.shipments.append(shipment)
+        cls.detail_ids = {
+            'shipment': cls.shipments[0].id,
+            'invoice': Invoice.objects.first().id,
+            'tour': Tour.objects.first().id,
+            'incident': Incident.objects.first().id,
+        }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assertWithinBudget(self, name, url):
+        with self.assertNumQueries(self.BUDGETS[name]):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_shipment_list(self):
+        response = self.assertWithinBudget('shipment-list', '/api/shipments/')
+        self.assertEqual(len(response.data['results']), self.ROWS)
+        row = response.data['results'][0]
+        self.assertNotIn('status_history', row)
+        self.assertNotIn('customs_declaration', row)
+
+    def test_shipment_list_expanded(self):
+        response = self.assertWithinBudget('shipment-list-expanded', '/api/shipments/?expand=status_history')
+        self.assertEqual(len(response.data['results'][0]['status_history']), 2)
+
+    def test_shipment_list_fields(self):
+        response = self.assertWithinBudget('shipment-list', '/api/shipments/?fields=id,tracking_number,hs_code')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'tracking_number', 'hs_code'})
+
+    def test_shipment_detail(self):
+        response = self.assertWithinBudget('shipment-detail', f"/api/shipments/{self.detail_ids['shipment']}/")
+        self.assertEqual(response.data['client_name'], 'SARL Naftal Distribution')
+        self.assertEqual(len(response.data['status_history']), 2)
+        self.assertIn('customs_declaration', response.data)
+
+    def test_invoice_list(self):
+        response = self.assertWithinBudget('invoice-list', '/api/invoices/')
+        self.assertEqual(len(response.data['results']), self.ROWS)
+
+    def test_invoice_detail(self):
+        self.assertWithinBudget('invoice-detail', f"/api/invoices/{self.detail_ids['invoice']}/")
+
+    def test_tour_list(self):
+        response = self.assertWithinBudget('tour-list', '/api/tours/')
+        self.assertEqual(len(response.data['results']), self.ROWS)
+
+    def test_tour_detail(self):
+        self.assertWithinBudget('tour-detail', f"/api/tours/{self.detail_ids['tour']}/")
+
+    def test_incident_list(self):
+        response = self.assertWithinBudget('incident-list', '/api/incidents/')
+        self.assertEqual(len(response.data['results']), self.ROWS)
+
+    def test_incident_detail(self):
+        self.assertWithinBudget('incident-detail', f"/api/incidents/{self.detail_ids['incident']}/")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DashboardSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.agent = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.driver_user = User.objects.create_user(username='driver', password='driver', role='DRIVER')
+        driver = cls.driver_user.driver_profile
+        for number, status, assigned in (
+            (1, 'PENDING', None), (2, 'IN_TRANSIT', driver), (3, 'OUT_FOR_DELIVERY', driver),
+            (4, 'SORTING_CENTER', None), (5, 'DELIVERED', driver), (6, 'IN_TRANSIT', None),
+        ):
+            shipment = create_shipment(cls.refs, number, status=status, driver=assigned)
+        Incident.objects.create(shipment=shipment, description='Retard')
+        Incident.objects.create(shipment=shipment, description='Colis abime', status='RESOLVED')
+        for amount in ('1190.00', '595.50'):
+            invoice = Invoice.objects.create(client=cls.refs['client'])
+            Invoice.objects.filter(pk=invoice.pk).update(amount_ttc=Decimal(amount))
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+
+    def summary(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/dashboard/summary/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_and_revenue(self):
+        with self.assertNumQueries(3):  # one aggregate per table
+            summary = self.summary(self.agent)
+        self.assertEqual(summary, {
+            'total_shipments': 6, 'active_deliveries': 4, 'pending_count': 1, 'in_transit_count': 2,
+            'open_incidents': 1, 'revenue': '1785.50',
+        })
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get('/api/dashboard/summary/').status_code, 401)
+
+    def test_drivers_only_see_their_own_shipments(self):
+        self.summary(self.agent)
+        summary = self.summary(self.driver_user)
+        self.assertEqual(
+            (summary['total_shipments'], summary['active_deliveries'], summary['pending_count'], summary['in_transit_count']),
+            (3, 2, 0, 1),
+        )
+        self.assertEqual(caches['default'].get(f'dashboard_summary:driver:{self.driver_user.pk}'), summary)
+        self.assertEqual(caches['default'].get('dashboard_summary')['total_shipments'], 6)
+
+    def test_cached_for_the_timeout_window(self):
+        first = self.summary(self.agent)
+        create_shipment(self.refs, 7)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.summary(self.agent), first)
+        later = time.time() + settings.DASHBOARD_SUMMARY_CACHE_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.summary(self.agent)['total_shipments'], 7)
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipments = [create_shipment(cls.refs, number) for number in range(1, 8)]
+        # Rows sharing a date are told apart by id
+        moment = timezone.now() - timedelta(days=1)
+        for index, shipment in enumerate(cls.shipments):
+            Shipment.objects.filter(pk=shipment.pk).update(date=moment - timedelta(hours=index // 2))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_cursor_round_trip_visits_every_row_once(self):
+        expected = list(Shipment.objects.order_by('-date', '-id').values_list('id', flat=True))
+        seen = []
+        url = '/api/shipments/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            self.assertNotIn('cursor', response.data['first'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_last_page_has_no_next_link(self):
+        response = self.client.get('/api/shipments/?page_size=7')
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(self.client.get('/api/shipments/?page_size=6').data['next'])
+
+    def test_invalid_or_tampered_cursor(self):
+        for cursor in ('not-base64!', b64encode(b'no separator').decode(), b64encode(b'not a date|1').decode(),
+                       b64encode(b'2024-01-01T00:00:00+00:00|x').decode(), b64encode('é|1'.encode()).decode()):
+            response = self.client.get('/api/shipments/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_invoice_of_a_shipment(self):
+        invoice = Invoice.objects.create(client=self.refs['client'])
+        invoice.shipments.add(self.shipments[0])
+        Invoice.objects.create(client=self.refs['client'])
+        response = self.client.get('/api/invoices/', {'shipments': self.shipments[0].pk})
+        self.assertEqual([row['id'] for row in response.data['results']], [invoice.pk])
+
+    def test_status_filters(self):
+        invoices = {status: Invoice.objects.create(client=self.refs['client']) for status in ('UNPAID', 'PARTIAL', 'PAID')}
+        for status, invoice in invoices.items():
+            Invoice.objects.filter(pk=invoice.pk).update(status=status)
+        response = self.client.get('/api/invoices/', {'status__in': 'UNPAID,PARTIAL'})
+        self.assertEqual({row['id'] for row in response.data['results']}, {invoices['UNPAID'].pk, invoices['PARTIAL'].pk})
+
+        open_incident = Incident.objects.create(shipment=self.shipments[0], description='Retard')
+        Incident.objects.create(shipment=self.shipments[0], description='Colis abime', status='RESOLVED')
+        response = self.client.get('/api/incidents/', {'status': 'OPEN', 'page_size': 1})
+        self.assertEqual([row['id'] for row in response.data['results']], [open_incident.pk])
+
+
+class PricingRuleIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+
+    def test_calculate_cost_needs_no_queries_once_loaded(self):
+        shipment = Shipment(destination=self.refs['destination'], service_type=self.refs['service_type'],
+                            weight=Decimal('10.00'), volume=Decimal('2.00'))
+        pricing_rule_index.invalidate()
+        with self.assertNumQueries(1):
+            self.assertEqual(shipment.calculate_cost(), Decimal('850.00'))
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                shipment.calculate_cost()
+
+    def test_saving_a_rule_invalidates_the_index(self):
+        shipment = Shipment(destination=self.refs['destination'], service_type=self.refs['service_type'],
+                            weight=Decimal('10.00'), volume=Decimal('2.00'))
+        self.assertEqual(shipment.calculate_cost(), Decimal('850.00'))
+        rule = PricingRule.objects.get()
+        rule.base_tariff = Decimal('600.00')
+        rule.save()
+        self.assertEqual(shipment.calculate_cost(), Decimal('950.00'))
+        rule.delete()
+        self.assertEqual(shipment.calculate_cost(), Decimal('0.00'))
+
+
+class RepricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        refs = create_reference_data()
+        express = ServiceType.objects.create(name='Express')
+        PricingRule.objects.create(
+            destination=refs['destination'],
+            service_type=express,
+            base_tariff=Decimal('750.35'),
+            weight_rate=Decimal('25.55'),
+            volume_rate=Decimal('49.99'),
+        )
+        unpriced = ServiceType.objects.create(name='Economique')
+        cases = [
+            {},
+            {'service_type': express, 'weight': Decimal('10.33'), 'volume': Decimal('0.07')},
+            {'service_type': express, 'is_international': True, 'weight': Decimal('10.33')},
+            {'is_international': True, 'requires_customs_clearance': True},
+            {'is_international': True, 'customs_value': Decimal('100000.00')},
+            {'is_international': True, 'customs_value': Decimal('250000.15'), 'requires_customs_clearance': True},
+            {'customs_value': Decimal('250000.00')},
+            {'service_type': unpriced},
+        ]
+        for number, fields in enumerate(cases):
+            create_shipment(refs, number, calculated_cost=Decimal('1.00'), **fields)
+
+    def test_matches_calculate_cost_to_the_cent(self):
+        scanned, changed, _ = reprice_shipments(chunk_size=3)
+        self.assertEqual(scanned, 8)
+        self.assertEqual(changed, 8)
+        for shipment in Shipment.objects.all():
+            self.assertEqual(shipment.calculated_cost, shipment.calculate_cost().quantize(CENT), shipment)
+
+    def test_price_rows_rounds_like_decimal(self):
+        rule = PricingRule.objects.get(service_type__name='Express')
+        rule.base_tariff, rule.weight_rate = Decimal('0.00'), Decimal('0.50')
+        rule.save()
+        # The rolled back rates must not outlive this test in the process-wide table
+        self.addCleanup(pricing_rule_index.invalidate)
+        huge = 9999999999
+        rows = [
+            # (weight, volume, is_international, requires_customs_clearance, customs_value), in cents.
+            # Half-cent ties go to the even cent, as Decimal.quantize does
+            (1, 0, False, False, 0),
+            (3, 0, False, False, 0),
+            (2, 0, True, False, 0),
+            (3, 0, True, True, 10000001),
+            # Past int64, priced through Decimal instead
+            (huge, huge, True, True, 999999999999),
+        ]
+        rows = [(rule.destination_id, rule.service_type_id, *columns) for columns in rows]
+        expected = [
+            int(compute_shipment_cost(rule, from_cents(weight), from_cents(volume), *flags, from_cents(value)).quantize(CENT) * 100)
+            for _, _, weight, volume, *flags, value in rows
+        ]
+        self.assertEqual(price_rows(rows).tolist(), expected)
+        self.assertEqual(expected[:3], [0, 2, 2])
+
+    def test_monthly_revenue_follows_the_new_costs(self):
+        # The service keeps the rollups current by itself, without the command's help
+        reprice_shipments(chunk_size=3)
+        self.assertEqual(check_monthly_stats(), [])
+        self.assertEqual(
+            ShipmentMonthlyStat.objects.aggregate(total=Sum('revenue'))['total'],
+            Shipment.objects.aggregate(total=Sum('calculated_cost'))['total'],
+        )
+
+    def test_only_changed_rows_are_written(self):
+        reprice_shipments()
+        self.assertEqual(reprice_shipments()[1], 0)
+
+    def test_dry_run_writes_nothing(self):
+        call_command('reprice_shipments', '--dry-run', stdout=StringIO())
+        self.assertFalse(Shipment.objects.exclude(calculated_cost=Decimal('1.00')).exists())
+
+
+class BulkShipmentCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        create_shipment(cls.refs, 1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def item(self, **kwargs):
+        item = {
+            'client': self.refs['client'].id,
+            'destination': self.refs['destination'].id,
+            'service_type': self.refs['service_type'].id,
+            'weight': '10.00',
+            'volume': '2.00',
+        }
+        item.update(kwargs)
+        return item
+
+    def test_invalid_items_do_not_abort_the_batch(self):
+        items = [
+            self.item(),
+            self.item(weight='heavy'),
+            self.item(destination=999999),
+            self.item(tracking_number='DZ20240001'),
+            self.item(tracking_number='CUSTOM-1'),
+            self.item(tracking_number='CUSTOM-1'),
+        ]
+        response = self.client.post('/api/shipments/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row['index'] for row in response.data['created']], [0, 4])
+        self.assertEqual([row['index'] for row in response.data['errors']], [1, 2, 3, 5])
+        self.assertEqual(response.data['created'][0]['calculated_cost'], Decimal('850.00'))
+        self.assertEqual(Shipment.objects.get(tracking_number='CUSTOM-1').calculated_cost, Decimal('850.00'))
+
+    def test_lookups_are_batched(self):
+        pricing_rule_index.rules()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/shipments/bulk/', [self.item() for _ in range(200)], format='json')
+        self.assertEqual(len(response.data['created']), 200)
+        self.assertEqual(Shipment.objects.count(), 201)
+        # One id lookup per related table at most; the inserts are split by the backend's batch size
+        selects = [query for query in queries if query['sql'].startswith('SELECT')]
+        self.assertLessEqual(len(selects), 5)
+
+    def test_ndjson_body(self):
+        body = '\n'.join(json.dumps(self.item()) for _ in range(3)) + '\n'
+        response = self.client.post('/api/shipments/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 3)
+
+
+class InvoiceTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        refs = create_reference_data()
+        costs = [Decimal('850.00'), Decimal('1234.57'), Decimal('99.99'), None]
+        shipments = [create_shipment(refs, i) for i in range(len(costs))]
+        for shipment, cost in zip(shipments, costs):
+            Shipment.objects.filter(pk=shipment.pk).update(calculated_cost=cost)
+        cls.invoices = []
+        for linked, paid in [(shipments, Decimal('0')), (shipments[1:3], Decimal('100')), ([], Decimal('0'))]:
+            invoice = Invoice.objects.create(client=refs['client'], paid_amount=paid)
+            invoice.shipments.set(linked)
+            cls.invoices.append(invoice)
+
+    def expected_totals(self, invoice):
+        """Totals as computed one invoice at a time by Invoice.calculate_totals"""
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.calculate_totals()
+        invoice.refresh_from_db()
+        return invoice.amount_ht, invoice.tva, invoice.amount_ttc, invoice.status
+
+    def test_calculate_totals_sums_costs_in_the_database(self):
+        invoice = Invoice.objects.get(pk=self.invoices[0].pk)
+        # One SUM and the UPDATE, whatever the number of shipments
+        with self.assertNumQueries(2):
+            invoice.calculate_totals()
+        self.assertEqual(self.expected_totals(self.invoices[0])[:3],
+                         (Decimal('2184.56'), Decimal('415.07'), Decimal('2599.63')))
+
+    def test_bulk_recalculation_matches_calculate_totals(self):
+        expected = {invoice.pk: self.expected_totals(invoice) for invoice in self.invoices}
+        Invoice.objects.update(amount_ht=1, tva=1, amount_ttc=1, status=Invoice.Status.PARTIAL)
+        self.assertEqual(recalculate_invoice_totals(chunk_size=2), (3, 3))
+        for invoice in Invoice.objects.all():
+            self.assertEqual((invoice.amount_ht, invoice.tva, invoice.amount_ttc, invoice.status), expected[invoice.pk])
+        self.assertEqual(recalculate_invoice_totals(), (3, 0))
+
+
+class VehicleStatusReconciliationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = Driver.objects.create(name='Karim Benali', license_number='01123456', phone='0666789012')
+        cls.vehicles = {
+            status: Vehicle.objects.create(license_plate=f'{number:06d}-16', capacity=3500,
+                                           vehicle_type='Fourgon', status=status)
+            for number, status in enumerate(Vehicle.Status.values)
+        }
+        cls.idle = Vehicle.objects.create(license_plate='999999-16', capacity=3500,
+                                          vehicle_type='Fourgon', status=Vehicle.Status.IN_USE)
+
+    def test_two_updates_and_maintenance_untouched(self):
+        today = date.today()
+        for vehicle in self.vehicles.values():
+            Tour.objects.bulk_create([Tour(driver=self.driver, vehicle=vehicle, date=today)])
+        with self.assertNumQueries(2):
+            changed = Vehicle.reconcile_statuses(today=today)
+        self.assertEqual(changed, (1, 1))
+        statuses = {vehicle.pk: vehicle.status for vehicle in Vehicle.objects.all()}
+        self.assertEqual(statuses[self.vehicles['AVAILABLE'].pk], 'IN_USE')
+        self.assertEqual(statuses[self.vehicles['IN_USE'].pk], 'IN_USE')
+        self.assertEqual(statuses[self.vehicles['MAINTENANCE'].pk], 'MAINTENANCE')
+        self.assertEqual(statuses[self.idle.pk], 'AVAILABLE')
+        self.assertEqual(Vehicle.reconcile_statuses(today=today), (0, 0))
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        refs = create_reference_data()
+        cls.user = User.objects.create_user(username='manager', password='manager', role='MANAGER')
+        for i in range(5):
+            create_shipment(refs, i, status='DELIVERED' if i % 2 else 'PENDING')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_csv_export_applies_list_filters(self):
+        response = self.client.get('/api/shipments/export/', {'status': 'DELIVERED'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'tracking_number'])
+        self.assertEqual(len(lines), 3)
+
+    def test_ndjson_export(self):
+        response = self.client.get('/api/shipments/export/', {'export_format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['client__name'], 'SARL Naftal Distribution')
+
+    def test_export_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get('/api/shipments/export/').status_code, 401)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SlipTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipment = create_shipment(cls.refs, 1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = f'/api/shipments/{self.shipment.pk}/slip/'
+
+    def test_slip_is_served_with_an_etag(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        self.assertEqual(self.client.get(self.url).content, response.content)
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_etag_follows_shipment_and_related_changes(self):
+        etag = self.client.get(self.url)['ETag']
+        Client.objects.filter(pk=self.refs['client'].pk).update(name='EURL Cevital Logistique')
+        renamed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(renamed.status_code, 200)
+        self.shipment.status = Shipment.Status.DELIVERED
+        self.shipment.save()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], renamed['ETag'])
+
+class SlipBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipments = [create_shipment(cls.refs, number) for number in range(1, 7)]
+        cls.tour = Tour.objects.create(driver=cls.refs['driver'], vehicle=cls.refs['vehicle'], date=date(2024, 3, 1))
+        cls.tour.shipments.set(cls.shipments[:3])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def fetch(self, query):
+        response = self.client.get(f'/api/shipments/slips/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def page_count(self, pdf):
+        return len(re.findall(rb'/Type /Page\b', pdf))
+
+    def test_selection_by_ids_tour_and_filter(self):
+        ids = ','.join(str(shipment.pk) for shipment in self.shipments[:2])
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/shipments/slips/?ids={ids}')
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(self.page_count(pdf), 2)
+        self.assertEqual(self.page_count(self.fetch(f'tour={self.tour.pk}')), 3)
+        self.assertEqual(self.page_count(self.fetch(f'client={self.refs["client"].pk}')), 6)
+
+    def test_sheet_layout_puts_several_slips_on_a_page(self):
+        self.assertEqual(self.page_count(self.fetch('layout=sheet')), 2)
+
+    def test_invalid_selection(self):
+        self.assertEqual(self.client.get('/api/shipments/slips/?tour=x').status_code, 400)
+        self.assertEqual(self.client.get('/api/shipments/slips/?ids=0').status_code, 404)
+        with self.settings(SLIP_BATCH_MAX_ITEMS=5):
+            self.assertEqual(self.client.get('/api/shipments/slips/').status_code, 400)
+
+    @override_settings(SLIP_BATCH_QUEUE_THRESHOLD=2)
+    def test_large_batches_are_queued_for_the_document_worker(self):
+        response = self.client.get('/api/shipments/slips/?layout=sheet')
+        self.assertEqual(response.status_code, 202)
+        job = DocumentJob.objects.get(pk=response.data['id'])
+        self.assertEqual((job.kind, job.status, job.requested_by), (DocumentJob.Kind.SLIP_BATCH, DocumentJob.Status.QUEUED, self.user))
+        self.assertEqual(job.params, {'ids': sorted(shipment.pk for shipment in self.shipments), 'layout': 'sheet'})
+
+        call_command('run_document_worker', workers=0, once=True, stdout=StringIO(), stderr=StringIO())
+        download = self.client.get(f'/api/document-jobs/{job.pk}/download/')
+        self.assertEqual(self.page_count(download.content), 2)
+
+@override_settings(CACHES=TEST_CACHES)
+class InvoicePdfTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.shipments = [create_shipment(cls.refs, number) for number in range(1, 81)]
+        cls.invoice = Invoice.objects.create(client=cls.refs['client'])
+        cls.invoice.shipments.set(cls.shipments[:79])
+        cls.invoice.calculate_totals()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        caches['documents'].clear()
+        self.url = f'/api/invoices/{self.invoice.pk}/pdf/'
+
+    def test_long_invoices_span_several_pages(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        pdf = response.content
+        self.assertEqual(len(re.findall(rb'/Type /Page\b', pdf)), 3)
+        # Cached: only the invoice and its state fingerprint are read
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).content, pdf)
+
+    def test_etag_follows_invoice_contents(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.invoice.shipments.add(self.shipments[79])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(self.url)['ETag']
+
+        self.shipments[0].weight = Decimal('12.00')
+        self.shipments[0].save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+@override_settings(CACHES=TEST_CACHES, DOCUMENT_JOB_MAX_ATTEMPTS=2)
+class DocumentJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipments = [create_shipment(cls.refs, number) for number in range(1, 4)]
+        cls.invoice = Invoice.objects.create(client=cls.refs['client'])
+        cls.invoice.shipments.set(cls.shipments)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def run_worker(self):
+        out = StringIO()
+        call_command('run_document_worker', workers=0, once=True, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_enqueue_poll_and_download(self):
+        jobs = [
+            self.client.post('/api/document-jobs/', {'kind': 'INVOICE', 'params': {'invoice': self.invoice.pk}}, format='json'),
+            self.client.post('/api/document-jobs/', {'kind': 'SLIP', 'params': {'shipment': self.shipments[0].pk}}, format='json'),
+            self.client.post('/api/document-jobs/', {
+                'kind': 'SLIP_BATCH', 'params': {'ids': [shipment.pk for shipment in self.shipments], 'layout': 'sheet'},
+            }, format='json'),
+        ]
+        for response in jobs:
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data['status'], 'QUEUED')
+            self.assertIsNone(response.data['download_url'])
+        url = f"/api/document-jobs/{jobs[0].data['id']}/"
+        self.assertEqual(self.client.get(url + 'download/').status_code, 409)
+
+        self.assertIn('Rendered 3 documents', self.run_worker())
+
+        for response in jobs:
+            job = self.client.get(f"/api/document-jobs/{response.data['id']}/").data
+            self.assertEqual(job['status'], 'DONE')
+            download = self.client.get(job['download_url'])
+            self.assertEqual(download.status_code, 200)
+            self.assertTrue(download.content.startswith(b'%PDF'))
+        self.assertEqual(len(self.client.get('/api/document-jobs/').data['results']), 3)
+
+    def test_invalid_params_are_rejected(self):
+        for kind, params in [
+            ('INVOICE', {'invoice': 0}),
+            ('SLIP', {'shipment': 'x'}),
+            ('SLIP_BATCH', {'layout': 'sheet'}),
+            ('SLIP_BATCH', {'ids': [1], 'layout': 'poster'}),
+        ]:
+            response = self.client.post('/api/document-jobs/', {'kind': kind, 'params': params}, format='json')
+            self.assertEqual(response.status_code, 400, (kind, params))
+
+    def test_failed_jobs_are_retried_then_dead_lettered(self):
+        response = self.client.post('/api/document-jobs/', {'kind': 'INVOICE', 'params': {'invoice': self.invoice.pk}}, format='json')
+        job = DocumentJob.objects.get(pk=response.data['id'])
+        self.invoice.delete()
+
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (DocumentJob.Status.QUEUED, 1))
+        self.assertIn('DoesNotExist', job.error)
+        self.assertGreater(job.available_at, timezone.now())
+
+        # Not due yet: the worker leaves it alone
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+
+        DocumentJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (DocumentJob.Status.DEAD, 2))
+
+    def test_abandoned_jobs_are_requeued(self):
+        job = DocumentJob.objects.create(
+            kind='SLIP', params={'shipment': self.shipments[0].pk}, requested_by=self.user,
+            status=DocumentJob.Status.RUNNING, attempts=1,
+            started_at=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(requeue_stale_jobs(exclude=[job.pk]), 0)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, DocumentJob.Status.QUEUED)
+
+    def test_worker_sweeps_for_abandoned_jobs_while_it_runs(self):
+        job = DocumentJob.objects.create(
+            kind='SLIP', params={'shipment': self.shipments[0].pk}, status=DocumentJob.Status.RUNNING, attempts=1,
+            available_at=timezone.now() + timedelta(hours=1), started_at=timezone.now(),
+        )
+        command = RunDocumentWorker(stdout=StringIO())
+        command.next_sweep = 0
+        command.sweep()
+        # The job goes stale after the worker started, and the next sweep picks it up
+        DocumentJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        command.sweep()
+        self.assertEqual(DocumentJob.objects.get(pk=job.pk).status, DocumentJob.Status.RUNNING)
+        with override_settings(DOCUMENT_JOB_SWEEP_INTERVAL=0):
+            command.next_sweep = 0
+            command.sweep()
+        self.assertEqual(DocumentJob.objects.get(pk=job.pk).status, DocumentJob.Status.QUEUED)
+
+    def test_prune_drops_old_finished_jobs(self):
+        now = timezone.now()
+        for status, days in (('DONE', 10), ('DEAD', 10), ('DONE', 1), ('RUNNING', 10)):
+            DocumentJob.objects.create(
+                kind='SLIP', params={}, status=status, result=b'%PDF' if status == 'DONE' else None,
+                finished_at=now - timedelta(days=days) if status != 'RUNNING' else None,
+                started_at=now - timedelta(days=days),
+            )
+        out = StringIO()
+        call_command('prune_document_jobs', days=7, stdout=out)
+        self.assertIn('Deleted 2 document jobs', out.getvalue())
+        self.assertEqual(sorted(DocumentJob.objects.values_list('status', flat=True)), ['DONE', 'RUNNING'])
+        with self.assertRaises(CommandError):
+            call_command('prune_document_jobs', days=-1, stdout=StringIO())
+
+    def test_drivers_cannot_enqueue(self):
+        driver = User.objects.create_user(username='driver', password='driver', role='DRIVER')
+        self.client.force_authenticate(user=driver)
+        response = self.client.post('/api/document-jobs/', {'kind': 'SLIP', 'params': {'shipment': self.shipments[0].pk}}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+class BillingRunTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.other_client = Client.objects.create(name='EURL Cevital Logistique', address='Bejaia', contact_info='0555654321')
+        cls.march = [create_shipment(cls.refs, number) for number in range(1, 5)]
+        cls.march.append(create_shipment(cls.refs, 5, client=cls.other_client))
+        cls.april = create_shipment(cls.refs, 6)
+        cls.billed = create_shipment(cls.refs, 7)
+        Shipment.objects.filter(pk__in=[s.pk for s in cls.march + [cls.billed]]).update(
+            date=timezone.make_aware(timezone.datetime(2024, 3, 15, 10))
+        )
+        Shipment.objects.filter(pk=cls.april.pk).update(date=timezone.make_aware(timezone.datetime(2024, 4, 1)))
+        invoice = Invoice.objects.create(client=cls.refs['client'])
+        invoice.shipments.set([cls.billed])
+
+    def test_dry_run_reports_without_writing(self):
+        report = run_billing(date(2024, 3, 1), date(2024, 4, 1), dry_run=True)
+        self.assertEqual(report['shipments'], 5)
+        self.assertEqual(report['amount_ht'], sum(s.calculated_cost for s in self.march))
+        self.assertEqual([row['shipments'] for row in report['clients']], [4, 1])
+        self.assertEqual(report['invoices'], [])
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_one_invoice_per_client_with_sql_totals(self):
+        with CaptureQueriesContext(connection) as queries:
+            report = run_billing(date(2024, 3, 1), date(2024, 4, 1))
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(len(report['invoices']), 2)
+
+        invoice = Invoice.objects.get(pk=report['invoices'][0])
+        self.assertEqual(invoice.client, self.refs['client'])
+        self.assertEqual(set(invoice.shipments.all()), set(self.march[:4]))
+        expected = sum(s.calculated_cost for s in self.march[:4])
+        self.assertEqual(invoice.amount_ht, expected)
+        self.assertEqual(invoice.amount_ttc, (expected * Decimal('1.19')).quantize(CENT))
+        self.assertEqual(invoice.status, Invoice.Status.UNPAID)
+        self.assertFalse(self.april.invoices.exists())
+
+        # Everything of the period is billed now
+        self.assertEqual(run_billing(date(2024, 3, 1), date(2024, 4, 1))['invoices'], [])
+
+    def test_shipments_billed_by_a_concurrent_run_are_not_invoiced_again(self):
+        lock_candidates = billing.lock_candidates
+
+        def other_run_commits_meanwhile(*args):
+            rows = lock_candidates(*args)
+            Invoice.objects.create(client=self.refs['client']).shipments.add(self.march[0])
+            return rows
+
+        with mock.patch('logistics.billing.lock_candidates', side_effect=other_run_commits_meanwhile):
+            report = run_billing(date(2024, 3, 1), date(2024, 4, 1))
+        self.assertEqual(report['shipments'], 4)
+        self.assertEqual(self.march[0].invoices.count(), 1)
+        self.assertEqual(Invoice.shipments.through.objects.filter(shipment__in=self.march).count(), 5)
+
+    @skipUnless(connection.vendor == 'postgresql', 'SQLite has no row locks')
+    def test_candidates_are_locked_skipping_rows_held_elsewhere(self):
+        with CaptureQueriesContext(connection) as queries:
+            run_billing(date(2024, 3, 1), date(2024, 4, 1))
+        self.assertTrue(any('FOR UPDATE' in query['sql'] and 'SKIP LOCKED' in query['sql'] for query in queries))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('run_billing', month='2024-03', dry_run=True, stdout=out)
+        self.assertIn('Would create 2 invoices for 5 shipments', out.getvalue())
+        call_command('run_billing', month='2024-04', render_pdfs=True, stdout=out)
+        self.assertIn('Created 1 invoices for 1 shipments', out.getvalue())
+        self.assertEqual(DocumentJob.objects.filter(kind=DocumentJob.Kind.INVOICE).count(), 1)
+
+    def test_api_is_limited_to_managers(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(username='agent', password='agent', role='AGENT'))
+        payload = {'start': '2024-03-01', 'end': '2024-04-01', 'dry_run': True}
+        self.assertEqual(client.post('/api/invoices/billing-run/', payload, format='json').status_code, 403)
+
+        client.force_authenticate(user=User.objects.create_user(username='manager', password='manager', role='MANAGER'))
+        response = client.post('/api/invoices/billing-run/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['shipments'], 5)
+        response = client.post('/api/invoices/billing-run/', {**payload, 'dry_run': False}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['invoices']), 2)
+
+class MonthlyStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.express = ServiceType.objects.create(name='Express')
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assertConsistent(self):
+        self.assertEqual(check_monthly_stats(), [])
+
+    def test_signals_keep_rollups_current(self):
+        shipments = [create_shipment(self.refs, number) for number in range(1, 5)]
+        Incident.objects.create(shipment=shipments[0], description='Colis endommage')
+        self.assertConsistent()
+
+        shipments[0].status = Shipment.Status.DELIVERED
+        shipments[0].save()
+        shipments[1].service_type = self.express
+        shipments[1].calculated_cost = Decimal('999.00')
+        shipments[1].save()
+        shipments[2].delete()
+        self.assertConsistent()
+
+        # Partially loaded rows read their old bucket back before moving
+        partial = Shipment.objects.only('id', 'status').get(pk=shipments[3].pk)
+        partial.status = Shipment.Status.IN_TRANSIT
+        partial.save()
+        self.assertConsistent()
+
+        shipments[0].incidents.all().delete()
+        self.assertConsistent()
+
+    def test_bulk_created_shipments_are_counted(self):
+        items = [{
+            'client': self.refs['client'].pk, 'destination': self.refs['destination'].pk,
+            'service_type': self.refs['service_type'].pk, 'weight': '5.00', 'volume': '1.00',
+        } for _ in range(3)]
+        self.assertEqual(self.client.post('/api/shipments/bulk/', items, format='json').status_code, 201)
+        self.assertConsistent()
+        self.assertEqual(ShipmentMonthlyStat.objects.get().shipment_count, 3)
+
+    def test_stats_are_read_from_the_rollups(self):
+        for number in range(1, 6):
+            create_shipment(self.refs, number, status=Shipment.Status.DELIVERED if number % 2 else Shipment.Status.PENDING)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/shipments/stats/')
+        self.assertEqual(
+            {row['status']: row['count'] for row in response.data['status_distribution']},
+            {'DELIVERED': 3, 'PENDING': 2},
+        )
+        [month] = response.data['revenue_over_time']
+        self.assertEqual(month['revenue'], Shipment.objects.aggregate(total=Sum('calculated_cost'))['total'])
+        self.assertEqual(month['month'], month_start(timezone.now().date().replace(day=1)))
+
+    def test_check_and_rebuild_command(self):
+        create_shipment(self.refs, 1)
+        # Queryset updates bypass the signals
+        Shipment.objects.update(status=Shipment.Status.DELIVERED)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_monthly_stats', check=True, stdout=StringIO())
+
+        out = StringIO()
+        call_command('rebuild_monthly_stats', stdout=out)
+        self.assertIn('Rebuilt 1 shipment and 0 incident monthly rollups', out.getvalue())
+        call_command('rebuild_monthly_stats', check=True, stdout=out)
+        self.assertIn('consistent', out.getvalue())
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite EXPLAIN QUERY PLAN output')
+class IndexUsageTests(TestCase):
+    """The hot queries must be answered from an index, without a sort step"""
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index}', plan.replace('COVERING INDEX', 'INDEX'))
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_shipment_list_pages(self):
+        now = timezone.now()
+        ordered = Shipment.objects.order_by('-date', '-id')
+        self.assertUsesIndex(ordered[:51], 'shipment_date_id_idx')
+        self.assertUsesIndex(ordered.filter(Q(date__lt=now) | Q(date=now, id__lt=10))[:51], 'shipment_date_id_idx')
+        self.assertUsesIndex(ordered.filter(status='PENDING')[:51], 'shipment_status_date_idx')
+        self.assertUsesIndex(ordered.filter(client_id=1)[:51], 'shipment_client_date_idx')
+        self.assertUsesIndex(ordered.filter(driver__user_id=1)[:51], 'shipment_driver_date_idx')
+
+    def test_billing_period_scan(self):
+        now = timezone.now()
+        linked = Invoice.shipments.through.objects.filter(shipment_id=OuterRef('pk'))
+        period = Shipment.objects.filter(date__gte=now - timedelta(days=30), date__lt=now).filter(~Exists(linked))
+        self.assertUsesIndex(period, 'shipment_date_id_idx')
+
+    def test_pending_shipments_per_destination(self):
+        pending = Shipment.objects.filter(status='PENDING', destination_id=1).order_by('date')
+        self.assertUsesIndex(pending, 'shipment_pending_dest_idx')
+
+    def test_status_history_timeline(self):
+        self.assertUsesIndex(
+            ShipmentStatusHistory.objects.filter(shipment_id=1).order_by('-timestamp'), 'status_history_timeline_idx'
+        )
+
+    def test_vehicles_on_tour_today(self):
+        self.assertUsesIndex(Tour.objects.filter(date=date.today()).values('vehicle_id'), 'tour_date_vehicle_idx')
+
+    def test_document_job_queue(self):
+        due = (
+            DocumentJob.objects.filter(status=DocumentJob.Status.QUEUED, available_at__lte=timezone.now())
+            .order_by('available_at', 'id').values_list('id', flat=True)[:10]
+        )
+        self.assertUsesIndex(due, 'documentjob_queue_idx')
+
+    def test_latest_driver_position(self):
+        latest = DriverLocation.objects.filter(driver_id=1).order_by('-recorded_at')[:1]
+        self.assertUsesIndex(latest, 'driverlocation_track_idx')
+
+    def test_date_ordered_lists(self):
+        self.assertUsesIndex(Invoice.objects.order_by('-date', '-id')[:51], 'invoice_date_id_idx')
+        self.assertUsesIndex(Incident.objects.order_by('-date', '-id')[:51], 'incident_date_id_idx')
+        self.assertUsesIndex(Tour.objects.order_by('-date', '-id')[:51], 'tour_date_id_idx')
+        self.assertUsesIndex(Claim.objects.filter(date__gte=timezone.now()).order_by('date'), 'claim_date_idx')
+
+class ReadReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipment = create_shipment(cls.refs, 1)
+
+    def test_router(self):
+        router = ReadReplicaRouter()
+        with reading_from_replica():
+            # No replica configured: everything stays on the primary
+            self.assertEqual(router.db_for_read(Shipment), 'default')
+        with mock.patch.dict(connections.settings, {'replica': connections.settings['default']}):
+            self.assertEqual(router.db_for_read(Shipment), 'default')
+            with reading_from_replica():
+                self.assertEqual(router.db_for_read(Shipment), 'replica')
+                self.assertEqual(router.db_for_write(Shipment), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'logistics'))
+        self.assertTrue(router.allow_migrate('default', 'logistics'))
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_read_only_actions_use_the_replica(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        seen = []
+        get_queryset = ShipmentViewSet.get_queryset
+
+        def record(view):
+            seen.append((view.action, replica_reads.get()))
+            return get_queryset(view)
+
+        with mock.patch.object(ShipmentViewSet, 'get_queryset', record):
+            client.get('/api/shipments/')
+            client.get(f'/api/shipments/{self.shipment.pk}/')
+            client.patch(f'/api/shipments/{self.shipment.pk}/', {'status': 'IN_TRANSIT'}, format='json')
+            client.get(f'/api/shipments/{self.shipment.pk}/slip/')
+        self.assertEqual(seen, [('list', True), ('retrieve', True), ('partial_update', False), ('slip', False)])
+        self.assertFalse(replica_reads.get())
+
+class StatusHistoryCoalescingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipments = [create_shipment(cls.refs, number) for number in range(1, 3)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def patch_status(self, shipment, status):
+        response = self.client.patch(f'/api/shipments/{shipment.pk}/', {'status': status}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_history_is_written_with_the_change_by_default(self):
+        self.patch_status(self.shipments[0], 'IN_TRANSIT')
+        self.assertEqual(list(self.shipments[0].status_history.values_list('status', flat=True)), ['IN_TRANSIT'])
+
+    @override_settings(STATUS_HISTORY_COALESCE_INTERVAL=60)
+    def test_coalesced_history_is_written_in_one_batch(self):
+        writer = StatusHistoryWriter(60)
+        with mock.patch('logistics.history._writer', writer), mock.patch.object(writer, 'start'):
+            before = timezone.now()
+            self.patch_status(self.shipments[0], 'IN_TRANSIT')
+            self.patch_status(self.shipments[1], 'IN_TRANSIT')
+            self.patch_status(self.shipments[0], 'DELIVERED')
+            self.assertFalse(ShipmentStatusHistory.objects.exists())
+
+            with self.assertNumQueries(4):  # savepoint, insert, release, tracking numbers of the pages to drop
+                self.assertEqual(writer.flush(), 3)
+        history = list(ShipmentStatusHistory.objects.order_by('timestamp').values_list('shipment_id', 'status', 'timestamp'))
+        self.assertEqual([row[:2] for row in history], [
+            (self.shipments[0].pk, 'IN_TRANSIT'), (self.shipments[1].pk, 'IN_TRANSIT'), (self.shipments[0].pk, 'DELIVERED'),
+        ])
+        self.assertGreaterEqual(history[0][2], before)
+
+    @override_settings(STATUS_HISTORY_COALESCE_INTERVAL=60)
+    def test_failed_flush_keeps_the_rows(self):
+        writer = StatusHistoryWriter(60)
+        with mock.patch('logistics.history._writer', writer), mock.patch.object(writer, 'start'):
+            self.patch_status(self.shipments[0], 'IN_TRANSIT')
+            with mock.patch.object(ShipmentStatusHistory.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+                with self.assertRaises(OperationalError):
+                    writer.flush()
+            self.patch_status(self.shipments[0], 'DELIVERED')
+            self.assertEqual(writer.flush(), 2)
+        self.assertEqual(
+            list(ShipmentStatusHistory.objects.order_by('timestamp').values_list('status', flat=True)), ['IN_TRANSIT', 'DELIVERED']
+        )
+
+    def test_sqlite_performance_options(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with tempfile.TemporaryDirectory() as directory:
+            tuned = SQLiteDatabaseWrapper(
+                {**connections.settings['default'], 'NAME': os.path.join(directory, 'tuned.sqlite3'),
+                 'OPTIONS': settings.SQLITE_PERFORMANCE_OPTIONS},
+                alias='tuned',
+            )
+            try:
+                with tuned.cursor() as cursor:
+                    pragmas = {}
+                    for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size'):
+                        cursor.execute(f'PRAGMA {pragma}')
+                        pragmas[pragma] = cursor.fetchone()[0]
+            finally:
+                tuned.close()
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000,
+            'cache_size': -65536, 'mmap_size': 268435456,
+        })
+
+class DriverLocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.agent = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.driver_user = User.objects.create_user(username='driver', password='driver', role='DRIVER')
+        cls.driver = cls.driver_user.driver_profile
+        cls.shipment = create_shipment(cls.refs, 1, driver=cls.driver, status='IN_TRANSIT')
+
+    def setUp(self):
+        caches['positions'].clear()
+        self.client = APIClient()
+
+    def post_fixes(self, user, fixes, **kwargs):
+        self.client.force_authenticate(user=user)
+        return self.client.post('/api/drivers/locations/', fixes, format='json', **kwargs)
+
+    def test_driver_reports_a_batch(self):
+        start = timezone.now() - timedelta(minutes=5)
+        fixes = [
+            {'recorded_at': (start + timedelta(seconds=i)).isoformat(), 'lat': 36.75 + i / 1000, 'lng': 3.05, 'speed': 40}
+            for i in range(50)
+        ]
+        with self.assertNumQueries(4):  # profile lookup, savepoint, insert, release
+            response = self.post_fixes(self.driver_user, fixes)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'stored': 50, 'errors': []})
+        track = DriverLocation.objects.filter(driver=self.driver).order_by('recorded_at')
+        self.assertEqual(track.count(), 50)
+        self.assertEqual(track.first().day, timezone.localtime(start).date())
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(f'/api/driver-location/{self.shipment.tracking_number}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.data['location']['lat'], 36.799)
+        self.assertEqual(response.data['location']['driver_name'], self.driver.name)
+
+    def test_ndjson_batches_from_a_gateway_are_validated_per_item(self):
+        now = timezone.now().timestamp()
+        lines = [
+            {'driver': self.refs['driver'].pk, 'recorded_at': now, 'lat': 36.7, 'lng': 3.0},
+            {'driver': 999999, 'recorded_at': now, 'lat': 36.7, 'lng': 3.0},
+            {'driver': self.refs['driver'].pk, 'recorded_at': now + 3600, 'lat': 91, 'lng': 'x'},
+            {'recorded_at': now, 'lat': 36.7, 'lng': 3.0},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines)
+        self.client.force_authenticate(user=self.agent)
+        response = self.client.post('/api/drivers/locations/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['stored'], 1)
+        errors = {error['index']: error['errors'] for error in response.data['errors']}
+        self.assertEqual(set(errors), {1, 2, 3})
+        self.assertIn('driver', errors[1])
+        self.assertEqual(set(errors[2]), {'recorded_at', 'lat', 'lng'})
+        self.assertIn('driver', errors[3])
+
+        response = self.post_fixes(self.agent, [{'lat': 1}] * (settings.DRIVER_LOCATION_BATCH_MAX_ITEMS + 1))
+        self.assertEqual(response.status_code, 400)
+
+    def test_tracking_lookup_is_served_from_the_cache(self):
+        url = f'/api/driver-location/{self.shipment.tracking_number}/'
+        self.assertEqual(self.client.get(url).data, {'location': None})
+
+        earlier = timezone.now() - timedelta(minutes=2)
+        self.post_fixes(self.driver_user, [{'recorded_at': earlier.isoformat(), 'lat': 36.1, 'lng': 3.1}])
+        self.client.force_authenticate(user=None)
+        with self.assertNumQueries(2):  # shipment, then the track on a cache miss
+            self.assertEqual(self.client.get(url).data['location']['lat'], 36.1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data['location']['lat'], 36.1)
+
+        # A newer fix moves the cached position, a late one does not
+        self.post_fixes(self.driver_user, [
+            {'recorded_at': timezone.now().isoformat(), 'lat': 36.3, 'lng': 3.3},
+            {'recorded_at': (earlier - timedelta(minutes=1)).isoformat(), 'lat': 36.2, 'lng': 3.2},
+        ])
+        self.client.force_authenticate(user=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data['location']['lat'], 36.3)
+
+        Shipment.objects.filter(pk=self.shipment.pk).update(status='DELIVERED')
+        self.assertEqual(self.client.get(url).data, {'location': None})
+        self.assertEqual(self.client.get('/api/driver-location/UNKNOWN/').status_code, 404)
+
+    def test_prune_drops_old_days(self):
+        now = timezone.now()
+        for days in (0, 10, 40):
+            recorded_at = now - timedelta(days=days)
+            DriverLocation.objects.create(
+                driver=self.driver, day=timezone.localtime(recorded_at).date(), recorded_at=recorded_at, lat=0, lng=0
+            )
+        call_command('prune_driver_locations', days=30, stdout=StringIO())
+        self.assertEqual(DriverLocation.objects.count(), 2)
+        with self.assertRaises(CommandError):
+            call_command('prune_driver_locations', days=0, stdout=StringIO())
+
+class RouteOptimizationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.driver_user = User.objects.create_user(username='driver', password='driver', role='DRIVER')
+        # Stops due east of the depot, created out of order
+        depot = (settings.DEPOT_LATITUDE, settings.DEPOT_LONGITUDE)
+        cls.destinations = {
+            offset: Destination.objects.create(
+                name=f'Est {offset}', zone='Est', latitude=depot[0], longitude=depot[1] + offset / 10
+            )
+            for offset in (3, 1, 4, 2)
+        }
+        cls.shipments = [
+            create_shipment(cls.refs, number, destination=cls.destinations[offset])
+            for number, offset in enumerate((3, 1, 4, 2, 1), start=1)
+        ]
+        cls.unrouted = create_shipment(cls.refs, 9)
+        cls.tour = Tour.objects.create(driver=cls.refs['driver'], vehicle=cls.refs['vehicle'], date=date(2024, 3, 1))
+        cls.tour.shipments.set(cls.shipments + [cls.unrouted])
+
+    def test_solver(self):
+        # Points on a circle in scrambled order: the circle is the optimum
+        circle = [(36 + math.cos(2 * math.pi * (i * 7 % 30) / 30), 3 + math.sin(2 * math.pi * (i * 7 % 30) / 30)) for i in range(30)]
+        matrix = distance_matrix(circle)
+        route, length = solve_route(matrix)
+        self.assertEqual(sorted(route), list(range(30)))
+        self.assertEqual(route[0], 0)
+        self.assertAlmostEqual(length, route_length(sorted(route, key=lambda node: node * 7 % 30), matrix))
+
+        # Never worse than the construction, and optimal on small instances
+        points = [(36 + (i * 37 % 11) / 10, 3 + (i * 53 % 13) / 10) for i in range(8)]
+        matrix = distance_matrix(points)
+        route, length = solve_route(matrix)
+        optimum = min(route_length([0, *order], matrix) for order in itertools.permutations(range(1, 8)))
+        self.assertAlmostEqual(length, optimum)
+        self.assertLessEqual(length, route_length(nearest_neighbour_route(matrix), matrix))
+
+    def test_optimize_endpoint(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.driver_user)
+        self.assertEqual(self.client.post(f'/api/tours/{self.tour.pk}/optimize/').status_code, 403)
+
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(5):  # tour, stops, savepoint, update, release
+            response = self.client.post(f'/api/tours/{self.tour.pk}/optimize/')
+        self.assertEqual(response.status_code, 200)
+        plan = response.data
+        self.assertIn([stop['destination'] for stop in plan['stops']], [
+            [self.destinations[offset].pk for offset in order] for order in ((1, 2, 3, 4), (4, 3, 2, 1))
+        ])
+        self.assertEqual(plan['zone'], 'Est')
+        self.assertEqual(plan['unrouted'], [self.unrouted.pk])
+        # 0.4 degrees of longitude out and back, times the road factor
+        expected = 2 * 0.4 * 111.2 * math.cos(math.radians(settings.DEPOT_LATITUDE)) * settings.ROUTE_ROAD_FACTOR
+        self.assertAlmostEqual(float(plan['distance_km']), expected, delta=1)
+
+        self.tour.refresh_from_db()
+        self.assertEqual(self.tour.distance_km, plan['distance_km'])
+        self.assertEqual(self.tour.duration_hours, plan['duration_hours'])
+        self.assertEqual(len(self.tour.stop_order), 6)
+        self.assertEqual(self.tour.stop_order[-1], self.unrouted.pk)
+
+    def test_command(self):
+        other = Destination.objects.create(name='Ouest', zone='Ouest', latitude=36.7, longitude=2.5)
+        second = Tour.objects.create(driver=self.refs['driver'], vehicle=self.refs['vehicle'], date=date(2024, 3, 1))
+        second.shipments.set([create_shipment(self.refs, 20, destination=other)])
+        out = StringIO()
+        call_command('optimize_tours', date='2024-03-01', workers=0, dry_run=True, stdout=out)
+        self.assertIn('(Est): 4 stops', out.getvalue())
+        self.assertIn('(Ouest): 1 stops', out.getvalue())
+        self.assertFalse(Tour.objects.exclude(stop_order=[]).exists())
+
+        call_command('optimize_tours', date='2024-03-01', workers=0, stdout=StringIO())
+        self.assertEqual(Tour.objects.exclude(stop_order=[]).count(), 2)
+
+class DistanceMatrixTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.matrix = DistanceMatrix(self.directory)
+        self.alger = Destination.objects.create(name='Alger', latitude=36.7538, longitude=3.0588)
+        self.oran = Destination.objects.create(name='Oran', latitude=35.6971, longitude=-0.6308)
+        self.blida = Destination.objects.create(name='Blida', latitude=36.4700, longitude=2.8277)
+        Destination.objects.create(name='Sans coordonnees')
+
+    def test_haversine(self):
+        self.assertAlmostEqual(haversine_matrix([(36.7538, 3.0588)], [(35.6971, -0.6308)])[0, 0], 353, delta=2)
+        self.assertEqual(haversine_matrix([(36, 3), (36, 3)], [(36, 3)]).tolist(), [[0.0], [0.0]])
+
+    def test_incremental_updates(self):
+        self.assertEqual(self.matrix.update(), (3, 0, 0))
+        self.assertAlmostEqual(self.matrix.distance(self.alger.pk, self.oran.pk), 353, delta=2)
+        self.assertEqual(self.matrix.distance(self.oran.pk, self.alger.pk), self.matrix.distance(self.alger.pk, self.oran.pk))
+        self.assertEqual(self.matrix.distance(self.alger.pk, self.alger.pk), 0)
+
+        # Another process holding the old mapping sees new destinations
+        reader = DistanceMatrix(self.directory)
+        reader.refresh()
+        setif = Destination.objects.create(name='Setif', latitude=36.19, longitude=5.41)
+        self.assertEqual(self.matrix.update(), (1, 0, 0))
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, 'distances.f32')), row_offset(4) * 4)
+        expected = haversine_matrix([(36.19, 5.41)], [(36.7538, 3.0588)])[0, 0]
+        self.assertAlmostEqual(reader.distance(setif.pk, self.alger.pk), expected, places=3)
+
+        Destination.objects.filter(pk=self.blida.pk).update(latitude=self.oran.latitude, longitude=self.oran.longitude)
+        self.oran.delete()
+        self.assertEqual(self.matrix.update(), (0, 1, 1))
+        self.assertIsNone(reader.distance(self.oran.pk, self.alger.pk))
+        self.assertAlmostEqual(reader.distance(self.blida.pk, self.alger.pk), 353, delta=2)
+        self.assertEqual(self.matrix.update(rebuild=True), (0, 0, 0))
+        self.assertAlmostEqual(reader.distance(self.blida.pk, self.alger.pk), 353, delta=2)
+
+    def test_matrix_mixes_stored_and_computed_rows(self):
+        self.matrix.update()
+        # Blida moved since the update: its row must not come from the file
+        Destination.objects.filter(pk=self.blida.pk).update(latitude=36.0)
+        depot = (settings.DEPOT_LATITUDE, settings.DEPOT_LONGITUDE)
+        points = [depot, (36.7538, 3.0588), (35.6971, -0.6308), (36.0, 2.8277), (36.5, 3.5)]
+        ids = [None, self.alger.pk, self.oran.pk, self.blida.pk, None]
+        result = self.matrix.matrix(points, ids)
+        self.assertEqual(result.shape, (5, 5))
+        self.assertTrue((abs(result - haversine_matrix(points, points)) < 1e-3).all())
+        self.assertTrue((result == result.T).all())
+
+class LoadPlanningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.driver_user = User.objects.create_user(username='driver', password='driver', role='DRIVER')
+
+    def assertWithinCapacity(self, loads):
+        for load in loads:
+            _, weight_capacity, volume_capacity = load.vehicle
+            self.assertLessEqual(sum(item[1] for item in load.items), weight_capacity)
+            self.assertLessEqual(sum(item[2] for item in load.items), volume_capacity)
+            self.assertEqual({item[3] for item in load.items}, {load.zone})
+
+    def test_pack(self):
+        vehicles = [(1, 100, math.inf), (2, 100, 10), (3, 50, math.inf)]
+        items = [
+            (10, 60, 1, 'A'), (11, 30, 1, 'A'), (12, 30, 1, 'A'), (13, 20, 12, 'A'),
+            (20, 5, 1, 'B'), (30, 2000, 1, 'C'),
+        ]
+        loads, leftovers = pack(items, vehicles)
+        self.assertWithinCapacity(loads)
+        self.assertEqual(leftovers, [((30, 2000, 1, 'C'), 'too_large')])
+        by_zone = {}
+        for load in loads:
+            by_zone.setdefault(load.zone, []).append(load)
+        # Zone A needs two vehicles of 100 kg; the bulky item cannot go in vehicle 2
+        self.assertEqual(len(by_zone['A']), 2)
+        self.assertEqual(sum(len(load.items) for load in by_zone['A']), 4)
+        self.assertEqual([load.vehicle[0] for load in by_zone['B']], [3])
+
+        # A light load first opens the biggest truck, then moves to the smallest vehicle that carries it
+        loads, _ = pack([(1, 5, 1, 'A')], [(4, 1000, math.inf), (3, 50, math.inf), (5, 20, 0.5)])
+        self.assertEqual([load.vehicle[0] for load in loads], [3])
+
+        loads, leftovers = pack([(1, 10, 1, 'A'), (2, 10, 1, 'B')], [(1, 100, math.inf)])
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(leftovers, [((2, 10, 1, 'B'), 'no_capacity')])
+
+    def test_merges_lightly_loaded_vehicles(self):
+        loads = []
+        for vehicle, items in (((1, 100, 10), [(1, 50, 6, 'A')]), ((2, 100, 10), [(2, 30, 1, 'A'), (3, 10, 3, 'A')]),
+                               ((3, 100, 10), [(4, 60, 2, 'A')])):
+            load = Load(vehicle, 'A')
+            for item in items:
+                load.add(item)
+            loads.append(load)
+        emptied = merge_loads(loads)
+        self.assertEqual([load.vehicle[0] for load in emptied], [2])
+        self.assertEqual(sorted(item[0] for load in loads for item in load.items), [1, 2, 3, 4])
+        self.assertWithinCapacity(loads)
+
+    def test_load_plan_endpoint(self):
+        today = timezone.localdate()
+        small = Vehicle.objects.create(license_plate='654321-16', capacity=100, volume_capacity=5, vehicle_type='Van')
+        busy = Vehicle.objects.create(license_plate='111111-16', capacity=5000, vehicle_type='Camion')
+        Tour.objects.create(driver=self.refs['driver'], vehicle=busy, date=today)
+        shipments = [create_shipment(self.refs, number, weight=Decimal('40.00')) for number in range(1, 5)]
+        Tour.objects.get(vehicle=busy).shipments.add(shipments[3])
+        create_shipment(self.refs, 9, status='DELIVERED')
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.driver_user)
+        self.assertEqual(self.client.get('/api/tours/load-plan/').status_code, 403)
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/tours/load-plan/?date={today}')
+        self.assertEqual(response.status_code, 200)
+        plan = response.data
+        self.assertEqual((plan['shipments'], plan['planned'], plan['vehicles_available'], plan['vehicles_used']), (3, 3, 2, 1))
+        # 120 kg does not fit the van, so the 3500 kg vehicle takes it
+        self.assertEqual(plan['loads'], [{
+            'vehicle': self.refs['vehicle'].pk, 'zone': 'Alger', 'shipments': [shipment.pk for shipment in shipments[:3]],
+            'destinations': [self.refs['destination'].pk],
+            'weight': 120.0, 'volume': 3.0, 'weight_utilization': 3.4, 'volume_utilization': None,
+        }])
+        self.assertEqual(self.client.get('/api/tours/load-plan/?date=x').status_code, 400)
+
+        out = StringIO()
+        call_command('plan_loads', date=today, stdout=out)
+        self.assertIn('Planned 3 of 3 shipments on 1 of 2 vehicles', out.getvalue())
+
+        # 80 kg fits the van, so the load moves down onto it
+        Shipment.objects.filter(pk=shipments[2].pk).update(status='DELIVERED')
+        loads = self.client.get(f'/api/tours/load-plan/?date={today}').data['loads']
+        self.assertEqual([(load['vehicle'], load['weight']) for load in loads], [(small.pk, 80.0)])
+
+class DispatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.driver_user = User.objects.create_user(username='driver', password='driver', role='DRIVER')
+        Driver.objects.filter(user=cls.driver_user).update(status=Driver.Status.OFF_DUTY)
+        cls.east = Destination.objects.create(name='Bejaia', zone='Est', latitude=36.75, longitude=5.06)
+        cls.west = Destination.objects.create(name='Oran', zone='Ouest', latitude=35.70, longitude=-0.63)
+        cls.west_driver = cls.refs['driver']
+        cls.east_driver = Driver.objects.create(name='Samir Haddad', license_number='02123456', phone='0666789013')
+        cls.tired_driver = Driver.objects.create(name='Nadia Bouzid', license_number='03123456', phone='0666789014')
+        now = timezone.now()
+        for driver, (lat, lng) in ((cls.west_driver, (35.6, -0.6)), (cls.east_driver, (36.7, 5.0)), (cls.tired_driver, (36.7, 5.1))):
+            DriverLocation.objects.create(driver=driver, day=timezone.localdate(), recorded_at=now, lat=lat, lng=lng)
+        # The nearest driver to Bejaia has driven a lot lately
+        old_vehicle = Vehicle.objects.create(license_plate='222222-16', capacity=1000, vehicle_type='Fourgon', status='MAINTENANCE')
+        Tour.objects.bulk_create([
+            Tour(driver=cls.tired_driver, vehicle=old_vehicle, date=timezone.localdate() - timedelta(days=days)) for days in (1, 2, 3)
+        ])
+        cls.second_vehicle = Vehicle.objects.create(license_plate='333333-16', capacity=1000, vehicle_type='Fourgon')
+        cls.east_shipments = [create_shipment(cls.refs, number, destination=cls.east, driver=None) for number in range(1, 4)]
+        cls.west_shipments = [create_shipment(cls.refs, number, destination=cls.west, driver=None) for number in range(4, 6)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_min_cost_assignment(self):
+        for rows, columns in ((4, 4), (3, 5), (5, 3)):
+            cost = [[(i * 7 + j * 13) % 11 + (i == j) for j in range(columns)] for i in range(rows)]
+            pairs = min_cost_assignment(cost)
+            self.assertEqual(len(pairs), min(rows, columns))
+            if rows <= columns:
+                best = min(sum(cost[i][p[i]] for i in range(rows)) for p in itertools.permutations(range(columns), rows))
+            else:
+                best = min(sum(cost[p[j]][j] for j in range(columns)) for p in itertools.permutations(range(rows), columns))
+            self.assertEqual(sum(cost[i][j] for i, j in pairs), best)
+        self.assertEqual(min_cost_assignment([]), [])
+
+    def test_dispatch(self):
+        self.client.force_authenticate(user=self.driver_user)
+        self.assertEqual(self.client.post('/api/tours/dispatch/', {}, format='json').status_code, 403)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post('/api/tours/dispatch/', {'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Tour.objects.filter(date=timezone.localdate()).exists())
+        drivers = {tour['zone']: tour['driver'] for tour in response.data['tours']}
+        self.assertEqual(drivers, {'Est': self.east_driver.pk, 'Ouest': self.west_driver.pk})
+
+        caches['tracking'].clear()
+        tracked = f'/api/track/{self.east_shipments[0].tracking_number}/'
+        updated_at = self.client.get(tracked).json()['updated_at']
+        with self.assertNumQueries(13):
+            response = self.client.post('/api/tours/dispatch/', {}, format='json')
+        self.assertNotEqual(self.client.get(tracked).json()['updated_at'], updated_at)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['dispatched'], 5)
+        self.assertEqual(response.data['drivers_available'], 3)
+        for assignment in response.data['tours']:
+            tour = Tour.objects.get(pk=assignment['tour'])
+            self.assertEqual(sorted(tour.shipments.values_list('id', flat=True)), assignment['shipments'])
+            self.assertEqual(set(Shipment.objects.filter(id__in=assignment['shipments']).values_list('driver_id', flat=True)),
+                             {assignment['driver']})
+        self.assertEqual(
+            set(Vehicle.objects.filter(tour__date=timezone.localdate()).values_list('status', flat=True)), {'IN_USE'}
+        )
+
+        # Everything is on a tour now, and both vehicles are taken
+        out = StringIO()
+        call_command('dispatch_tours', stdout=out)
+        self.assertIn('Dispatched 0 of 0 shipments on 0 tours', out.getvalue())
+
+class TrackingPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.refs = create_reference_data()
+        cls.user = User.objects.create_user(username='agent', password='agent', role='AGENT')
+        cls.shipment = create_shipment(cls.refs, 1)
+        ShipmentStatusHistory.objects.create(shipment=cls.shipment, status=Shipment.Status.PENDING)
+
+    def setUp(self):
+        caches['tracking'].clear()
+        self.client = APIClient()
+        self.url = f'/api/track/{self.shipment.tracking_number}/'
+
+    def test_page_is_served_from_the_cache(self):
+        with self.assertNumQueries(2):  # shipment, then its history on a cache miss
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(page['status'], 'PENDING')
+        self.assertEqual(page['destination'], self.refs['destination'].name)
+        self.assertEqual([entry['status'] for entry in page['history']], ['PENDING'])
+        self.assertNotIn('client', page)
+        self.assertNotIn('calculated_cost', page)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).json(), page)
+
+        # Unknown numbers are looked up every time
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get('/api/track/UNKNOWN/').status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_status_changes_drop_the_page(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(user=self.user)
+        self.client.patch(f'/api/shipments/{self.shipment.pk}/', {'status': 'IN_TRANSIT'}, format='json')
+        page = self.client.get(self.url).json()
+        self.assertEqual(page['status'], 'IN_TRANSIT')
+        self.assertEqual([entry['status'] for entry in page['history']], ['IN_TRANSIT', 'PENDING'])
+
+    def test_repricing_drops_the_page(self):
+        updated_at = self.client.get(self.url).json()['updated_at']
+        Shipment.objects.filter(pk=self.shipment.pk).update(calculated_cost=Decimal('1.00'))
+        reprice_shipments()
+        self.assertNotEqual(self.client.get(self.url).json()['updated_at'], updated_at)
+
+    @override_settings(STATUS_HISTORY_COALESCE_INTERVAL=60)
+    def test_coalesced_history_drops_the_page_when_written(self):
+        writer = StatusHistoryWriter(60)
+        with mock.patch('logistics.history._writer', writer), mock.patch.object(writer, 'start'):
+            self.client.force_authenticate(user=self.user)
+            self.client.patch(f'/api/shipments/{self.shipment.pk}/', {'status': 'IN_TRANSIT'}, format='json')
+            self.assertEqual(len(self.client.get(self.url).json()['history']), 1)
+            writer.flush()
+        self.assertEqual(len(self.client.get(self.url).json()['history']), 2)
+
+        self.shipment.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shipments_save_without_the_tracking_cache(self):
+        self.shipment.status = Shipment.Status.IN_TRANSIT
+        self.shipment.save()
+        ShipmentStatusHistory.objects.create(shipment=self.shipment, status=Shipment.Status.IN_TRANSIT)
@@ -0,0 +1,200 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Driver, DriverLocation, Shipment, ShipmentStatusHistory, tracking_page_key
+
+POSITION_FIELDS = ('recorded_at', 'lat', 'lng', 'speed', 'heading')
+
+def position_key(driver_id):
+    return f'driver-position:{driver_id}'
+
+def parse_timestamp(value):
+    """ISO 8601 string (naive means the server time zone) or Unix seconds"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if isinstance(value, str):
+        try:
+            moment = parse_datetime(value)
+        except ValueError:
+            return None
+        if moment is not None and timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+    return None
+
+def parse_coordinate(value, limit):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) and -limit <= value <= limit else None
+
+def parse_fix(item, driver_id, latest_allowed):
+    """
+    Check one fix without going through a serializer (this runs thousands of
+    times a second). Returns (DriverLocation, None) or (None, errors).
+    """
+    if not isinstance(item, dict):
+        return None, {'non_field_errors': ['Expected an object']}
+    errors = {}
+    if driver_id is None:
+        driver_id = item.get('driver')
+        if isinstance(driver_id, bool) or not isinstance(driver_id, int):
+            errors['driver'] = ['A driver id is required']
+    recorded_at = parse_timestamp(item.get('recorded_at'))
+    if recorded_at is None:
+        errors['recorded_at'] = ['Expected an ISO 8601 datetime or Unix seconds']
+    elif recorded_at > latest_allowed:
+        errors['recorded_at'] = ['Fix is stamped in the future']
+    lat = parse_coordinate(item.get('lat'), 90)
+    if lat is None:
+        errors['lat'] = ['Expected a latitude between -90 and 90']
+    lng = parse_coordinate(item.get('lng'), 180)
+    if lng is None:
+        errors['lng'] = ['Expected a longitude between -180 and 180']
+    extra = {}
+    for field, limit in (('speed', 1000), ('heading', 359)):
+        value = item.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= limit:
+            errors[field] = [f'Expected a number between 0 and {limit}']
+        else:
+            extra[field] = round(value)
+    if errors:
+        return None, errors
+    return DriverLocation(
+        driver_id=driver_id, day=timezone.localtime(recorded_at).date(),
+        recorded_at=recorded_at, lat=lat, lng=lng, **extra,
+    ), None
+
+def ingest_fixes(items, driver=None):
+    """
+    Store a batch of GPS fixes and move each driver's cached last position
+    forward. With `driver` every fix belongs to that driver, otherwise each
+    item names its driver (a gateway reporting for a fleet).
+
+    Items that fail validation are reported by position and the rest are
+    stored. Driver ids are checked with one query and the rows inserted with
+    one bulk_create; fixes are never updated, late ones only land in the track.
+
+    Returns (number stored, {index: errors}).
+    """
+    latest_allowed = timezone.now() + timedelta(seconds=settings.DRIVER_LOCATION_MAX_CLOCK_SKEW)
+    driver_id = driver.pk if driver is not None else None
+    errors = {}
+    valid = {}
+    for index, item in enumerate(items):
+        fix, item_errors = parse_fix(item, driver_id, latest_allowed)
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            valid[index] = fix
+
+    if driver_id is None:
+        existing = set(Driver.objects.filter(
+            id__in={fix.driver_id for fix in valid.values()}
+        ).values_list('id', flat=True))
+        for index, fix in list(valid.items()):
+            if fix.driver_id not in existing:
+                errors[index] = {'driver': [f'Invalid pk "{fix.driver_id}" - object does not exist.']}
+                del valid[index]
+
+    fixes = list(valid.values())
+    if fixes:
+        with transaction.atomic():
+            DriverLocation.objects.bulk_create(fixes, batch_size=1000)
+        update_positions(fixes)
+    return len(fixes), errors
+
+def update_positions(fixes):
+    """
+    Move cached positions forward to the newest of `fixes` per driver. Drivers
+    with nothing cached are left to latest_position, which reads the table and
+    so cannot be fooled by a batch that arrives late.
+    """
+    newest = {}
+    for fix in fixes:
+        current = newest.get(fix.driver_id)
+        if current is None or fix.recorded_at > current.recorded_at:
+            newest[fix.driver_id] = fix
+    cache = caches['positions']
+    keys = {position_key(driver_id): fix for driver_id, fix in newest.items()}
+    cached = cache.get_many(keys)
+    cache.set_many({
+        key: {field: getattr(fix, field) for field in POSITION_FIELDS}
+        for key, fix in keys.items()
+        if key in cached and cached[key]['recorded_at'] < fix.recorded_at
+    })
+
+def latest_position(driver_id):
+    """
+    Last reported position of a driver as a dict of POSITION_FIELDS, or None.
+    Served from the positions cache; a miss reads the newest row of the
+    driver's track through driverlocation_track_idx and caches it.
+    """
+    cache = caches['positions']
+    key = position_key(driver_id)
+    position = cache.get(key)
+    if position is None:
+        position = (
+            DriverLocation.objects.filter(driver_id=driver_id)
+            .order_by('-recorded_at').values(*POSITION_FIELDS).first()
+        )
+        if position is not None:
+            cache.add(key, position)
+    return position
+
+TRACKING_PAGE_FIELDS = (
+    'id', 'tracking_number', 'status', 'date', 'updated_at', 'destination__name',
+    'service_type__name', 'is_international', 'destination_country',
+)
+
+def tracking_page(tracking_number):
+    """
+    Public view of a shipment for customers following it, as JSON bytes, or
+    None for an unknown tracking number. No client, driver or price details.
+
+    Served from the tracking cache; a miss reads the shipment on its unique
+    index and its history on status_history_timeline_idx, then caches the
+    encoded page. Saves of the shipment or its history drop the page (see
+    forget_tracking_pages). Unknown numbers are not cached, since shipments
+    inserted with bulk_create send no signal to drop them.
+    """
+    cache = caches['tracking']
+    key = tracking_page_key(tracking_number)
+    page = cache.get(key)
+    if page is None:
+        shipment = Shipment.objects.filter(tracking_number=tracking_number).values(*TRACKING_PAGE_FIELDS).first()
+        if shipment is None:
+            return None
+        history = ShipmentStatusHistory.objects.filter(shipment_id=shipment['id']).order_by('-timestamp').values(
+            'status', 'timestamp'
+        )
+        page = json.dumps({
+            'tracking_number': shipment['tracking_number'],
+            'status': shipment['status'],
+            'status_display': str(Shipment.Status(shipment['status']).label),
+            'date': shipment['date'],
+            'updated_at': shipment['updated_at'],
+            'destination': shipment['destination__name'],
+            'service_type': shipment['service_type__name'],
+            'is_international': shipment['is_international'],
+            'destination_country': shipment['destination_country'],
+            'history': list(history),
+        }, cls=DjangoJSONEncoder).encode()
+        cache.add(key, page)
+    return page
@@ -3,8 +3,8 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, ClientViewSet, DriverViewSet, VehicleViewSet, 
     DestinationViewSet, ServiceTypeViewSet, PricingRuleViewSet, 
-    ShipmentViewSet, TourViewSet, InvoiceViewSet, IncidentViewSet,
-    driver_location
+    ShipmentViewSet, TourViewSet, InvoiceViewSet, IncidentViewSet, DocumentJobViewSet,
+    driver_location, track_shipment, dashboard_summary
 )
 
 router = DefaultRouter()
@@ -19,8 +19,11 @@ router.register(r'shipments', ShipmentViewSet, basename='shipment')
 router.register(r'tours', TourViewSet)
 router.register(r'invoices', InvoiceViewSet)
 router.register(r'incidents', IncidentViewSet)
+router.register(r'document-jobs', DocumentJobViewSet, basename='document-job')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('driver-location/<str:tracking_number>/', driver_location, name='driver_location'),
+    path('track/<str:tracking_number>/', track_shipment, name='track_shipment'),
+    path('dashboard/summary/', dashboard_summary, name='dashboard_summary'),
 ]
@@ -1,20 +1,54 @@
-from rest_framework import viewsets
+from rest_framework import viewsets, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from django.http import HttpResponse
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncMonth
+from django.http import HttpResponse, FileResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+from django.utils.http import parse_etags
+from django.conf import settings
+from django.utils import timezone
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import Sum, Count, Q, Prefetch
 from django.contrib.auth.hashers import check_password
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from .models import User, Client, Driver, Vehicle, Destination, ServiceType, PricingRule, Shipment, Tour, Invoice, Incident
+from .models import User, Client, Driver, Vehicle, Destination, ServiceType, PricingRule, Shipment, ShipmentStatusHistory, Tour, Invoice, Incident, DocumentJob
 from .serializers import (
     UserSerializer, ClientSerializer, DriverSerializer, VehicleSerializer, 
     DestinationSerializer, ServiceTypeSerializer, PricingRuleSerializer, 
-    ShipmentSerializer, TourSerializer, InvoiceSerializer, IncidentSerializer
+    ShipmentSerializer, ShipmentListSerializer, TourSerializer, InvoiceSerializer, IncidentSerializer,
+    DocumentJobSerializer, BillingRunSerializer, LoadPlanSerializer, DispatchSerializer, requested_fields
 )
-from .permissions import IsAdminOrReadOnly, IsAdminOrAgentOrReadOnly, CanManageShipments
+from .permissions import IsAdminOrReadOnly, IsAdminOrAgentOrReadOnly, IsAdminOrManager, CanManageShipments, CanDispatch
+from .pagination import DateIdCursorPagination, CreatedAtCursorPagination
+from .parsers import NDJSONParser
+from .intake import bulk_create_shipments
+from .tracking import ingest_fixes, latest_position, tracking_page
+from .routing import plan_routes, save_plans
+from .loading import plan_loads
+from .dispatching import dispatch
+from .billing import run_billing
+from .jobs import enqueue_jobs
+from .analytics import monthly_stats
+from .exports import ExportMixin
+from .routers import reading_from_replica
+from .documents import (
+    SLIP_VALUES, SLIPS_PER_SHEET, slip_etag, cached_slip, slip_batch,
+    invoice_etag, cached_invoice
+)
+
+class ReplicaReadMixin:
+    """
+    Serve the read-only actions of a viewset from the read replica. Everything
+    else, including reads made while handling a write, stays on the primary.
+    """
+    replica_actions = ('list', 'retrieve', 'stats', 'export')
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        with reading_from_replica(action in self.replica_actions):
+            return super().dispatch(request, *args, **kwargs)
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -106,6 +140,34 @@ class DriverViewSet(viewsets.ModelViewSet):
             )
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated],
+            parser_classes=[JSONParser, NDJSONParser])
+    def locations(self, request):
+        """
+        Store a batch of GPS fixes from a JSON array or an NDJSON body. A driver
+        reports their own fixes; other staff name the driver on every item.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a JSON array or NDJSON body'}, status=400)
+        if len(items) > settings.DRIVER_LOCATION_BATCH_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {settings.DRIVER_LOCATION_BATCH_MAX_ITEMS} fixes per request'},
+                status=400
+            )
+
+        driver = None
+        if request.user.role == 'DRIVER':
+            driver = Driver.objects.filter(user=request.user).first()
+            if driver is None:
+                return Response({'error': 'No driver profile for this account'}, status=400)
+
+        stored, errors = ingest_fixes(items, driver)
+        return Response({
+            'stored': stored,
+            'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+        }, status=201 if stored or not items else 400)
+
 class VehicleViewSet(viewsets.ModelViewSet):
     queryset = Vehicle.objects.all()
     serializer_class = VehicleSerializer
@@ -126,16 +188,43 @@ class PricingRuleViewSet(viewsets.ModelViewSet):
     serializer_class = PricingRuleSerializer
     permission_classes = [IsAuthenticated, IsAdminOrReadOnly]
 
-class ShipmentViewSet(viewsets.ModelViewSet):
+class ShipmentViewSet(ReplicaReadMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = ShipmentSerializer
+    pagination_class = DateIdCursorPagination
     filterset_fields = ['tracking_number', 'status', 'client']
+    export_filename = 'shipments'
+    export_fields = (
+        'id', 'tracking_number', 'client__name', 'destination__name', 'service_type__name',
+        'driver__name', 'weight', 'volume', 'date', 'status', 'calculated_cost',
+        'is_international', 'destination_country', 'customs_value',
+    )
+
+    def get_serializer_class(self):
+        # Lists use the compact row unless the client picks its own ?fields=
+        if self.action == 'list' and 'fields' not in self.request.query_params:
+            return ShipmentListSerializer
+        return ShipmentSerializer
+
+    def wants_status_history(self):
+        if self.action == 'list':
+            return 'status_history' in (
+                requested_fields(self.request, 'expand') | requested_fields(self.request, 'fields')
+            )
+        # Only actions rendering the full record need the history
+        return self.action in ('retrieve', 'create', 'update', 'partial_update')
 
     def get_queryset(self):
         user = self.request.user
+        # Load everything the serializer reads up front instead of once per row
+        queryset = Shipment.objects.select_related('client', 'destination', 'service_type', 'driver')
+        if self.wants_status_history():
+            queryset = queryset.prefetch_related(
+                Prefetch('status_history', queryset=ShipmentStatusHistory.objects.order_by('-timestamp'))
+            )
         if user.is_authenticated and user.role == 'DRIVER':
             # Drivers only see their assigned shipments
-            return Shipment.objects.filter(driver__user=user)
-        return Shipment.objects.all()
+            return queryset.filter(driver__user=user)
+        return queryset
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -144,109 +233,323 @@ class ShipmentViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         return [IsAuthenticated(), CanManageShipments()]
 
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many shipments at once from a JSON array or an NDJSON body.
+        Invalid items are reported by position and do not stop the others.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a JSON array or NDJSON body'}, status=400)
+        if len(items) > settings.SHIPMENT_BULK_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {settings.SHIPMENT_BULK_MAX_ITEMS} shipments per request'},
+                status=400
+            )
+
+        try:
+            created, errors = bulk_create_shipments(items)
+        except IntegrityError:
+            # Another request took one of the tracking numbers since we checked
+            return Response({'error': 'Tracking number conflict, please retry'}, status=409)
+
+        return Response({
+            'created': [
+                {'index': index, 'id': shipment.id, 'tracking_number': shipment.tracking_number,
+                 'calculated_cost': shipment.calculated_cost}
+                for index, shipment in created
+            ],
+            'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+        }, status=201 if created or not items else 400)
+
     @action(detail=True, methods=['get'])
     def slip(self, request, pk=None):
-        shipment = self.get_object()
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="shipment_{shipment.tracking_number}.pdf"'
-        
-        p = canvas.Canvas(response, pagesize=letter)
-        p.drawString(100, 750, f"Shipment Slip: {shipment.tracking_number}")
-        p.drawString(100, 730, f"Client: {shipment.client.name}")
-        p.drawString(100, 710, f"Destination: {shipment.destination.name}")
-        p.drawString(100, 690, f"Service: {shipment.service_type.name}")
-        p.drawString(100, 670, f"Weight: {shipment.weight} kg")
-        p.drawString(100, 650, f"Volume: {shipment.volume} m3")
-        p.drawString(100, 630, f"Status: {shipment.status}")
-        p.showPage()
-        p.save()
+        values = get_object_or_404(self.get_queryset().values(*SLIP_VALUES), pk=pk)
+        etag = f'"{slip_etag(values)}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        response = HttpResponse(cached_slip(values, etag.strip('"')), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="shipment_{values["tracking_number"]}.pdf"'
+        response['ETag'] = etag
         return response
 
     @action(detail=False, methods=['get'])
-    def stats(self, request):
-        # Shipment Status Distribution
-        status_counts = Shipment.objects.values('status').annotate(count=Count('status'))
-        
-        # Revenue per Month (based on Invoices for simplicity, or Shipments)
-        # Using Shipments calculated_cost for revenue estimation
-        revenue_per_month = Shipment.objects.annotate(month=TruncMonth('date')).values('month').annotate(revenue=Sum('calculated_cost')).order_by('month')
-        
-        # Incidents per Month
-        incidents_per_month = Incident.objects.annotate(month=TruncMonth('date')).values('month').annotate(count=Count('id')).order_by('month')
+    def slips(self, request):
+        """
+        All slips for a selection in one PDF: ?ids=1,2,3, ?tour=<id> or the
+        list filters. ?layout=sheet stacks several slips per page. Batches above
+        SLIP_BATCH_QUEUE_THRESHOLD are queued as a document job (202).
+        """
+        layout = request.query_params.get('layout', 'page')
+        if layout not in ('page', 'sheet'):
+            return Response({'error': 'layout must be page or sheet'}, status=400)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            if 'ids' in request.query_params:
+                ids = [int(pk) for pk in request.query_params['ids'].split(',') if pk.strip()]
+                queryset = queryset.filter(id__in=ids)
+            if 'tour' in request.query_params:
+                queryset = queryset.filter(tours=int(request.query_params['tour']))
+        except ValueError:
+            return Response({'error': 'ids and tour must be integers'}, status=400)
+
+        limit = settings.SLIP_BATCH_MAX_ITEMS
+        rows = list(queryset.order_by('id').values(*SLIP_VALUES)[:limit + 1])
+        if not rows:
+            return Response({'error': 'No shipments selected'}, status=404)
+        if len(rows) > limit:
+            return Response({'error': f'At most {limit} slips per batch'}, status=400)
+
+        if len(rows) > settings.SLIP_BATCH_QUEUE_THRESHOLD:
+            # Large print runs go to the document worker instead of holding this request
+            job, = enqueue_jobs(
+                DocumentJob.Kind.SLIP_BATCH, [{'ids': [row['id'] for row in rows], 'layout': layout}],
+                requested_by=request.user,
+            )
+            return Response(DocumentJobSerializer(job, context={'request': request}).data, status=202)
 
-        return Response({
-            "status_distribution": status_counts,
-            "revenue_over_time": revenue_per_month,
-            "incidents_over_time": incidents_per_month
-        })
+        per_page = SLIPS_PER_SHEET if layout == 'sheet' else 1
+        return FileResponse(
+            slip_batch(rows, per_page), as_attachment=True,
+            filename='shipment_slips.pdf', content_type='application/pdf'
+        )
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        # Status distribution, revenue and incidents per month, from the monthly rollup tables
+        return Response(monthly_stats())
 
-class TourViewSet(viewsets.ModelViewSet):
-    queryset = Tour.objects.all()
+class TourViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    queryset = Tour.objects.select_related('driver', 'vehicle').prefetch_related(
+        Prefetch('shipments', queryset=Shipment.objects.only('id'))
+    )
     serializer_class = TourSerializer
+    pagination_class = DateIdCursorPagination
 
-class InvoiceViewSet(viewsets.ModelViewSet):
-    queryset = Invoice.objects.all()
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'optimize':
+            # The planner reads the stops itself
+            return queryset.prefetch_related(None)
+        return queryset
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, CanManageShipments])
+    def optimize(self, request, pk=None):
+        """
+        Order the tour's stops into a short route from the depot and back, and
+        store the order with the estimated distance and duration.
+        """
+        tour = self.get_object()
+        plans = plan_routes([tour.pk])
+        save_plans(plans)
+        return Response(plans[tour.pk])
+
+    @action(detail=False, methods=['get'], url_path='load-plan', permission_classes=[IsAuthenticated, CanDispatch])
+    def load_plan(self, request):
+        """
+        Proposed vehicle loads for the pending shipments of ?date= (today by
+        default) with the utilization of each vehicle. Nothing is saved.
+        """
+        serializer = LoadPlanSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(plan_loads(serializer.validated_data.get('date') or timezone.localdate()))
+
+    @action(detail=False, methods=['post'], url_path='dispatch', permission_classes=[IsAuthenticated, CanDispatch])
+    def auto_dispatch(self, request):
+        """
+        Create the tours of a day from the load plan, with a driver matched to
+        every vehicle load. With dry_run the assignment is only reported.
+        """
+        serializer = DispatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dry_run = serializer.validated_data['dry_run']
+        report = dispatch(serializer.validated_data.get('date') or timezone.localdate(), dry_run=dry_run)
+        return Response(report, status=200 if dry_run else 201)
+
+class InvoiceViewSet(ReplicaReadMixin, ExportMixin, viewsets.ModelViewSet):
+    queryset = Invoice.objects.select_related('client').prefetch_related(
+        Prefetch('shipments', queryset=Shipment.objects.only('id'))
+    )
     serializer_class = InvoiceSerializer
+    pagination_class = DateIdCursorPagination
+    # ?shipments=<id> finds the invoice of a shipment without paging through every invoice;
+    # ?status__in=UNPAID,PARTIAL lists what is still owed
+    filterset_fields = {'shipments': ['exact'], 'status': ['exact', 'in']}
+    export_filename = 'invoices'
+    export_fields = ('id', 'client__name', 'date', 'amount_ht', 'tva', 'amount_ttc', 'paid_amount', 'status')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'pdf':
+            # The PDF reads its shipment lines in chunks, not through the prefetch
+            return queryset.prefetch_related(None)
+        return queryset
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             return [AllowAny()]
+        if self.action == 'billing_run':
+            return [IsAuthenticated(), IsAdminOrManager()]
         return [IsAuthenticated()]
 
+    @action(detail=False, methods=['post'], url_path='billing-run')
+    def billing_run(self, request):
+        """
+        Invoice every uninvoiced shipment of a period, one invoice per client.
+        With dry_run the counts and amounts are reported and nothing is written.
+        """
+        serializer = BillingRunSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        report = run_billing(**serializer.validated_data)
+        return Response(report, status=200 if serializer.validated_data['dry_run'] else 201)
+
     @action(detail=True, methods=['get'], permission_classes=[AllowAny])
     def pdf(self, request, pk=None):
         invoice = self.get_object()
-        response = HttpResponse(content_type='application/pdf')
+        etag = f'"{invoice_etag(invoice)}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        response = HttpResponse(cached_invoice(invoice, etag.strip('"')), content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.id}.pdf"'
-        
-        p = canvas.Canvas(response, pagesize=letter)
-        p.drawString(100, 750, f"INVOICE #{invoice.id}")
-        p.drawString(100, 730, f"Client: {invoice.client.name}")
-        p.drawString(100, 710, f"Date: {invoice.date}")
-        p.drawString(100, 680, "Shipments:")
-        y = 660
-        for shipment in invoice.shipments.all():
-            p.drawString(120, y, f"- {shipment.tracking_number}: ${shipment.calculated_cost}")
-            y -= 20
-        
-        p.drawString(100, y-20, f"Total HT: ${invoice.amount_ht}")
-        p.drawString(100, y-40, f"TVA (19%): ${invoice.tva}")
-        p.drawString(100, y-60, f"Total TTC: ${invoice.amount_ttc}")
-        p.showPage()
-        p.save()
+        response['ETag'] = etag
         return response
 
-class IncidentViewSet(viewsets.ModelViewSet):
+class IncidentViewSet(ReplicaReadMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Incident.objects.all()
     serializer_class = IncidentSerializer
+    pagination_class = DateIdCursorPagination
+    filterset_fields = ['status']
+    export_filename = 'incidents'
+    export_fields = ('id', 'shipment__tracking_number', 'description', 'date', 'status')
+
+class DocumentJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                         mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Queue a PDF render with POST, then poll the job and fetch the file from
+    /download/ once it is DONE. Jobs are rendered by manage.py run_document_worker.
+    """
+    serializer_class = DocumentJobSerializer
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        # The rendered PDF is only read by download
+        queryset = DocumentJob.objects.defer('result')
+        if self.request.user.role != 'ADMIN':
+            queryset = queryset.filter(requested_by=self.request.user)
+        return queryset
+
+    def get_permissions(self):
+        return [IsAuthenticated(), CanManageShipments()]
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if response.status_code == 201:
+            response.status_code = 202
+        return response
+
+    def perform_create(self, serializer):
+        serializer.save(requested_by=self.request.user, max_attempts=settings.DOCUMENT_JOB_MAX_ATTEMPTS)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != DocumentJob.Status.DONE:
+            return Response({'error': 'Document is not ready', 'status': job.status}, status=409)
+        response = HttpResponse(bytes(job.result), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{job.result_name}"'
+        return response
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
-import random
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def driver_location(request, tracking_number):
     """
-    Return simulated driver location for a shipment.
-    In production, this would fetch real-time location from a driver mobile app.
+    Last position reported by the driver of a shipment that is on its way.
+    One lookup on the unique tracking number index, then the driver's
+    position from the positions cache (see logistics.tracking).
     """
-    try:
-        shipment = Shipment.objects.get(tracking_number=tracking_number)
-        # Only show driver location if shipment is in transit or out for delivery
-        if shipment.status not in ['IN_TRANSIT', 'OUT_FOR_DELIVERY']:
-            return Response({'location': None})
-        
-        # Simulated location around Algiers (36.7538, 3.0588)
-        # In production, fetch from driver's device GPS
-        location = {
-            'lat': 36.7538 + random.uniform(-0.1, 0.1),
-            'lng': 3.0588 + random.uniform(-0.1, 0.1),
-            'timestamp': shipment.updated_at,
-            'driver_name': shipment.driver.name if shipment.driver else None,
-            'driver_phone': shipment.driver.phone if shipment.driver else None,
-        }
-        return Response({'location': location})
-    except Shipment.DoesNotExist:
+    shipment = (
+        Shipment.objects.filter(tracking_number=tracking_number)
+        .values('status', 'driver_id', 'driver__name', 'driver__phone')
+        .first()
+    )
+    if shipment is None:
         return Response({'error': 'Shipment not found'}, status=404)
+    # Only show driver location if shipment is in transit or out for delivery
+    if shipment['status'] not in ['IN_TRANSIT', 'OUT_FOR_DELIVERY'] or shipment['driver_id'] is None:
+        return Response({'location': None})
+
+    position = latest_position(shipment['driver_id'])
+    if position is None:
+        return Response({'location': None})
+    location = {
+        'lat': position['lat'],
+        'lng': position['lng'],
+        'timestamp': position['recorded_at'],
+        'speed': position['speed'],
+        'heading': position['heading'],
+        'driver_name': shipment['driver__name'],
+        'driver_phone': shipment['driver__phone'],
+    }
+    return Response({'location': location})
+
+
+@require_GET
+def track_shipment(request, tracking_number):
+    """
+    Public tracking page of a shipment (see logistics.tracking.tracking_page).
+    A plain Django view: the page is public and already encoded in the cache,
+    so DRF's authentication, content negotiation and rendering are skipped.
+    """
+    page = tracking_page(tracking_number)
+    if page is None:
+        return JsonResponse({'error': 'Shipment not found'}, status=404)
+    return HttpResponse(page, content_type='application/json')
+
+
+ACTIVE_SHIPMENT_STATUSES = ['IN_TRANSIT', 'SORTING_CENTER', 'OUT_FOR_DELIVERY']
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dashboard_summary(request):
+    """
+    Return the dashboard KPIs computed with one aggregate query per table.
+    Results are cached for a few seconds so a busy dashboard does not hit the database on every refresh.
+    """
+    user = request.user
+    shipments = Shipment.objects.all()
+    cache_key = 'dashboard_summary'
+    if user.role == 'DRIVER':
+        # Drivers only see their assigned shipments
+        shipments = shipments.filter(driver__user=user)
+        cache_key = f'dashboard_summary:driver:{user.id}'
+
+    summary = cache.get(cache_key)
+    if summary is None:
+        shipment_counts = shipments.aggregate(
+            total_shipments=Count('id'),
+            active_deliveries=Count('id', filter=Q(status__in=ACTIVE_SHIPMENT_STATUSES)),
+            pending_count=Count('id', filter=Q(status='PENDING')),
+            in_transit_count=Count('id', filter=Q(status='IN_TRANSIT')),
+        )
+        open_incidents = Incident.objects.aggregate(count=Count('id', filter=Q(status='OPEN')))['count']
+        revenue = Invoice.objects.aggregate(total=Sum('amount_ttc'))['total'] or 0
+
+        summary = {
+            **shipment_counts,
+            'open_incidents': open_incidents,
+            'revenue': f"{revenue:.2f}",
+        }
+        cache.set(cache_key, summary, settings.DASHBOARD_SUMMARY_CACHE_TIMEOUT)
 
+    return Response(summary)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -102,12 +103,163 @@ WSGI_APPLICATION = 'transport_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL when POSTGRES_DB is set in the environment, SQLite otherwise
+# (local development and the test suite without a database server).
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Seconds a connection is kept open between requests
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('DB_POOL_MAX_SIZE'):
+        # psycopg 3 connection pool; it replaces persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+        }}
+    if os.environ.get('POSTGRES_REPLICA_HOST'):
+        # Read-only standby used by logistics.routers.ReadReplicaRouter
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ['POSTGRES_REPLICA_HOST'],
+            'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
+
+# Opt-in SQLite tuning for small single-server deployments (SQLITE_PERFORMANCE_MODE=1, true, yes or on):
+# WAL lets readers run alongside the writer, IMMEDIATE transactions take the write
+# lock up front and wait up to `timeout` seconds for it instead of failing with
+# "database is locked", and the page cache and memory map are enlarged.
+SQLITE_PERFORMANCE_OPTIONS = {
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA cache_size=-65536;'  # 64 MB
+        'PRAGMA mmap_size=268435456;'  # 256 MB
+        'PRAGMA temp_store=MEMORY;'
+    ),
 }
+SQLITE_PERFORMANCE_MODE = os.environ.get('SQLITE_PERFORMANCE_MODE', '').strip().lower() in {'1', 'true', 'yes', 'on'}
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3' and SQLITE_PERFORMANCE_MODE:
+    DATABASES['default']['OPTIONS'] = SQLITE_PERFORMANCE_OPTIONS
+
+DATABASE_ROUTERS = ['logistics.routers.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'transport-system',
+    },
+    # Rendered PDFs (shipment slips), shared by every worker on the host and culled past MAX_ENTRIES
+    'documents': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'document_cache',
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Last reported position per driver (logistics.tracking). Per process here, so with
+    # several server processes point it at a shared cache (Redis, Memcached): until then
+    # a process can serve a position up to TIMEOUT seconds old
+    'positions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'driver-positions',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Encoded public tracking pages (logistics.tracking.tracking_page), least recently
+    # used culled first. Saves drop pages in the process that makes them, so with several
+    # server processes point it at a shared cache: until then a page can be TIMEOUT seconds old
+    'tracking': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tracking-pages',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+}
+
+# Seconds the dashboard KPIs are served from cache before being recomputed
+DASHBOARD_SUMMARY_CACHE_TIMEOUT = 30
+
+# Seconds before the in-process pricing rule table (logistics.models.pricing_rule_index)
+# is reloaded even without a PricingRule save/delete signal in this process
+PRICING_RULE_INDEX_TTL = 300
+
+# Largest batch accepted by POST /api/shipments/bulk/
+SHIPMENT_BULK_MAX_ITEMS = 5000
+
+# Slip batches (GET /api/shipments/slips/): largest batch accepted, and the size
+# above which the batch is queued for manage.py run_document_worker instead of
+# being rendered while the request waits
+SLIP_BATCH_MAX_ITEMS = 5000
+SLIP_BATCH_QUEUE_THRESHOLD = 300
+
+# Document job queue (manage.py run_document_worker): attempts before a job is
+# marked failed, first retry delay in seconds (doubled per attempt) and how long
+# a job may stay RUNNING before it is treated as abandoned by a dead worker
+DOCUMENT_JOB_MAX_ATTEMPTS = 3
+DOCUMENT_JOB_RETRY_DELAY = 30
+DOCUMENT_JOB_STALE_AFTER = 600
+# Seconds between the worker's sweeps for abandoned jobs, and days a finished or
+# failed job (and its PDF) is kept before manage.py prune_document_jobs deletes it
+DOCUMENT_JOB_SWEEP_INTERVAL = 60
+DOCUMENT_JOB_RETENTION_DAYS = 7
+
+# Seconds status history rows are buffered and then inserted together
+# (logistics.history); 0 writes each row with its status change
+STATUS_HISTORY_COALESCE_INTERVAL = float(os.environ.get('STATUS_HISTORY_COALESCE_INTERVAL', '0'))
+
+# GPS fixes (POST /api/drivers/locations/): largest batch accepted, how far ahead of
+# the server clock a fix may be stamped, and days kept by manage.py prune_driver_locations
+DRIVER_LOCATION_BATCH_MAX_ITEMS = 5000
+DRIVER_LOCATION_MAX_CLOCK_SKEW = 300
+DRIVER_LOCATION_RETENTION_DAYS = 30
+
+# Route planning (logistics.routing): where every tour starts and ends, the factor
+# from straight-line to road distance, average speed, time spent at each stop and
+# the worker processes that solve the zones of a day in parallel
+DEPOT_LATITUDE = 36.7538
+DEPOT_LONGITUDE = 3.0588
+ROUTE_ROAD_FACTOR = 1.3
+ROUTE_AVERAGE_SPEED_KMH = 40
+ROUTE_STOP_MINUTES = 10
+ROUTE_OPTIMIZER_WORKERS = 2
+
+# Memory-mapped distances between geocoded destinations (logistics.distances),
+# extended by manage.py update_distance_matrix
+DISTANCE_MATRIX_DIR = BASE_DIR / 'distance_matrix'
+
+# Dispatcher (logistics.dispatching): km of extra distance that one tour driven in the
+# last DISPATCH_BALANCE_DAYS days is worth when matching drivers to vehicle loads
+DISPATCH_BALANCE_KM = 25
+DISPATCH_BALANCE_DAYS = 7
 
 
 # Password validation
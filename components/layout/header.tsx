@@ -47,10 +47,11 @@ export function Header() {
 
   async function fetchNotifications() {
     try {
+      // Only the newest row of each kind is shown, so ask for just that
       const [shipments, incidents, invoices] = await Promise.all([
-        shipmentsApi.getAll(),
-        incidentsApi.getAll(),
-        invoicesApi.getAll()
+        shipmentsApi.getRecent(1),
+        incidentsApi.getRecent(1, '?status=OPEN'),
+        invoicesApi.getRecent(1, '?status=UNPAID')
       ])
 
       const notifs: any[] = []
@@ -0,0 +1,18 @@
+"use client"
+
+// Fetches the next page of a usePages list; hidden once the last page is in
+export default function LoadMoreButton({ hasMore, loading, onClick }: { hasMore: boolean, loading: boolean, onClick: () => void }) {
+  if (!hasMore) return null
+
+  return (
+    <div className="flex justify-center">
+      <button
+        onClick={onClick}
+        disabled={loading}
+        className="px-6 py-2 border border-border rounded-lg text-foreground font-medium hover:bg-accent transition-colors disabled:opacity-50"
+      >
+        {loading ? "Loading..." : "Load more"}
+      </button>
+    </div>
+  )
+}
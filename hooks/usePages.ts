@@ -0,0 +1,36 @@
+import { useState, useEffect, useRef } from 'react'
+
+// Page through a paginated list (e.g. shipmentsApi.getPages()) one page at a
+// time: the first page loads on mount, the next one on each loadMore()
+export function usePages<T = any>(openPages: () => AsyncGenerator<T[]>) {
+  const pages = useRef<AsyncGenerator<T[]> | null>(null)
+  const [items, setItems] = useState<T[]>([])
+  const [loading, setLoading] = useState(true)
+  const [hasMore, setHasMore] = useState(false)
+
+  useEffect(() => {
+    pages.current = openPages()
+    setItems([])
+    loadMore()
+  }, [])
+
+  async function loadMore() {
+    const current = pages.current
+    if (!current) return
+    setLoading(true)
+    try {
+      const { value, done } = await current.next()
+      // The effect ran again (React strict mode) and opened a new generator meanwhile
+      if (current !== pages.current) return
+      if (!done) setItems(previous => [...previous, ...value])
+      // The generator only reports done on the call after its last page
+      setHasMore(!done)
+    } catch (error) {
+      console.error('Failed to fetch page:', error)
+    } finally {
+      setLoading(false)
+    }
+  }
+
+  return { items, setItems, loading, hasMore, loadMore }
+}
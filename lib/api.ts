@@ -2,7 +2,8 @@ const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api';
 
 // Generic fetch function
 async function apiFetch(endpoint: string, options: RequestInit = {}) {
-  const url = `${API_URL}${endpoint}`;
+  // Pagination `next` links come back from the API as absolute URLs
+  const url = endpoint.startsWith('http') ? endpoint : `${API_URL}${endpoint}`;
   const token = typeof window !== 'undefined' ? localStorage.getItem('access_token') : null;
   
   const response = await fetch(url, {
@@ -28,10 +29,51 @@ async function apiFetch(endpoint: string, options: RequestInit = {}) {
   return response.json();
 }
 
+// Paginated list endpoints (shipments, invoices, incidents, tours) return
+// { next, first, results } pages ordered newest first. Yields one page at a time.
+export async function* apiFetchPages(endpoint: string, options: RequestInit = {}) {
+  let page = await apiFetch(endpoint, options);
+  yield page.results;
+  while (page.next) {
+    page = await apiFetch(page.next, options);
+    yield page.results;
+  }
+}
+
+// Largest page the list endpoints serve (DateIdCursorPagination.max_page_size)
+const MAX_PAGE_SIZE = 500;
+
+function withPageSize(endpoint: string, pageSize: number) {
+  return `${endpoint}${endpoint.includes('?') ? '&' : '?'}page_size=${pageSize}`;
+}
+
+// The newest `limit` rows of a paginated list endpoint, in one request
+async function apiFetchRecent(endpoint: string, limit: number) {
+  const page = await apiFetch(withPageSize(endpoint, Math.min(limit, MAX_PAGE_SIZE)));
+  return page.results;
+}
+
+// Collect every page of a paginated list endpoint into one array. Only for
+// pickers that must offer every row; list screens page with getPages instead.
+async function apiFetchAll(endpoint: string, options: RequestInit = {}) {
+  const results: any[] = [];
+  for await (const page of apiFetchPages(withPageSize(endpoint, MAX_PAGE_SIZE), options)) {
+    results.push(...page);
+  }
+  return results;
+}
+
 // Shipments API
 export const shipmentsApi = {
-  getAll: () => apiFetch('/shipments/'),
+  getAll: () => apiFetchAll('/shipments/'),
+  getPages: (pageSize = 50) => apiFetchPages(withPageSize('/shipments/', pageSize)),
+  getRecent: (limit: number, query = '') => apiFetchRecent(`/shipments/${query}`, limit),
   getById: (id: number) => apiFetch(`/shipments/${id}/`),
+  // List rows are compact; fetch the full record (customs fields, status history) by id
+  getByTrackingNumber: async (trackingNumber: string) => {
+    const page = await apiFetch(`/shipments/?tracking_number=${encodeURIComponent(trackingNumber)}&fields=id`);
+    return page.results.length ? apiFetch(`/shipments/${page.results[0].id}/`) : null;
+  },
   create: (data: any) => apiFetch('/shipments/', {
     method: 'POST',
     body: JSON.stringify(data),
@@ -112,8 +154,15 @@ export const serviceTypesApi = {
 
 // Invoices API
 export const invoicesApi = {
-  getAll: () => apiFetch('/invoices/'),
+  getAll: () => apiFetchAll('/invoices/'),
+  getPages: (pageSize = 50) => apiFetchPages(withPageSize('/invoices/', pageSize)),
+  getRecent: (limit: number, query = '') => apiFetchRecent(`/invoices/${query}`, limit),
   getById: (id: number) => apiFetch(`/invoices/${id}/`),
+  // A shipment is billed on at most one invoice
+  getByShipment: async (shipmentId: number) => {
+    const page = await apiFetch(`/invoices/?shipments=${shipmentId}`);
+    return page.results[0] || null;
+  },
   create: (data: any) => apiFetch('/invoices/', {
     method: 'POST',
     body: JSON.stringify(data),
@@ -126,7 +175,10 @@ export const invoicesApi = {
 
 // Incidents API
 export const incidentsApi = {
-  getAll: () => apiFetch('/incidents/'),
+  getAll: () => apiFetchAll('/incidents/'),
+  getPages: (pageSize = 50) => apiFetchPages(withPageSize('/incidents/', pageSize)),
+  getRecent: (limit: number, query = '') => apiFetchRecent(`/incidents/${query}`, limit),
+  getById: (id: number) => apiFetch(`/incidents/${id}/`),
   create: (data: any) => apiFetch('/incidents/', {
     method: 'POST',
     body: JSON.stringify(data),
@@ -140,27 +192,15 @@ export const incidentsApi = {
 // Dashboard Stats API
 export const dashboardApi = {
   getStats: async () => {
-    const [shipments, incidents, invoices] = await Promise.all([
-      shipmentsApi.getAll(),
-      incidentsApi.getAll(),
-      invoicesApi.getAll(),
-    ]);
-    
-    const activeStatuses = ['IN_TRANSIT', 'SORTING_CENTER', 'OUT_FOR_DELIVERY'];
-    const activeDeliveries = shipments.filter((s: any) => activeStatuses.includes(s.status));
-    const pendingShipments = shipments.filter((s: any) => s.status === 'PENDING');
-    const inTransitShipments = shipments.filter((s: any) => s.status === 'IN_TRANSIT');
-    const openIncidents = incidents.filter((i: any) => i.status === 'OPEN');
-    
-    const totalRevenue = invoices.reduce((sum: number, inv: any) => sum + parseFloat(inv.amount_ttc || 0), 0);
-    
+    const summary = await apiFetch('/dashboard/summary/');
+
     return {
-      totalShipments: shipments.length,
-      activeDeliveries: activeDeliveries.length,
-      incidents: openIncidents.length,
-      revenue: totalRevenue.toFixed(2),
-      pendingCount: pendingShipments.length,
-      inTransitCount: inTransitShipments.length,
+      totalShipments: summary.total_shipments,
+      activeDeliveries: summary.active_deliveries,
+      incidents: summary.open_incidents,
+      revenue: summary.revenue,
+      pendingCount: summary.pending_count,
+      inTransitCount: summary.in_transit_count,
     };
   },
 };
@@ -176,7 +216,8 @@ export const userApi = {
 
 // Tours API
 export const toursApi = {
-  getAll: () => apiFetch('/tours/'),
+  getAll: () => apiFetchAll('/tours/'),
+  getPages: (pageSize = 50) => apiFetchPages(withPageSize('/tours/', pageSize)),
   getById: (id: number) => apiFetch(`/tours/${id}/`),
   create: (data: any) => apiFetch('/tours/', {
     method: 'POST',